@@ -1,15 +1,148 @@
+import asyncio
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
 import openai
 from loguru import logger
+from circuit_breaker import CircuitBreaker
 from config import *
+from embedding_cache import get_embedding_cache
+from file_processor_helper import FileProcessorHelper
+from rate_limiter import PRIORITY_INTERACTIVE, estimate_chat_tokens, is_retryable, request, request_async
+from usage import AsyncTrackedStream, TrackedStream, UsageTracker
+
+
+# HTTP/2 需要可选依赖 h2（pip install httpx[http2]），未安装时使用 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_shared_instance = None
+_shared_async_instance = None
+_shared_lock = threading.Lock()
+
+
+def is_openai_failure(error):
+    """
+    断路器是否计入失败：请求调度重试用尽后仍失败的连接错误、超时和 5xx 计入。
+    429 是限流而不是故障，由 rate_limiter 退避处理，不计入，避免一个模型或批量入库的限流断开所有请求；
+    400/401 等调用方错误说明接口正常响应，也不计入。
+    """
+    if getattr(error, "status_code", None) == 429:
+        return False
+    return is_retryable(error)
+
+
+# 所有 OpenAI 请求共用一个断路器
+openai_breaker = CircuitBreaker("OpenAI", is_failure=is_openai_failure)
+
+
+def operation_timeout(read_timeout):
+    # 每种操作的读超时不同，连接超时共用 OPENAI_CONNECT_TIMEOUT
+    return httpx.Timeout(read_timeout, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def _http_client_kwargs():
+    return dict(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        http2=OPENAI_HTTP2 and HTTP2_AVAILABLE,
+        timeout=operation_timeout(OPENAI_CHAT_TIMEOUT),
+    )
+
+
+def create_http_client():
+    """
+    创建带连接池的 httpx 客户端，长连接在多次请求之间复用，省去重复的 TCP/TLS 握手。
+    """
+    return httpx.Client(**_http_client_kwargs())
+
+
+def create_async_http_client():
+    # 与 create_http_client 相同的连接池配置，供 AsyncOpenAI 使用
+    return httpx.AsyncClient(**_http_client_kwargs())
+
+
+def normalize_messages(messages):
+    # 字符串转换为单条用户消息；类型不对时返回 None
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    if isinstance(messages, list):
+        return messages
+    return None
+
+
+def completion_request_options(stream):
+    # 流式输出时请求接口在最后一个 chunk 返回 usage；openai SDK 当前版本没有 stream_options 参数，经 extra_body 传递
+    options = {"timeout": operation_timeout(OPENAI_STREAM_TIMEOUT if stream else OPENAI_CHAT_TIMEOUT)}
+    if stream and OPENAI_STREAM_INCLUDE_USAGE:
+        options["extra_body"] = {"stream_options": {"include_usage": True}}
+    return options
+
+
+def record_response_usage(response, model, operation):
+    # 非流式响应直接带有 usage
+    tracker = UsageTracker(model, operation)
+    tracker.observe_usage(response.usage)
+    return tracker.finish()
+
+
+def split_cached_embeddings(texts, cached):
+    """
+    :param cached: embedding 缓存命中的结果 {输入下标: 向量}
+    :return: (未命中的输入下标, 去重后的未命中文本)
+    """
+    missing = [i for i in range(len(texts)) if i not in cached]
+    # 同一批输入里重复的文本只请求一次
+    missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+    return missing, missing_texts
+
+
+def merge_embeddings(texts, cached, missing, missing_texts, missing_embeddings):
+    # 按输入顺序拼接缓存命中的向量和新请求到的向量
+    embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+    for i, vector in cached.items():
+        embeddings[i] = vector
+    if missing:
+        positions = {text: j for j, text in enumerate(missing_texts)}
+        embeddings[missing] = missing_embeddings[[positions[texts[i]] for i in missing]]
+    logger.debug(f"embedding 缓存 | inputs: {len(texts)} hits: {len(cached)} misses: {len(missing)}")
+    return embeddings
+
+
+def parse_embedding_response(response):
+    # 按 index 排序，保证与输入顺序一致
+    data = sorted(response.data, key=lambda item: item.index)
+    return np.array([item.embedding for item in data], dtype=np.float32)
 
 
 class AssistantGPT:
-    def __init__(self, api_key=OPENAI_API_KEY):
+    def __init__(self, api_key=OPENAI_API_KEY, http_client=None):
         """
         初始化
         :param api_key: 设置 OpenAI API 密钥
+        :param http_client: 自定义的 httpx.Client，默认按 config 创建带连接池的客户端
         """
-        self.client = openai.OpenAI(api_key=api_key)
+        # 重试由 rate_limiter 负责（限流、退避和 Retry-After），关闭 SDK 自带的重试
+        self.client = openai.OpenAI(api_key=api_key, http_client=http_client or create_http_client(), max_retries=0)
+
+    @classmethod
+    def shared(cls):
+        """
+        进程内共享的实例，首次使用时创建。openai 客户端是线程安全的，
+        Gradio 的各个工作线程和 embedding 线程池共用同一个连接池。
+        """
+        global _shared_instance
+        if _shared_instance is None:
+            with _shared_lock:
+                if _shared_instance is None:
+                    _shared_instance = cls()
+                    logger.info(f"创建共享的 OpenAI 客户端，HTTP/2：{OPENAI_HTTP2 and HTTP2_AVAILABLE}")
+        return _shared_instance
 
     def get_completion(
             self,
@@ -18,6 +151,7 @@ class AssistantGPT:
             max_tokens=2000,
             temperature=0.7,
             stream=False,
+            prompt_tokens=None,
     ):
         """
         Creates a model response for the given chat conversation.
@@ -31,55 +165,248 @@ class AssistantGPT:
         :param temperature: 使用什么采样温度，介于 0 和 2 之间。
         较高的值（如 0.8）将使输出更加随机，而较低的值（如 0.2）将使其更具集中性和确定性。
         :param stream: 是否流式输出。
+        :param prompt_tokens: 调用方估算的 prompt token 数（整数或无参函数）；接口不返回 usage 时用于用量记录，
+        为整数时同时用于限流估算，不再重新编码 messages。
         :return: chat completion object（聊天完成对象），
-        如果请求是流式处理的，则返回chat completion chunk（聊天完成区块对象）的流序列。
+        如果请求是流式处理的，则返回chat completion chunk（聊天完成区块对象）的流序列（TrackedStream），
+        迭代结束后 usage 属性是本次调用的用量记录。
         """
-        if isinstance(messages, str):
-            messages = [{"role": "user", "content": messages}]
-        elif not isinstance(messages, list):
+        messages = normalize_messages(messages)
+        if messages is None:
             return "无效的 'messages' 类型。它应该是一个字符串或消息列表。"
 
-        response = self.client.chat.completions.create(
-            messages=messages,
-            model=model,
-            max_tokens=max_tokens,
-            stream=stream,
-            temperature=temperature,
+        tracker = UsageTracker(model, "chat", stream, prompt_tokens)
+        # 经过断路器和请求调度发送：按估算的 token 数限流，可重试的错误退避重试；通过原始响应读取限流头
+        response = openai_breaker.call(
+            request,
+            lambda: self.client.chat.completions.with_raw_response.create(
+                messages=messages,
+                model=model,
+                max_tokens=max_tokens,
+                stream=stream,
+                temperature=temperature,
+                **completion_request_options(stream),
+            ),
+            model,
+            lambda: estimate_chat_tokens(messages, model, max_tokens, prompt_tokens),
         )
 
         if stream:
             # 流式输出
-            return response
+            return TrackedStream(response, tracker)
 
         # 非流式输出
         # logger.success(f"response_content: {response.choices[0].message.content}")
-        logger.success(f"非流式输出 | total_tokens: {response.usage.total_tokens} "
-                       f"= prompt_tokens:{response.usage.prompt_tokens}"
-                       f"+ completion_tokens: {response.usage.completion_tokens}")
+        tracker.observe_usage(response.usage)
+        tracker.finish()
         return response.choices[0].message.content
 
-    def get_embeddings(self, input):
+    def get_embeddings(self, input, model=EMBEDDING_MODEL, priority=PRIORITY_INTERACTIVE):
         """
         Creates an embedding vector representing the input text.
         创建表示输入文本的嵌入向量。
 
         API官方文档：https://platform.openai.com/docs/api-reference/embeddings/create
 
-        :param input: 输入要嵌入的文本，编码为字符串或标记数组。若要在单个请求中嵌入多个输入，请传递字符串数组或令牌数组数组。
-        输入不得超过模型的最大输入标记数（8192 text-embedding-ada-002 个标记），不能为空字符串，任何数组的维数必须小于或等于 2048。
-        :return: 嵌入对象的列表。
+        先查询持久化 embedding 缓存（EMBEDDING_CACHE_ENABLED），只对未命中的文本发起请求。
+        未命中的输入按条数（EMBEDDING_BATCH_SIZE）和 token 预算（EMBEDDING_BATCH_MAX_TOKENS）切成多个批次，
+        通过有界线程池（EMBEDDING_MAX_WORKERS）并发请求，每个批次经过请求调度限流，失败时只重试失败的批次。
+
+        :param input: 输入要嵌入的文本，字符串或字符串列表。单条输入不得超过模型的最大输入标记数（8192 text-embedding-ada-002 个标记），不能为空字符串。
+        :param model: embedding 模型。
+        :param priority: 请求优先级，文件入库等批量任务使用 PRIORITY_BULK，为交互式对话让出限额。
+        :return: float32 的 NumPy 矩阵，形状为 (len(input), EMBEDDING_DIMENSION)，行顺序与输入一致。
         """
-        response = self.client.embeddings.create(
-            input=input,
-            model='text-embedding-ada-002',
+        texts = [input] if isinstance(input, str) else list(input)
+        if not texts or not EMBEDDING_CACHE_ENABLED:
+            return self._get_embeddings_uncached(texts, model, priority)
+
+        cache = get_embedding_cache()
+        cached = cache.get_many(model, texts)
+        missing, missing_texts = split_cached_embeddings(texts, cached)
+        missing_embeddings = None
+        if missing:
+            missing_embeddings = self._get_embeddings_uncached(missing_texts, model, priority)
+            cache.put_many(model, missing_texts, missing_embeddings)
+        return merge_embeddings(texts, cached, missing, missing_texts, missing_embeddings)
+
+    def _get_embeddings_uncached(self, texts, model, priority=PRIORITY_INTERACTIVE):
+        if not texts:
+            return np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+
+        batches = self._build_embedding_batches(texts, model)
+        embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+        if len(batches) == 1:
+            start, batch_texts, batch_tokens = batches[0]
+            embeddings[start:start + len(batch_texts)] = self._embed_batch(batch_texts, model, batch_tokens, priority)
+            return embeddings
+
+        with ThreadPoolExecutor(max_workers=min(EMBEDDING_MAX_WORKERS, len(batches))) as executor:
+            futures = [
+                (start, len(batch_texts),
+                 executor.submit(self._embed_batch, batch_texts, model, batch_tokens, priority))
+                for start, batch_texts, batch_tokens in batches
+            ]
+            for start, count, future in futures:
+                embeddings[start:start + count] = future.result()
+        logger.debug(f"get_embeddings | inputs: {len(texts)} batches: {len(batches)}")
+        return embeddings
+
+    @staticmethod
+    def _build_embedding_batches(texts, model):
+        """
+        按条数和 token 预算把输入切成批次。
+        :return: [(批次在输入中的起始下标, 批次文本列表, 批次的 token 数), ...]
+        """
+        token_counts = FileProcessorHelper.count_tokens(texts, model)
+        batches = []
+        start, batch_tokens = 0, 0
+        for i, token_count in enumerate(token_counts):
+            if i > start and (i - start >= EMBEDDING_BATCH_SIZE
+                              or batch_tokens + token_count > EMBEDDING_BATCH_MAX_TOKENS):
+                batches.append((start, texts[start:i], batch_tokens))
+                start, batch_tokens = i, 0
+            batch_tokens += token_count
+        batches.append((start, texts[start:], batch_tokens))
+        return batches
+
+    def _embed_batch(self, texts, model, tokens, priority=PRIORITY_INTERACTIVE):
+        # 单个批次的请求，由请求调度限流，失败时只重试该批次
+        response = openai_breaker.call(
+            request,
+            lambda: self.client.embeddings.with_raw_response.create(
+                input=texts,
+                model=model,
+                timeout=operation_timeout(OPENAI_EMBEDDING_TIMEOUT),
+            ),
+            model,
+            tokens,
+            priority,
         )
-        embeddings = [data.embedding for data in response.data]
+        record_response_usage(response, model, "embedding")
+        return parse_embedding_response(response)
+
+
+class AsyncAssistantGPT:
+    """
+    AssistantGPT 的异步版本，基于 openai.AsyncOpenAI。等待模型响应时不占用线程，
+    流式输出以异步迭代器返回，适合在 Gradio 的事件循环中同时服务大量对话。
+    """
+
+    def __init__(self, api_key=OPENAI_API_KEY, http_client=None):
+        """
+        初始化
+        :param api_key: 设置 OpenAI API 密钥
+        :param http_client: 自定义的 httpx.AsyncClient，默认按 config 创建带连接池的客户端
+        """
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key, http_client=http_client or create_async_http_client(), max_retries=0)
+        self._embedding_semaphore = None
+
+    @classmethod
+    def shared(cls):
+        """
+        进程内共享的实例，首次使用时创建。异步客户端的连接绑定在创建它的事件循环上，
+        只应在 Gradio 的事件循环中使用。
+        """
+        global _shared_async_instance
+        if _shared_async_instance is None:
+            with _shared_lock:
+                if _shared_async_instance is None:
+                    _shared_async_instance = cls()
+        return _shared_async_instance
+
+    async def get_completion(
+            self,
+            messages,
+            model=DEFAULT_MODEL,
+            max_tokens=2000,
+            temperature=0.7,
+            stream=False,
+            prompt_tokens=None,
+    ):
+        """
+        参数与 AssistantGPT.get_completion 相同。
+        :return: 回复内容；流式输出时返回 chat completion chunk 的异步迭代器（AsyncTrackedStream）。
+        """
+        messages = normalize_messages(messages)
+        if messages is None:
+            return "无效的 'messages' 类型。它应该是一个字符串或消息列表。"
+
+        tracker = UsageTracker(model, "chat", stream, prompt_tokens)
+        response = await openai_breaker.call_async(
+            request_async,
+            lambda: self.client.chat.completions.with_raw_response.create(
+                messages=messages,
+                model=model,
+                max_tokens=max_tokens,
+                stream=stream,
+                temperature=temperature,
+                **completion_request_options(stream),
+            ),
+            model,
+            lambda: estimate_chat_tokens(messages, model, max_tokens, prompt_tokens),
+        )
+
+        if stream:
+            return AsyncTrackedStream(response, tracker)
+
+        tracker.observe_usage(response.usage)
+        tracker.finish()
+        return response.choices[0].message.content
+
+    async def get_embeddings(self, input, model=EMBEDDING_MODEL, priority=PRIORITY_INTERACTIVE):
+        """
+        参数与返回值同 AssistantGPT.get_embeddings。SQLite 缓存的读写放到线程中执行，不阻塞事件循环。
+        """
+        texts = [input] if isinstance(input, str) else list(input)
+        if not texts or not EMBEDDING_CACHE_ENABLED:
+            return await self._get_embeddings_uncached(texts, model, priority)
+
+        cache = get_embedding_cache()
+        cached = await asyncio.to_thread(cache.get_many, model, texts)
+        missing, missing_texts = split_cached_embeddings(texts, cached)
+        missing_embeddings = None
+        if missing:
+            missing_embeddings = await self._get_embeddings_uncached(missing_texts, model, priority)
+            await asyncio.to_thread(cache.put_many, model, missing_texts, missing_embeddings)
+        return merge_embeddings(texts, cached, missing, missing_texts, missing_embeddings)
+
+    async def _get_embeddings_uncached(self, texts, model, priority=PRIORITY_INTERACTIVE):
+        if not texts:
+            return np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+
+        if self._embedding_semaphore is None:
+            self._embedding_semaphore = asyncio.Semaphore(EMBEDDING_MAX_WORKERS)
+        batches = AssistantGPT._build_embedding_batches(texts, model)
+        results = await asyncio.gather(*(
+            self._embed_batch(batch_texts, model, batch_tokens, priority) for _, batch_texts, batch_tokens in batches))
+        embeddings = np.empty((len(texts), EMBEDDING_DIMENSION), dtype=np.float32)
+        for (start, batch_texts, _), batch_embeddings in zip(batches, results):
+            embeddings[start:start + len(batch_texts)] = batch_embeddings
         return embeddings
 
+    async def _embed_batch(self, texts, model, tokens, priority=PRIORITY_INTERACTIVE):
+        # 单个批次的请求，失败时只重试该批次；同时在途的批次数不超过 EMBEDDING_MAX_WORKERS
+        async with self._embedding_semaphore:
+            response = await openai_breaker.call_async(
+                request_async,
+                lambda: self.client.embeddings.with_raw_response.create(
+                    input=texts,
+                    model=model,
+                    timeout=operation_timeout(OPENAI_EMBEDDING_TIMEOUT),
+                ),
+                model,
+                tokens,
+                priority,
+            )
+            record_response_usage(response, model, "embedding")
+            return parse_embedding_response(response)
+
 
 if __name__ == "__main__":
     # 测试
-    gpt = AssistantGPT()
+    gpt = AssistantGPT.shared()
 
     # # prompt
     # prompt = '你好'
@@ -93,7 +420,7 @@ if __name__ == "__main__":
     # response = gpt.get_completion(messages, temperature=1)
     # print(response)
 
-    # 计算流式输出的 tokens
+    # 流式输出，结束后 bot_response.usage 是本次调用的用量记录（同时交给 usage 模块注册的 sink）
     prompt = '你好'
     bot_response = gpt.get_completion(prompt, stream=True)
     completion = ""
@@ -103,20 +430,14 @@ if __name__ == "__main__":
             completion += character_content
             # print(character_content)
             # print(completion)
-        else:
-            from file_processor_helper import FileProcessorHelper
-            prompt_tokens = FileProcessorHelper.tiktoken_len(prompt)
-            completion_tokens = FileProcessorHelper.tiktoken_len(completion)
-            total_tokens = prompt_tokens + completion_tokens
-            logger.success(f"流式输出 | bot_response: {completion}")
-            logger.success(f"流式输出 | total_tokens: {total_tokens} "
-                           f"= prompt_tokens:{prompt_tokens} + completion_tokens: {completion_tokens}")
+    logger.success(f"流式输出 | bot_response: {completion}")
+    logger.success(f"流式输出 | usage: {bot_response.usage}")
 
     # vectors = gpt.get_embeddings("input text")
-    # print(len(vectors), len(vectors[0]))
-    # # 1 1536
+    # print(vectors.shape, vectors.dtype)
+    # # (1, 1536) float32
     #
     # vectors = gpt.get_embeddings(["input text 1", "input text 2"])
-    # print(len(vectors), len(vectors[0]))
-    # # 2 1536
+    # print(vectors.shape, vectors.dtype)
+    # # (2, 1536) float32
 
@@ -1,16 +1,32 @@
-import sys
+import time
 
 import gradio as gr
 import pandas as pd
 
-from AssistantGPT import AssistantGPT
-from config import DEFAULT_MODEL, MODEL_TO_MAX_TOKENS, MODELS, DEFAULT_MAX_TOKENS
+from AssistantGPT import AsyncAssistantGPT
+from circuit_breaker import CircuitOpenError, DependencyUnavailable
+from config import (CHAT_CONCURRENCY_LIMIT, DEFAULT_MODEL, MESSAGE_OVERHEAD_TOKENS, MODEL_TO_MAX_TOKENS, MODELS,
+                    DEFAULT_MAX_TOKENS)
+from context_packer import PromptBudgetError, prompt_token_budget
+from conversation import ConversationState
+from db_qdrant import check_health
 from file_processor_helper import FileProcessorHelper
+from log_config import log_payload, setup_logging, truncate
 from loguru import logger
-from utils import build_chat_document_prompt, upload_files
+import tracing
+from stream_buffer import STALLED, StreamBuffer, iter_stream
+from utils import build_chat_document_prompt_async, upload_files
 
-logger.remove()  # 删去import logger之后自动产生的handler，不删除的话会出现重复输出的现象
-logger.add(sys.stderr, level="DEBUG")  # 调整日志输出级别: INFO|DEBUG|TRACE
+# 日志级别由环境变量 LOG_LEVEL 配置: TRACE|DEBUG|INFO，写入由后台线程完成
+setup_logging()
+
+# 启动时预加载各模型的 tokenizer，避免首个请求承担加载开销
+FileProcessorHelper.preload_encodings()
+# 启动时创建共享的 Qdrant 客户端并检查连通性；失败时仍可进行不带文档的普通对话
+check_health()
+# 分阶段耗时统计：TRACING_ENABLED 打开时在单独端口暴露 /metrics，并按配置导出到 OpenTelemetry
+tracing.setup_opentelemetry()
+tracing.start_metrics_server()
 
 
 def fn_update_max_tokens(model, origin_set_tokens):
@@ -43,7 +59,9 @@ def fn_update_max_tokens(model, origin_set_tokens):
 
 def fn_prehandle_user_input(user_input, chat_history):
 
-    logger.info(f"组件输入 | user_input: {user_input} chat_history: {chat_history}")
+    logger.opt(lazy=True).info("组件输入 | user_input: {} chat_history: {} 轮",
+                               lambda: truncate(user_input), lambda: len(chat_history or []))
+    log_payload("TRACE", "chat_history", lambda: chat_history)
 
     # 初始化
     chat_history = [] if not chat_history else chat_history
@@ -60,49 +78,60 @@ def fn_prehandle_user_input(user_input, chat_history):
     return chat_history
 
 
-def fn_chat(
+def build_chat_messages(conversation, user_input, model, max_tokens):
+    """
+    普通问答（以及文档问答降级时）的 messages：会话状态中缓存的历史 messages，按模型预算截取最近的若干轮。
+
+    :return: (messages, 估算的 prompt token 数)
+    """
+    user_tokens = FileProcessorHelper.tiktoken_len(user_input, model) + MESSAGE_OVERHEAD_TOKENS
+    messages, history_tokens = conversation.history_messages(prompt_token_budget(model, max_tokens) - user_tokens)
+    messages.append({"role": "user", "content": user_input})
+    return messages, history_tokens + user_tokens
+
+
+async def fn_chat(
         chat_mode,
         uploaded_file_paths_df,
+        uploaded_documents,
         user_input,
         chat_history,
+        conversation,
         model,
         max_tokens,
         temperature,
         stream,
         top_n
 ):
+    start = time.perf_counter()
 
-    # 如果用户输入为空，则返回当前的聊天历史
+    # 如果用户输入为空，则返回当前的聊天历史（异步生成器不能 return 值，先 yield 再返回）
     if not user_input:
-        return chat_history
+        yield chat_history, conversation
+        return
+
+    # 会话状态：逐轮保存对话和 token 数，首次对话时创建；与 Chatbot 对齐只处理新增的轮次
+    if conversation is None:
+        conversation = ConversationState(model)
+    conversation.sync(chat_history, model)
 
     # 获取已上传的文件路径列表
     uploaded_file_paths = uploaded_file_paths_df['已上传的文件'].values.tolist()
 
     # 打印日志，记录输入参数信息
-    logger.info(f"\n"
-                f"问答模式: {chat_mode} \n"
-                f"文件路径: {uploaded_file_paths} {type(uploaded_file_paths)} \n"
-                f"用户输入: {user_input} \n"
-                f"历史记录: {chat_history} \n"
-                f"使用模型: {model} {type(model)}\n"
-                f"要生成的最大token数: {max_tokens} {type(max_tokens)}\n"
-                f"温度: {temperature} {type(temperature)}\n"
-                f"是否流式输出: {stream} {type(stream)}\n"
-                f"top_n: {top_n} {type(top_n)}")
+    # 级别未开启时不格式化；用户输入和文件列表截断后记录
+    logger.opt(lazy=True).info(
+        "\n问答模式: {} \n文件路径: {} \n用户输入: {} \n历史记录: {} 轮，窗口内 {} 轮 {} tokens \n"
+        "使用模型: {}\n要生成的最大token数: {}\n温度: {}\n是否流式输出: {}\ntop_n: {}",
+        lambda: chat_mode, lambda: truncate(uploaded_file_paths), lambda: truncate(user_input),
+        lambda: conversation.total_turns, lambda: len(conversation.turns), lambda: conversation.window_tokens,
+        lambda: model, lambda: max_tokens, lambda: temperature, lambda: stream, lambda: top_n)
 
     # 构建 messages 参数
     messages = []
+    prompt_tokens = 0
     if chat_mode == "普通问答":
-        # 普通问答
-        messages = user_input  # or [{"role": "user", "content": user_input}]
-        if len(chat_history) > 1:
-            messages = []
-            for chat in chat_history:
-                if chat[0] is not None:
-                    messages.append({"role": "user", "content": chat[0]})
-                if chat[1] is not None:
-                    messages.append({"role": "assistant", "content": chat[1]})
+        messages, prompt_tokens = build_chat_messages(conversation, user_input, model, max_tokens)
     else:
         # 文档问答
 
@@ -111,13 +140,30 @@ def fn_chat(
         # 如果 uploaded_file_paths 不是列表，或者是空列表，或者包含空字符串，则抛出错误
         if not isinstance(uploaded_file_paths, list) or not uploaded_file_paths or '' in uploaded_file_paths:
             gr.Warning("未上传文件")
-            return chat_history
-
-        user_prompt = build_chat_document_prompt(
-            uploaded_file_paths, user_input, chat_history, top_n)
+            yield chat_history, conversation
+            return
+
+        # 优先使用上传时保存的文档句柄，避免每轮问答重新读取和哈希文件
+        documents = uploaded_documents if uploaded_documents else uploaded_file_paths
+        try:
+            user_prompt, prompt_tokens = await build_chat_document_prompt_async(
+                documents, user_input, chat_history, top_n, model, max_tokens, conversation)
+        except DependencyUnavailable as e:
+            # 降级：Qdrant 或 embedding 接口不可用时按普通问答回答；断路器断开后不再等待连接超时
+            logger.warning(f"文档问答降级为普通问答 | {e}")
+            gr.Warning(f"{e.name} 暂时不可用，本次回答未使用文档内容")
+            user_prompt = None
+            messages, prompt_tokens = build_chat_messages(conversation, user_input, model, max_tokens)
+        except PromptBudgetError as e:
+            # 不发送没有文档内容的 prompt，提示用户调小 max_tokens
+            gr.Warning(f"{e}，请调小要生成的最大token数")
+            yield chat_history, conversation
+            return
         if user_prompt:
             messages.append({"role": "user", "content": user_prompt})
-        else:
+            # 打包时已经统计了模板、文档内容和对话历史的 token 数，限流和用量估算直接使用，不再编码 prompt
+            prompt_tokens += MESSAGE_OVERHEAD_TOKENS
+        elif user_prompt is not None:
             logger.error("生成 user_prompt 失败")
             messages = []
 
@@ -125,55 +171,71 @@ def fn_chat(
     if not messages:
         logger.error(f"messages为空列表")
         gr.Warning("服务器错误")
-        return chat_history
+        yield chat_history, conversation
+        return
     else:
         # 打印 messages 参数
-        logger.trace(f"messages: {messages}")
+        log_payload("TRACE", "messages", lambda: messages)
 
         # messages有值，生成回复
-        gpt = AssistantGPT()
-        bot_response = gpt.get_completion(
-            messages, model, max_tokens, temperature, stream)
+        # 异步请求：等待模型响应时让出事件循环，不占用 Gradio 的工作线程
+        gpt = AsyncAssistantGPT.shared()
+        try:
+            bot_response = await gpt.get_completion(
+                messages, model, max_tokens, temperature, stream, prompt_tokens=prompt_tokens)
+        except CircuitOpenError as e:
+            logger.warning(f"模型接口断路器已断开 | {e}")
+            gr.Warning("模型服务暂时不可用，请稍后再试")
+            yield chat_history, conversation
+            return
         if stream:
-            # 流式输出
+            # 流式输出：增量先进入缓冲区，按 STREAM_FLUSH_POLICY 节流推送给前端
             chat_history[-1][1] = ""
-            for character in bot_response:
+            buffer = StreamBuffer()
+            deltas = 0
+            # 模型停顿时 iter_stream 产出 STALLED，按 "time" 策略推送已缓冲的内容
+            async for character in iter_stream(bot_response, buffer.time_until_flush):
+                if character is STALLED:
+                    chat_history[-1][1] = buffer.flush()
+                    yield chat_history, conversation
+                    continue
                 character_content = character.choices[0].delta.content
                 if character_content is not None:
-                    chat_history[-1][1] += character_content
-                    yield chat_history
-                else:
-                    logger.success(f"流式输出 | bot_response: {chat_history[-1][1]}")
-                    # 估算流式输出的 token 用量
-                    # prompt: messages 里的所有字符拼在一起
-                    prompt = messages # messages 类型可能是 str，也可能是 list
-                    if isinstance(messages, list):
-                        prompt = ""
-                        for message in messages:
-                            prompt += message['content'] + "\n"
-                    logger.trace(f"prompt: {prompt}")
-                    # prompt 的 token 数量
-                    prompt_tokens = FileProcessorHelper.tiktoken_len(prompt)
-                    # completion 的 token 数量
-                    completion_tokens = FileProcessorHelper.tiktoken_len(chat_history[-1][1])
-                    # 总 token 数量
-                    total_tokens = prompt_tokens + completion_tokens
-                    logger.success(f"流式输出 | total_tokens: {total_tokens} "
-                                   f"= prompt_tokens:{prompt_tokens} + completion_tokens: {completion_tokens}")
+                    if not deltas:
+                        tracing.observe("first_token", time.perf_counter() - start)
+                    deltas += 1
+                    if buffer.append(character_content):
+                        chat_history[-1][1] = buffer.flush()
+                        yield chat_history, conversation
+            # 最后一段总是推送
+            chat_history[-1][1] = buffer.flush()
+            logger.debug("流式输出 | 增量数: {} 推送次数: {}", deltas, buffer.flushes)
+            log_payload("DEBUG", "流式输出 | bot_response", lambda: chat_history[-1][1])
+            # 用量记录由 AsyncTrackedStream 在流结束时生成并交给 usage sink：
+            # 接口返回 usage 时使用接口的数字，否则为按增量累计的估算值
+            # 本轮加入会话状态，直接使用记录中的 completion token 数，不再编码整段回复
+            conversation.add_turn(user_input, chat_history[-1][1], bot_response.usage['completion_tokens'])
+            tracing.observe("total", time.perf_counter() - start)
+            yield chat_history, conversation
 
         else:
             # 非流式输出
+            # 非流式时整段回复一次返回，首个 token 即完整回复
+            tracing.observe("first_token", time.perf_counter() - start)
             chat_history[-1][1] = bot_response
-            logger.success(f"非流式输出 | bot_response: {chat_history[-1][1]}")
-            yield chat_history
+            log_payload("DEBUG", "非流式输出 | bot_response", lambda: bot_response)
+            conversation.add_turn(user_input, bot_response)
+            tracing.observe("total", time.perf_counter() - start)
+            yield chat_history, conversation
 
 
 def fn_upload_files(unuploaded_file_paths):
 
     logger.trace(f"组件输入 | unuploaded_file_paths: {unuploaded_file_paths}")
 
-    # 初始化上传成功的文件列表
+    # 初始化上传成功的文件列表和文档句柄列表
     uploaded_file_paths = []
+    uploaded_documents = []
 
     # 循环处理待上传的文件
     for file_path in unuploaded_file_paths:
@@ -186,11 +248,12 @@ def fn_upload_files(unuploaded_file_paths):
             gr.Info("文件上传成功！")
             uploaded_file_paths.append(
                 result.get('data').get('uploaded_file_path'))
+            uploaded_documents.append(result.get('data').get('document'))
         else:
             # 上传失败
             raise gr.Error("文件上传失败！")
 
-    return pd.DataFrame({'已上传的文件': uploaded_file_paths})
+    return pd.DataFrame({'已上传的文件': uploaded_file_paths}), uploaded_documents
 
 
 with gr.Blocks() as demo:
@@ -227,6 +290,10 @@ with gr.Blocks() as demo:
                 )
                 file_paths_dataframe = gr.Dataframe(
                     value=pd.DataFrame({'已上传的文件': []}))
+                # 会话内保存上传时得到的文档句柄（摘要、大小、修改时间、集合名）
+                uploaded_documents_state = gr.State([])
+                # 会话内保存对话历史及其 token 数（ConversationState），首次对话时创建
+                conversation_state = gr.State(None)
                 top_n_number = gr.Number(label="top_n", value=20)
             # 创建一个选项卡，用于调整参数
             with gr.Tab(label="模型参数"):
@@ -281,15 +348,19 @@ with gr.Blocks() as demo:
         inputs=[
             chat_mode_radio,
             file_paths_dataframe,
+            uploaded_documents_state,
             user_input_textbox,
             chatbot,
+            conversation_state,
             model_dropdown,
             max_tokens_slider,
             temperature_slider,
             stream_radio,
             top_n_number
         ],
-        outputs=[chatbot]
+        outputs=[chatbot, conversation_state],
+        concurrency_limit=CHAT_CONCURRENCY_LIMIT,
+        concurrency_id="chat",  # 回车和按钮提交共用同一个并发上限
     )
 
     # 单击按钮时触发。https://www.gradio.app/docs/button
@@ -304,24 +375,29 @@ with gr.Blocks() as demo:
         inputs=[
             chat_mode_radio,
             file_paths_dataframe,
+            uploaded_documents_state,
             user_input_textbox,
             chatbot,
+            conversation_state,
             model_dropdown,
             max_tokens_slider,
             temperature_slider,
             stream_radio,
             top_n_number
         ],
-        outputs=[chatbot]
+        outputs=[chatbot, conversation_state],
+        concurrency_limit=CHAT_CONCURRENCY_LIMIT,
+        concurrency_id="chat",  # 回车和按钮提交共用同一个并发上限
     )
-    clear_btn.click(lambda: None, None, chatbot, queue=False)
+    # 清空对话时同时重置会话状态
+    clear_btn.click(lambda: (None, None), None, [chatbot, conversation_state], queue=False)
 
     # 上传文件时触发。
     # https://www.gradio.app/docs/file
     file_paths_files.upload(
         fn=fn_upload_files,
         inputs=[file_paths_files],
-        outputs=[file_paths_dataframe],  # 展示已上传的文件
+        outputs=[file_paths_dataframe, uploaded_documents_state],  # 展示已上传的文件，保存文档句柄
         show_progress=True,  # 如果为 True，则在挂起时显示进度动画
     )
 
@@ -0,0 +1,47 @@
+"""
+PDF 文本提取基准测试：串行 vs 进程池并行，按页数统计加速比
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_pdf_extract path/to/file.pdf [workers]
+"""
+import sys
+import time
+
+import pdfplumber
+
+from config import PDF_EXTRACT_WORKERS
+from file_processor_helper import FileProcessorHelper
+
+PAGE_COUNTS = [16, 32, 64, 128, 256, 512]
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    file_path = sys.argv[1]
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else PDF_EXTRACT_WORKERS
+
+    with pdfplumber.open(file_path) as pdf:
+        total_pages = len(pdf.pages)
+    page_counts = [count for count in PAGE_COUNTS if count < total_pages] + [total_pages]
+    print(f"file={file_path} total_pages={total_pages} workers={workers}")
+    print(f"{'pages':>6} {'serial(s)':>10} {'parallel(s)':>12} {'speedup':>8}")
+
+    for page_count in page_counts:
+        serial, serial_pages = timed(
+            lambda: FileProcessorHelper.extract_pdf_pages(file_path, page_count, workers=1))
+        parallel, parallel_pages = timed(
+            lambda: FileProcessorHelper.extract_pdf_pages(file_path, page_count, workers=workers))
+        assert serial_pages == parallel_pages, "并行提取的结果与串行不一致"
+        print(f"{page_count:>6} {serial:>10.2f} {parallel:>12.2f} {serial / parallel:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Qdrant 集合调优配置基准测试：按 config.QDRANT_COLLECTION_PROFILES 中的每个配置建集合，
+与精确检索（exact=True）对比，统计 recall@k 和检索延迟
+
+需要可连接的 Qdrant 服务（config.QDRANT_HOST / QDRANT_PORT），测试集合在结束后删除。
+向量默认随机生成；也可以传入 .npy 文件（形状为 (n, EMBEDDING_DIMENSION) 的真实 embedding）。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_qdrant_profiles [points] [queries] [k] [vectors.npy]
+"""
+import sys
+import time
+
+import numpy as np
+from qdrant_client.http.models import SearchParams
+
+from config import EMBEDDING_DIMENSION, QDRANT_COLLECTION_PROFILES
+from db_qdrant import Qdrant
+
+
+def load_vectors(argv, points):
+    if len(argv) > 4:
+        vectors = np.load(argv[4]).astype(np.float32)
+        return vectors[:points]
+    rng = np.random.default_rng(42)
+    return rng.standard_normal((points, EMBEDDING_DIMENSION), dtype=np.float32)
+
+
+def wait_indexed(qdrant, collection_name, timeout=600):
+    # 等待优化器完成（状态变为 green），否则检索可能落在未建索引的段上
+    # 小于 indexing_threshold 的集合不会建 HNSW 索引，所以这里不比较 indexed_vectors_count
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if qdrant.client.get_collection(collection_name).status == "green":
+            return
+        time.sleep(0.5)
+
+
+def percentile(values, q):
+    return float(np.percentile(np.asarray(values) * 1000, q))
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+    vectors = load_vectors(sys.argv, points)
+    points = len(vectors)
+    rng = np.random.default_rng(7)
+    query_vectors = vectors[rng.choice(points, size=queries, replace=False)]
+    query_vectors = query_vectors + rng.normal(scale=0.05, size=query_vectors.shape).astype(np.float32)
+    payloads = [{"page_content": "", "metadata": {}} for _ in range(points)]
+
+    print(f"points={points} queries={queries} k={k}")
+    print(f"{'profile':>12} {'recall@k':>9} {'mean(ms)':>9} {'p95(ms)':>8} {'exact p95(ms)':>14}")
+
+    for profile_name in QDRANT_COLLECTION_PROFILES:
+        qdrant = Qdrant(profile=profile_name)
+        collection_name = f"bench_profile_{profile_name.replace('-', '_')}"
+        try:
+            # create_collection 不会重建已有集合，先删除上次中断时可能残留的基准测试集合
+            qdrant.client.delete_collection(collection_name)
+            qdrant.create_collection(collection_name)
+            qdrant.add_points(collection_name, vectors, payloads)
+            wait_indexed(qdrant, collection_name)
+
+            recalls, latencies, exact_latencies = [], [], []
+            for query_vector in query_vectors:
+                start = time.perf_counter()
+                exact = qdrant.client.search(collection_name=collection_name, query_vector=query_vector,
+                                             search_params=SearchParams(exact=True), limit=k)
+                exact_latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                result = qdrant.search(collection_name, query_vector, limit=k)
+                latencies.append(time.perf_counter() - start)
+
+                expected = {point.id for point in exact}
+                recalls.append(len(expected & {point.id for point in result}) / max(len(expected), 1))
+
+            print(f"{profile_name:>12} {np.mean(recalls):>9.3f} {np.mean(latencies) * 1000:>9.2f} "
+                  f"{percentile(latencies, 95):>8.2f} {percentile(exact_latencies, 95):>14.2f}")
+        finally:
+            qdrant.client.delete_collection(collection_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Qdrant 传输方式基准测试：REST（JSON 编码向量）vs gRPC（protobuf 二进制编码），统计写入吞吐和检索延迟
+
+需要可连接的 Qdrant 服务，且开放 REST 与 gRPC 端口（config.QDRANT_PORT / QDRANT_GRPC_PORT），
+测试集合在结束后删除。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_qdrant_transport [points] [queries] [top_n]
+"""
+import sys
+import time
+
+import numpy as np
+
+from config import EMBEDDING_DIMENSION
+from db_qdrant import Qdrant, check_health, create_client
+
+
+def main():
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    top_n = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    rng = np.random.default_rng(42)
+    vectors = rng.standard_normal((points, EMBEDDING_DIMENSION), dtype=np.float32)
+    query_vectors = rng.standard_normal((queries, EMBEDDING_DIMENSION), dtype=np.float32)
+    payloads = [{"page_content": "x" * 500, "metadata": {}} for _ in range(points)]
+
+    print(f"points={points} queries={queries} top_n={top_n}")
+    print(f"{'transport':>9} {'upsert(pts/s)':>14} {'mean(ms)':>9} {'p50(ms)':>8} {'p95(ms)':>8}")
+
+    for transport, prefer_grpc in (("REST", False), ("gRPC", True)):
+        client = create_client(prefer_grpc=prefer_grpc)
+        if not check_health(client):
+            continue
+        qdrant = Qdrant(client=client)
+        collection_name = f"bench_transport_{transport.lower()}"
+        try:
+            # create_collection 不会重建已有集合，先删除上次中断时可能残留的基准测试集合
+            qdrant.client.delete_collection(collection_name)
+            qdrant.create_collection(collection_name)
+            start = time.perf_counter()
+            qdrant.add_points(collection_name, vectors, payloads)
+            upsert_rate = points / (time.perf_counter() - start)
+
+            # 预热连接
+            qdrant.search(collection_name, query_vectors[0], limit=top_n)
+            latencies = []
+            for query_vector in query_vectors:
+                start = time.perf_counter()
+                qdrant.search(collection_name, query_vector, limit=top_n)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            print(f"{transport:>9} {upsert_rate:>14.0f} {np.mean(latencies):>9.2f} "
+                  f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}")
+        finally:
+            client.delete_collection(collection_name)
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
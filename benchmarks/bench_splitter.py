@@ -0,0 +1,70 @@
+"""
+切分器基准测试：TokenOffsetTextSplitter vs RecursiveCharacterTextSplitter(length_function=tiktoken_len)
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_splitter                  # 使用合成的 500 页文本
+    python -m benchmarks.bench_splitter path/to/file.pdf # 使用真实 PDF 的页面
+"""
+import random
+import sys
+import time
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import CHUNK_OVERLAP, CHUNK_SIZE
+from file_processor_helper import FileProcessorHelper, TokenOffsetTextSplitter, _TOKEN_COUNT_CACHE
+
+PAGES = 500
+
+
+def synthetic_pages(pages=PAGES, seed=0):
+    # 中英文混排、带段落和句子分隔符的页面，每页约 1500 字符
+    rng = random.Random(seed)
+    words = ["检索", "增强", "生成", "向量", "数据库", "模型", "文档", "问答", "。", "，",
+             "the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog.", "\n"]
+    docs = []
+    for page in range(1, pages + 1):
+        paragraphs = [" ".join(rng.choice(words) for _ in range(rng.randint(80, 160))) for _ in range(5)]
+        docs.append(Document(
+            page_content="\n\n".join(paragraphs),
+            metadata={"file_name": "synthetic.pdf", "page": page, "total_pages": pages},
+        ))
+    return docs
+
+
+def bench(name, split):
+    _TOKEN_COUNT_CACHE.clear()  # 两边都从冷缓存开始
+    start = time.perf_counter()
+    chunks = split()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {elapsed:8.3f}s  chunks={len(chunks)}")
+    return elapsed
+
+
+def main():
+    if len(sys.argv) > 1:
+        docs = FileProcessorHelper.pdf_file_to_docs(sys.argv[1])
+    else:
+        docs = synthetic_pages()
+    texts = [doc.page_content for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+    print(f"pages={len(docs)} chars={sum(len(text) for text in texts)} "
+          f"chunk_size={CHUNK_SIZE} chunk_overlap={CHUNK_OVERLAP}")
+
+    FileProcessorHelper.get_encoding()  # 编码器加载不计入耗时
+
+    recursive = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=FileProcessorHelper.tiktoken_len,
+    )
+    token_offset = TokenOffsetTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    baseline = bench("RecursiveCharacterTextSplitter", lambda: recursive.create_documents(texts, metadatas))
+    native = bench("TokenOffsetTextSplitter", lambda: token_offset.create_documents(texts, metadatas))
+    print(f"speedup: {baseline / native:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+流式输出推送策略基准测试：逐个增量推送 vs StreamBuffer 的各个策略，统计推送次数和序列化对话历史的 CPU 时间
+
+模拟模型以固定间隔返回增量，每次推送像 Gradio 一样把整个对话历史序列化为 JSON。
+
+用法（在项目根目录执行）：
+    python -m benchmarks.bench_stream_flush [deltas] [delta_interval_ms] [history_turns]
+"""
+import json
+import sys
+import time
+
+from stream_buffer import StreamBuffer
+
+DELTA = "这是一段模拟的增量文本。"
+
+
+def simulate(deltas, delta_interval, chat_history, buffer=None):
+    chat_history[-1][1] = ""
+    pushes = 0
+    cpu = 0.0
+
+    def push():
+        nonlocal pushes, cpu
+        start = time.process_time()
+        json.dumps(chat_history, ensure_ascii=False)
+        cpu += time.process_time() - start
+        pushes += 1
+
+    for i in range(deltas):
+        time.sleep(delta_interval)
+        # 按 4 个字符一段切分，末段带句号
+        delta = DELTA[(i % 3) * 4:(i % 3) * 4 + 4]
+        if buffer is None:
+            chat_history[-1][1] += delta
+            push()
+        elif buffer.append(delta):
+            chat_history[-1][1] = buffer.flush()
+            push()
+    if buffer is not None:
+        chat_history[-1][1] = buffer.flush()
+        push()
+    return pushes, cpu
+
+
+def main():
+    deltas = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    delta_interval = (float(sys.argv[2]) if len(sys.argv) > 2 else 5) / 1000
+    history_turns = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    history = [["用户的问题" * 20, "助手的回答" * 200] for _ in range(history_turns)]
+
+    print(f"deltas={deltas} delta_interval={delta_interval * 1000:.0f}ms history_turns={history_turns}")
+    print(f"{'policy':>10} {'pushes':>7} {'cpu(ms)':>8}")
+    pushes, cpu = simulate(deltas, delta_interval, history + [["问题", None]])
+    print(f"{'per-delta':>10} {pushes:>7} {cpu * 1000:>8.1f}")
+    for policy in ("time", "chars", "sentence"):
+        pushes, cpu = simulate(deltas, delta_interval, history + [["问题", None]], StreamBuffer(policy))
+        print(f"{policy:>10} {pushes:>7} {cpu * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+外部依赖（Qdrant、OpenAI）的断路器。
+
+- closed：正常调用，连续失败达到 CIRCUIT_BREAKER_FAILURE_THRESHOLD 次后断开；
+- open：直接抛出 CircuitOpenError，不再等待连接超时；经过 CIRCUIT_BREAKER_RESET_TIMEOUT 秒后进入 half-open；
+- half-open：只放行一个探测请求，成功则闭合，失败则重新断开。
+
+只有 is_failure 判定为依赖故障的异常（连接错误、超时、5xx 等）计入失败；
+404 之类说明依赖正常响应的错误不计入，并且视为依赖可用。
+调用方捕获 DependencyUnavailable（包括 CircuitOpenError）后返回降级结果，例如不带文档内容的普通问答。
+"""
+import functools
+import inspect
+import threading
+import time
+
+from loguru import logger
+
+from config import CIRCUIT_BREAKER_ENABLED, CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class DependencyUnavailable(Exception):
+    """依赖暂时不可用：断路器已断开，或者请求因连接错误、超时、5xx 等依赖故障失败。"""
+
+    def __init__(self, name, message=None):
+        super().__init__(message or f"{name} 暂时不可用")
+        self.name = name
+
+
+class CircuitOpenError(DependencyUnavailable):
+    """断路器断开时的快速失败。"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(name, f"{name} 断路器已断开，{retry_in:.1f} 秒后重试")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name, is_failure=None, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT):
+        """
+        :param name: 依赖名称，用于日志和 CircuitOpenError
+        :param is_failure: 判断异常是否计入失败的函数，默认所有异常都计入
+        :param failure_threshold: 连续失败多少次后断开
+        :param reset_timeout: 断开后多少秒放行一个探测请求
+        """
+        self.name = name
+        self.is_failure = is_failure or (lambda error: True)
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        调用前检查，不允许调用时抛出 CircuitOpenError。
+        """
+        if not CIRCUIT_BREAKER_ENABLED:
+            return
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == OPEN:
+                retry_in = self._opened_at + self.reset_timeout - now
+                if retry_in > 0:
+                    raise CircuitOpenError(self.name, retry_in)
+                self.state = HALF_OPEN
+                logger.info(f"断路器半开，放行探测请求 | {self.name}")
+            # half-open：同一时间只有一个探测请求；探测请求长时间没有结果时（例如流被丢弃）再放行一个
+            if self._probe_started is not None and now - self._probe_started < self.reset_timeout:
+                raise CircuitOpenError(self.name, self._probe_started + self.reset_timeout - now)
+            self._probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.success(f"断路器闭合，{self.name} 已恢复")
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_started = None
+
+    def record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                logger.error(f"断路器断开 | {self.name} 连续失败: {self.failures} "
+                             f"{self.reset_timeout} 秒后探测 错误信息: {error}")
+
+    def record(self, error):
+        # 按 is_failure 记录一次调用的异常
+        if self.is_failure(error):
+            self.record_failure(error)
+        else:
+            self.record_success()
+
+    def call(self, func, *args, **kwargs):
+        self.allow()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record_success()
+        return result
+
+    async def call_async(self, func, *args, **kwargs):
+        # func 是协程函数
+        self.allow()
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record_success()
+        return result
+
+
+class GuardedClient:
+    """
+    包装客户端对象，每个方法调用都经过断路器；协程方法返回协程。
+    用于 QdrantClient / AsyncQdrantClient，Qdrant 封装类的所有请求都因此受到保护。
+    """
+
+    def __init__(self, client, breaker):
+        self._client = client
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        breaker = self._breaker
+        if inspect.iscoroutinefunction(attr):
+            @functools.wraps(attr)
+            async def guarded(*args, **kwargs):
+                return await breaker.call_async(attr, *args, **kwargs)
+        else:
+            @functools.wraps(attr)
+            def guarded(*args, **kwargs):
+                return breaker.call(attr, *args, **kwargs)
+        return guarded
+
+
+def guard_client(client, breaker):
+    # 已经包装过的客户端不重复包装
+    if isinstance(client, GuardedClient):
+        return client
+    return GuardedClient(client, breaker)
@@ -29,11 +29,230 @@ MODEL_TO_MAX_TOKENS = {
     "gpt-4-1106-preview": 4096,
     "gpt-4": 8192,
 }
+# 各模型的上下文窗口（prompt + 回复的 token 总数上限），用于计算文档问答 prompt 的 token 预算；
+# MODEL_TO_MAX_TOKENS 是 max_tokens 滑块的上限（最多生成的 token 数），两者不同
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo-1106": 16385,
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4-1106-preview": 128000,
+    "gpt-4": 8192,
+    "gpt-4o": 128000,
+}
+
+# OpenAI 客户端配置
+# 进程内共享一个 httpx 连接池，复用 TLS 连接；安装了 h2 时启用 HTTP/2
+OPENAI_MAX_CONNECTIONS = 100
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = 20
+OPENAI_KEEPALIVE_EXPIRY = 60  # 秒
+OPENAI_HTTP2 = True
+# 各操作的超时（秒）：连接超时共用；流式输出的读超时是相邻两个数据块之间的最长等待
+OPENAI_CONNECT_TIMEOUT = 5
+OPENAI_CHAT_TIMEOUT = 120
+OPENAI_STREAM_TIMEOUT = 30
+OPENAI_EMBEDDING_TIMEOUT = 60
+# 请求调度（rate_limiter.py）：按模型的 RPM / TPM 令牌桶限流，发送前用 tiktoken 估算 token 数
+RATE_LIMIT_ENABLED = True
+# 各模型每分钟的请求数和 token 数上限，按账户的 usage tier 填写；收到响应后按 x-ratelimit-* 头校准
+OPENAI_RATE_LIMITS = {
+    "default": {"rpm": 3500, "tpm": 90000},
+    "gpt-4": {"rpm": 500, "tpm": 10000},
+    "gpt-4-1106-preview": {"rpm": 500, "tpm": 150000},
+    "text-embedding-ada-002": {"rpm": 3000, "tpm": 1000000},
+}
+# 批量任务（入库 embedding）只能使用桶容量的这一比例，剩余留给交互式对话
+RATE_LIMIT_BULK_RATIO = 0.8
+# 429、5xx、连接错误等的重试次数，指数退避加随机抖动，优先使用 Retry-After；SDK 自带的重试关闭
+OPENAI_MAX_RETRIES = 5
+OPENAI_BACKOFF_BASE = 0.5  # 秒
+OPENAI_BACKOFF_MAX = 30  # 秒
+# 流式输出时请求接口在最后一个 chunk 返回 usage（stream_options.include_usage）；
+# 不支持该参数的兼容接口可关闭，此时按增量估算 completion token 数
+OPENAI_STREAM_INCLUDE_USAGE = True
+# 用量记录的 sink："log" 写日志，"jsonl" 追加到 USAGE_LOG_PATH；也可以用 usage.register_sink 注册自定义 sink
+USAGE_SINKS = ["log"]
+USAGE_LOG_PATH = os.path.join("logs", "usage.jsonl")
+
+# 日志配置（都可以通过环境变量覆盖）
+# 日志级别: TRACE|DEBUG|INFO|SUCCESS|WARNING|ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# 额外写入的日志文件，为空时只输出到 stderr；LOG_SERIALIZE 打开时每条记录写为一行 JSON
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_FILE_ROTATION = os.getenv("LOG_FILE_ROTATION", "100 MB")
+LOG_FILE_RETENTION = os.getenv("LOG_FILE_RETENTION", "7 days")
+LOG_SERIALIZE = os.getenv("LOG_SERIALIZE", "false").lower() in ("1", "true", "yes")
+# prompt、检索结果、回复等大段内容在日志中最多保留的字符数，0 表示不截断
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+# 记录大段内容的请求比例（0~1），级别开启时也只对这部分请求格式化和写入
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+
+# embedding 配置
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIMENSION = 1536
+# 单个请求最多的输入条数（API 上限 2048）
+EMBEDDING_BATCH_SIZE = 2048
+# 单个请求的 token 预算，按 tiktoken 估算
+EMBEDDING_BATCH_MAX_TOKENS = 100000
+# 并发请求的线程数
+EMBEDDING_MAX_WORKERS = 4
+# 持久化 embedding 缓存：按 (model, 文本) 的哈希缓存向量，重复上传/公共片段无需重新向量化
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = os.path.join("cache", "embeddings.sqlite3")
+# 缓存文件中向量数据的总字节上限，超出后按最近最少使用淘汰（1536 维 float32 每条约 6KB）
+EMBEDDING_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# 命中时的 last_access 更新先记在内存中，积累到这么多条或距上次写入超过这么多秒时批量写入，查询本身只读
+EMBEDDING_CACHE_TOUCH_FLUSH_SIZE = 1000
+EMBEDDING_CACHE_TOUCH_FLUSH_INTERVAL = 30  # 秒
+
+# 流式入库：每批 chunk 数，以及各阶段之间有界队列的长度（队列满时上游阻塞，峰值内存只与批大小相关）
+INGEST_BATCH_SIZE = 256
+INGEST_QUEUE_SIZE = 2
+# 入库失败后清理部分数据也失败时（例如 Qdrant 断路器已断开），在这里记录待清理的集合（文档），下次上传时先清理再重新入库
+INGEST_CLEANUP_MARKER_PATH = os.path.join("cache", "ingest_cleanup.json")
+
+# 文档问答的进程内缓存：问题文本 -> 问题向量，(集合, 问题向量, top_n) -> 检索结果
+QUERY_VECTOR_CACHE_SIZE = 1024
+QUERY_VECTOR_CACHE_TTL = 3600  # 秒
+RETRIEVAL_CACHE_SIZE = 1024
+RETRIEVAL_CACHE_TTL = 600  # 秒
+
+# 文件摘要算法，用于集合命名：md5 | blake2b | xxhash（未安装 xxhash 时回退到 blake2b）
+FILE_DIGEST_ALGORITHM = "md5"
+# 使用非 md5 算法时同时计算 MD5，以便继续使用以 MD5 命名的已有集合
+FILE_DIGEST_LEGACY_MD5 = True
+# 流式哈希时复用的读缓冲区大小（字节），哈希大文件的内存占用与文件大小无关
+FILE_HASH_BUFFER_SIZE = 1024 * 1024
+# (文件路径, 大小, 修改时间) -> 文件摘要 的缓存，只有文件路径的调用方无需重新读取和哈希文件
+FILE_DIGEST_CACHE_SIZE = 4096
+FILE_DIGEST_CACHE_TTL = 24 * 3600  # 秒
 
 QDRANT_HOST = "localhost"
 QDRANT_PORT = 6333
+QDRANT_GRPC_PORT = 6334
+# 使用 gRPC 传输：向量以 protobuf 二进制编码发送，省去 1536 维浮点数的 JSON 编解码；需要服务端开放 gRPC 端口
+QDRANT_PREFER_GRPC = False
+QDRANT_TIMEOUT = 30  # 秒
+# 进程内共享一个客户端，REST 连接池保持长连接（客户端默认对 localhost 关闭 keep-alive）
+QDRANT_MAX_CONNECTIONS = 64
+QDRANT_MAX_KEEPALIVE_CONNECTIONS = 32
+# 存储模式：
+# - "per_file"：每个文件一个集合，集合名由文件摘要得到
+# - "shared"：所有文件的节点存入同一个集合 QDRANT_SHARED_COLLECTION，用带索引的 doc_id 字段区分文档，
+#   检索时对所选文档做一次带过滤条件的搜索。已有的按文件集合可用 migrate_collections.py 迁移
+QDRANT_STORAGE_MODE = "per_file"
+QDRANT_SHARED_COLLECTION = "documents"
+# 集合调优配置：创建集合时的量化、向量/payload 是否落盘、HNSW 参数，以及检索时对应的 ef、重打分参数
+# - ram-fast：全精度向量常驻内存，检索最快，内存占用最大
+# - scalar-int8：原始向量落盘，int8 量化向量常驻内存（约为原来的 1/4），检索时过采样并用原始向量重打分
+# - on-disk：向量、HNSW 索引和 payload 都落盘，内存占用最小，检索最慢
+QDRANT_COLLECTION_PROFILES = {
+    "ram-fast": {
+        "on_disk": False,
+        "on_disk_payload": False,
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "hnsw_on_disk": False,
+        "quantization": None,
+        "search_hnsw_ef": 128,
+        "search_rescore": False,
+        "search_oversampling": None,
+    },
+    "scalar-int8": {
+        "on_disk": True,
+        "on_disk_payload": True,
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "hnsw_on_disk": False,
+        "quantization": "int8",
+        "quantization_always_ram": True,
+        "search_hnsw_ef": 128,
+        "search_rescore": True,
+        "search_oversampling": 2.0,
+    },
+    "on-disk": {
+        "on_disk": True,
+        "on_disk_payload": True,
+        "hnsw_m": 16,
+        "hnsw_ef_construct": 100,
+        "hnsw_on_disk": True,
+        "quantization": None,
+        "search_hnsw_ef": 64,
+        "search_rescore": False,
+        "search_oversampling": None,
+    },
+}
+QDRANT_COLLECTION_PROFILE = "ram-fast"
+# 检索时按集合创建时的调优配置生成检索参数（集合可能由其他配置创建），结果按集合缓存
+QDRANT_SEARCH_PARAMS_CACHE_SIZE = 4096
+QDRANT_SEARCH_PARAMS_CACHE_TTL = 3600  # 秒
+# 按 id 顺序滚动读取集合内容时每页的节点数
+QDRANT_SCROLL_PAGE_SIZE = 256
+# 每个进程同时在途的检索请求数（所有会话共用）
+QDRANT_SEARCH_PARALLEL = 16
+# 插入节点时每个请求的节点数，以及并发请求的线程数
+QDRANT_UPSERT_BATCH_SIZE = 128
+QDRANT_UPSERT_PARALLEL = 4
+QDRANT_UPSERT_RETRIES = 3
+# 插入失败（连接错误、超时、5xx）重试前的指数退避加随机抖动，与 OpenAI 请求的退避方式相同
+QDRANT_BACKOFF_BASE = 0.5  # 秒
+QDRANT_BACKOFF_MAX = 5  # 秒
+# False：插入时不等待索引完成（更快），入库结束后再检查节点数是否一致
+QDRANT_UPSERT_WAIT = True
+# wait=False 时一致性检查的超时时间（秒）
+QDRANT_CONSISTENCY_TIMEOUT = 60
 
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
+# PDF 文本提取共享进程池的进程数，页数不少于 PDF_PARALLEL_MIN_PAGES 时按页码区间分给多个进程并行提取
+PDF_EXTRACT_WORKERS = os.cpu_count() or 1
+PDF_PARALLEL_MIN_PAGES = 16
+# txt 文件按块流式读取，每块的字符数（在块内最后一个换行处断开）
+TXT_READ_BLOCK_CHARS = 64 * 1024
+# 切分时优先在这些分隔符之后断开（按优先级从高到低）
+TEXT_SPLIT_SEPARATORS = ["\n\n", "\n", "。", "！", "？", ". ", "；", "，", " "]
+
+DEFAULT_MAX_TOKENS = 2000
+# 会话状态中保留的对话历史 token 数上限，超出时淘汰最早的对话；每次请求还会按模型预算进一步截取
+CONVERSATION_MAX_HISTORY_TOKENS = 4000
+# 文档问答 prompt 的 token 预算 = 模型上下文窗口（MODEL_CONTEXT_WINDOWS）- max_tokens - 预留
+# MODEL_CONTEXT_WINDOWS 中没有的模型按 DEFAULT_CONTEXT_WINDOW 计算
+DEFAULT_CONTEXT_WINDOW = 8192
+PROMPT_RESERVED_TOKENS = 64  # 消息格式等额外开销
+# 每条消息除内容外的开销（角色、分隔符等），与 OpenAI cookbook 的估算一致
+MESSAGE_OVERHEAD_TOKENS = 4
+# 文档内容最多占用的 token 数，避免大窗口模型每轮都按上限付费
+CONTEXT_MAX_TOKENS = 6000
+# 对话历史最多占用剩余预算的比例，超出时丢弃最早的对话；历史用不完的预算留给文档内容
+HISTORY_MAX_RATIO = 0.3
+# 两个 chunk 的字符 n-gram Jaccard 相似度达到阈值时视为近似重复，只保留分数高的
+CONTEXT_DEDUP_THRESHOLD = 0.8
+CONTEXT_SHINGLE_SIZE = 5
+# 流式输出推送给前端的节奏："time" | "chars" | "sentence"，见 stream_buffer.py
+STREAM_FLUSH_POLICY = "time"
+STREAM_FLUSH_INTERVAL = 0.05  # 秒
+STREAM_FLUSH_CHARS = 64
+# 分阶段耗时统计（tracing.py）：关闭时几乎没有开销
+TRACING_ENABLED = False
+# 直方图的桶上限（秒）
+TRACING_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+# Prometheus 格式的 /metrics 端点，与 Gradio 应用使用不同的端口
+METRICS_HOST = "0.0.0.0"
+METRICS_PORT = 9464
+# 同时导出到 OpenTelemetry（需要 opentelemetry-sdk 和 opentelemetry-exporter-otlp，地址由 OTEL_EXPORTER_OTLP_* 环境变量配置）
+OTEL_EXPORTER_ENABLED = False
+OTEL_SERVICE_NAME = "llm-assistant"
+# 同时进行的对话数上限。fn_chat 是异步生成器，在事件循环中运行，不为每个对话占用线程
+CHAT_CONCURRENCY_LIMIT = 256
+# 断路器（circuit_breaker.py）：Qdrant / OpenAI 连续失败达到阈值后断开，断开期间直接降级（不带文档的普通问答），
+# 不再让每个请求等待连接超时；断开 CIRCUIT_BREAKER_RESET_TIMEOUT 秒后放行一个探测请求
+CIRCUIT_BREAKER_ENABLED = True
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30  # 秒
 
-DEFAULT_MAX_TOKENS = 2000
\ No newline at end of file
+# tokenizer 配置
+# 无法通过 tiktoken.encoding_for_model 解析的模型，回退使用该编码
+DEFAULT_TIKTOKEN_ENCODING = "cl100k_base"
+# 文本 -> token 数的记忆化缓存条目上限（LRU）
+TOKEN_COUNT_CACHE_SIZE = 4096
+# count_tokens 批量编码时使用的线程数
+TOKEN_COUNT_THREADS = 8
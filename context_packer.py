@@ -0,0 +1,161 @@
+"""
+按 token 预算组装文档问答 prompt 的上下文和对话历史。
+
+检索结果按分数从高到低贪心放入，直到用完预算：
+- 同一文档相邻的 chunk（chunk_index 相差 1）去掉 CHUNK_OVERLAP 造成的重叠文本；
+- 与已选 chunk 近似重复的 chunk（字符 n-gram Jaccard 相似度 >= CONTEXT_DEDUP_THRESHOLD）直接丢弃。
+对话历史由 ConversationState 从最近一轮往前截取，超出预算的早期对话被丢弃。
+"""
+from loguru import logger
+
+from config import (CHUNK_OVERLAP, CONTEXT_DEDUP_THRESHOLD, CONTEXT_MAX_TOKENS, CONTEXT_SHINGLE_SIZE,
+                    DEFAULT_CONTEXT_WINDOW, HISTORY_MAX_RATIO, MODEL_CONTEXT_WINDOWS, PROMPT_RESERVED_TOKENS)
+from db_qdrant import point_doc_key
+from file_processor_helper import FileProcessorHelper
+
+CONTEXT_SEPARATOR = "\n---\n"
+
+# 查找重叠时用后一个 chunk 开头的多少个字符做探针
+_OVERLAP_PROBE_CHARS = 8
+# 一个 token 最多对应的字符数（估计值），用于把 CHUNK_OVERLAP 换算成查找重叠的字符范围
+_OVERLAP_MAX_CHARS_PER_TOKEN = 8
+
+
+class PromptBudgetError(ValueError):
+    """检索到了文档内容，但 token 预算放不下任何一个 chunk（通常是 max_tokens 设得太大）。"""
+
+
+def prompt_token_budget(model, max_tokens):
+    """
+    prompt 可用的 token 数：模型上下文窗口减去要生成的 max_tokens 和预留开销。
+    """
+    context_window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(context_window - int(max_tokens) - PROMPT_RESERVED_TOKENS, 0)
+
+
+def strip_overlap(previous_text, text):
+    """
+    去掉 text 开头与 previous_text 结尾重叠的部分（相邻 chunk 由 CHUNK_OVERLAP 产生的重复文本）。
+    只在 previous_text 的最后 CHUNK_OVERLAP 个 token 对应的字符范围内查找，从最长的重叠开始尝试，
+    避免把较短的偶然重复当成重叠。
+    """
+    probe = text[:_OVERLAP_PROBE_CHARS]
+    if not probe:
+        return text
+    # CHUNK_OVERLAP 按 token 计，换算成字符数的上限
+    window_start = max(0, len(previous_text) - CHUNK_OVERLAP * _OVERLAP_MAX_CHARS_PER_TOKEN)
+    start = previous_text.find(probe, window_start)
+    while start != -1:
+        if text.startswith(previous_text[start:]):
+            return text[len(previous_text) - start:]
+        start = previous_text.find(probe, start + 1)
+    return text
+
+
+def shingles(text, size=CONTEXT_SHINGLE_SIZE):
+    # 字符 n-gram 集合；中文没有空格分词，按字符切分对中英文都适用
+    text = "".join(text.split())
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _chunk_position(point):
+    """
+    返回 (文档标识, chunk 序号)；旧数据的 payload 里没有 chunk_index 时返回 None。
+    """
+    payload = point['payload'] or {}
+    chunk_index = payload.get('chunk_index')
+    if chunk_index is None:
+        return None
+    return payload.get('doc_id') or point_doc_key(point['id']), chunk_index
+
+
+def pack_context(points, budget, model):
+    """
+    按分数从高到低贪心选择 chunk，直到用完 budget。
+
+    :param points: search_points_async 返回的按分数降序的 point 字典列表
+    :return: (上下文字符串, token 数, 统计信息 dict)
+    """
+    selected = []  # [(文本, shingles)]
+    selected_positions = {}  # (文档标识, chunk 序号) -> 已选的文本
+    separator_tokens = FileProcessorHelper.tiktoken_len(CONTEXT_SEPARATOR, model)
+    used = 0
+    stats = {"candidates": len(points), "duplicates": 0, "overlap_trimmed": 0, "over_budget": 0}
+
+    for point in points:
+        text = (point['payload'] or {}).get('page_content', '')
+        position = _chunk_position(point)
+        if position is not None:
+            doc_key, chunk_index = position
+            # 前一个 chunk 已选中：去掉本 chunk 开头的重叠；后一个已选中：去掉它开头与本 chunk 结尾的重叠
+            previous_text = selected_positions.get((doc_key, chunk_index - 1))
+            if previous_text is not None:
+                trimmed = strip_overlap(previous_text, text)
+                stats["overlap_trimmed"] += trimmed != text
+                text = trimmed
+            next_text = selected_positions.get((doc_key, chunk_index + 1))
+            if next_text is not None:
+                overlap = len(next_text) - len(strip_overlap(text, next_text))
+                if overlap:
+                    text = text[:len(text) - overlap]
+                    stats["overlap_trimmed"] += 1
+        if not text.strip():
+            stats["duplicates"] += 1
+            continue
+
+        text_shingles = shingles(text)
+        if any(jaccard(text_shingles, other) >= CONTEXT_DEDUP_THRESHOLD for _, other in selected):
+            stats["duplicates"] += 1
+            continue
+
+        token_count = FileProcessorHelper.tiktoken_len(text, model) + (separator_tokens if selected else 0)
+        if used + token_count > budget:
+            # 继续尝试后面更短的 chunk
+            stats["over_budget"] += 1
+            continue
+
+        selected.append((text, text_shingles))
+        if position is not None:
+            selected_positions[position] = text
+        used += token_count
+
+    stats["selected"] = len(selected)
+    return CONTEXT_SEPARATOR.join(text for text, _ in selected), used, stats
+
+
+def pack_prompt_parts(points, conversation, model, max_tokens, fixed_tokens):
+    """
+    在 token 预算内组装文档上下文和对话历史。
+
+    :param conversation: ConversationState，不含本轮问题
+    :param fixed_tokens: prompt 模板和本轮问题占用的 token 数
+    :return: (上下文字符串, 对话历史字符串, prompt 的 token 数)
+    :raises PromptBudgetError: 有检索结果但预算内放不下任何文档内容时，不发送没有上下文的 prompt
+    """
+    budget = max(prompt_token_budget(model, max_tokens) - fixed_tokens, 0)
+    history_str, history_tokens, dropped_turns = conversation.history_str(int(budget * HISTORY_MAX_RATIO))
+    context_budget = min(budget - history_tokens, CONTEXT_MAX_TOKENS)
+    context, context_tokens, stats = pack_context(points, context_budget, model)
+    if points and not stats["selected"] and stats["over_budget"]:
+        logger.warning(f"prompt 预算不足，放不下任何文档内容 | model: {model} max_tokens: {max_tokens} "
+                       f"budget: {budget} 历史: {history_tokens} 文档预算: {context_budget}")
+        raise PromptBudgetError(f"模型 {model} 的上下文窗口在 max_tokens={max_tokens} 时放不下任何文档内容")
+
+    # 与直接拼接全部检索结果和完整对话历史相比节省的 token 数
+    unpacked_tokens = sum(FileProcessorHelper.count_tokens(
+        [(point['payload'] or {}).get('page_content', '') for point in points], model))
+    packed = fixed_tokens + context_tokens + history_tokens
+    unpacked = fixed_tokens + unpacked_tokens + conversation.total_tokens
+    logger.info(f"prompt 打包 | model: {model} budget: {budget} prompt_tokens: {packed} / 未打包: {unpacked} "
+                f"节省: {unpacked - packed} | chunks: {stats['selected']}/{stats['candidates']} "
+                f"去重: {stats['duplicates']} 去重叠: {stats['overlap_trimmed']} 超预算: {stats['over_budget']} "
+                f"丢弃历史轮数: {dropped_turns}")
+    return context, history_str, packed
@@ -0,0 +1,163 @@
+"""
+会话状态：逐轮保存对话及其 token 数，在 token 预算内维护滚动窗口，并缓存渲染好的历史。
+
+每轮对话的 token 数只在加入时计算一次，渲染好的历史字符串和 messages 在窗口变化前一直复用，
+因此每轮的开销与会话长度无关。
+"""
+from collections import deque
+
+from config import CONVERSATION_MAX_HISTORY_TOKENS, DEFAULT_MODEL, MESSAGE_OVERHEAD_TOKENS
+from file_processor_helper import FileProcessorHelper
+
+
+class Turn:
+    def __init__(self, user, assistant, user_tokens, assistant_tokens):
+        self.user = user
+        self.assistant = assistant
+        self.user_tokens = user_tokens  # 内容的 token 数，不含消息开销
+        self.assistant_tokens = assistant_tokens
+
+    @property
+    def tokens(self):
+        # 两条消息的内容 token 数加上消息开销
+        return self.user_tokens + self.assistant_tokens \
+            + MESSAGE_OVERHEAD_TOKENS * (bool(self.user) + bool(self.assistant))
+
+    def render(self):
+        # 文档问答 prompt 中对话历史的格式
+        lines = []
+        if self.user:
+            lines.append(f'user:{self.user}')
+        if self.assistant:
+            lines.append(f'assistant:{self.assistant}')
+        return "\n".join(lines)
+
+    def messages(self):
+        messages = []
+        if self.user:
+            messages.append({"role": "user", "content": self.user})
+        if self.assistant:
+            messages.append({"role": "assistant", "content": self.assistant})
+        return messages
+
+
+class ConversationState:
+    """
+    保存在 gr.State 中的会话状态，每个浏览器会话一个实例。
+
+    - add_turn：本轮回复完成后加入，超出 max_history_tokens 时从最早的对话开始淘汰；
+    - sync：与 Gradio Chatbot 的 chat_history 对齐（例如页面被清空或状态丢失后重建）；
+    - history_str / history_messages：在给定预算内的最近若干轮，结果缓存到窗口变化为止。
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, max_history_tokens=CONVERSATION_MAX_HISTORY_TOKENS):
+        self.model = model
+        self.max_history_tokens = max_history_tokens
+        self.turns = deque()
+        self.window_tokens = 0  # 窗口内所有轮的 token 数
+        self.total_turns = 0  # 加入过的轮数，包括已淘汰的
+        self.total_tokens = 0  # 加入过的所有轮的 token 数，用于统计节省
+        self._cache = {}
+
+    @classmethod
+    def from_chat_history(cls, chat_history, model=DEFAULT_MODEL):
+        # chat_history 是不含本轮问题的 Gradio Chatbot 历史
+        state = cls(model)
+        for chat in chat_history:
+            state.add_turn(chat[0], chat[1])
+        return state
+
+    def count_tokens(self, user, assistant):
+        # :return: (user 的 token 数, assistant 的 token 数)
+        return FileProcessorHelper.count_tokens([user or "", assistant or ""], self.model)
+
+    def add_turn(self, user, assistant, assistant_tokens=None):
+        """
+        :param assistant_tokens: 已知的回复 token 数（例如接口返回的 completion_tokens），提供时不再编码回复
+        """
+        if assistant_tokens is None:
+            user_tokens, assistant_tokens = self.count_tokens(user, assistant)
+        else:
+            user_tokens = FileProcessorHelper.tiktoken_len(user or "", self.model)
+        turn = Turn(user, assistant, user_tokens, assistant_tokens)
+        self.turns.append(turn)
+        self.window_tokens += turn.tokens
+        self.total_turns += 1
+        self.total_tokens += turn.tokens
+        while self.window_tokens > self.max_history_tokens and len(self.turns) > 1:
+            self.window_tokens -= self.turns.popleft().tokens
+        self._cache.clear()
+        return turn
+
+    def clear(self):
+        self.turns.clear()
+        self.window_tokens = 0
+        self.total_turns = 0
+        self.total_tokens = 0
+        self._cache.clear()
+
+    def sync(self, chat_history, model=None):
+        """
+        与 Chatbot 的历史对齐。chat_history 的最后一项是本轮问题，不计入历史。
+        正常情况下状态已经包含之前的所有轮，这里只做 O(1) 的检查。
+        """
+        if model and model != self.model:
+            self.set_model(model)
+        completed = chat_history[:-1] if chat_history else []
+        if len(completed) < self.total_turns:
+            # Chatbot 被清空或回退，重建
+            self.clear()
+        for chat in completed[self.total_turns:]:
+            self.add_turn(chat[0], chat[1])
+
+    def set_model(self, model):
+        # 换用不同编码器的模型时重新计算窗口内各轮的 token 数
+        if FileProcessorHelper.get_encoding(model).name == FileProcessorHelper.get_encoding(self.model).name:
+            self.model = model
+            return
+        self.model = model
+        turns = list(self.turns)
+        self.turns.clear()
+        self.window_tokens = 0
+        for turn in turns:
+            turn.user_tokens, turn.assistant_tokens = self.count_tokens(turn.user, turn.assistant)
+            self.turns.append(turn)
+            self.window_tokens += turn.tokens
+        self._cache.clear()
+
+    def _window_start(self, budget):
+        # 在 budget 内能保留的最早一轮在窗口中的下标
+        if budget is None or budget >= self.window_tokens:
+            return 0, self.window_tokens
+        used = 0
+        start = len(self.turns)
+        for turn in reversed(self.turns):
+            if used + turn.tokens > budget:
+                break
+            used += turn.tokens
+            start -= 1
+        return start, used
+
+    def _cached(self, kind, budget, render):
+        start, used = self._window_start(budget)
+        key = (kind, start)
+        if key not in self._cache:
+            turns = list(self.turns)[start:]
+            self._cache[key] = render(turns)
+        return self._cache[key], used, start
+
+    def history_str(self, budget=None):
+        """
+        :return: (对话历史字符串, token 数, 预算外被丢弃的轮数)
+        """
+        history_str, used, start = self._cached(
+            "str", budget, lambda turns: "\n".join(turn.render() for turn in turns))
+        return history_str, used, start + self.total_turns - len(self.turns)
+
+    def history_messages(self, budget=None):
+        """
+        :return: (messages 列表的副本, token 数)；调用方在末尾追加本轮问题
+        """
+        messages, used, _ = self._cached(
+            "messages", budget, lambda turns: [message for turn in turns for message in turn.messages()])
+        return list(messages), used
@@ -1,15 +1,257 @@
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+import httpx
 from loguru import logger
-from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams, Batch
-from qdrant_client.http.exceptions import UnexpectedResponse  # 捕获错误信息
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http.models import (Distance, VectorParams, Batch, FieldCondition, Filter, FilterSelector,
+                                       HnswConfigDiff, MatchAny, MatchValue, PayloadSchemaType,
+                                       QuantizationSearchParams, ScalarQuantization, ScalarQuantizationConfig,
+                                       ScalarType, SearchParams)
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse  # 捕获错误信息
+
+from circuit_breaker import CircuitBreaker, guard_client
+from config import (EMBEDDING_DIMENSION, QDRANT_BACKOFF_BASE, QDRANT_BACKOFF_MAX, QDRANT_COLLECTION_PROFILE,
+                    QDRANT_COLLECTION_PROFILES, QDRANT_CONSISTENCY_TIMEOUT, QDRANT_GRPC_PORT, QDRANT_HOST,
+                    QDRANT_MAX_CONNECTIONS, QDRANT_MAX_KEEPALIVE_CONNECTIONS, QDRANT_PORT, QDRANT_PREFER_GRPC,
+                    QDRANT_SCROLL_PAGE_SIZE, QDRANT_SEARCH_PARAMS_CACHE_SIZE, QDRANT_SEARCH_PARAMS_CACHE_TTL,
+                    QDRANT_TIMEOUT, QDRANT_SEARCH_PARALLEL, QDRANT_UPSERT_BATCH_SIZE, QDRANT_UPSERT_PARALLEL,
+                    QDRANT_UPSERT_RETRIES, QDRANT_UPSERT_WAIT)
+from rate_limiter import backoff_delay
+from ttl_cache import TTLCache
+
+# 节点 id 的低 20 位是 chunk 序号，高位是文档 id 的哈希
+_CHUNK_INDEX_BITS = 20
+
+_upsert_executor = None
+_executor_lock = threading.Lock()
+
+# (集合名, 当前配置名) -> 该集合的 SearchParams，Qdrant 和 AsyncQdrant 共用
+_search_params_cache = TTLCache(QDRANT_SEARCH_PARAMS_CACHE_SIZE, QDRANT_SEARCH_PARAMS_CACHE_TTL)
+
+# 事件循环 -> 检索信号量：进程内所有 AsyncQdrant 共用，QDRANT_SEARCH_PARALLEL 是整个进程同时在途的检索请求数
+_search_semaphores = weakref.WeakKeyDictionary()
+
+_shared_client = None
+_shared_async_client = None
+_client_lock = threading.Lock()
+
+
+def is_not_found(error) -> bool:
+    # 集合不存在：REST 返回 404，本地模式抛出 ValueError，gRPC 返回 NOT_FOUND
+    if isinstance(error, ValueError):
+        return True
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code == 404
+    code = getattr(error, "code", None)
+    return callable(code) and getattr(code(), "name", None) == "NOT_FOUND"
+
+
+def is_already_exists(error) -> bool:
+    # 集合已存在：REST 返回 409（旧版本为 400 加错误信息），本地模式抛出 ValueError，gRPC 返回 ALREADY_EXISTS
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code == 409 or (
+            error.status_code == 400 and b"already exists" in (error.content or b""))
+    if isinstance(error, ValueError):
+        return "already exists" in str(error)
+    code = getattr(error, "code", None)
+    return callable(code) and getattr(code(), "name", None) == "ALREADY_EXISTS"
+
+
+def is_qdrant_error(error) -> bool:
+    # Qdrant 客户端抛出的错误（HTTP 响应、连接和超时、gRPC），与调用方自身的错误区分
+    return isinstance(error, (UnexpectedResponse, ResponseHandlingException, httpx.TransportError, grpc.RpcError))
+
+
+def is_qdrant_failure(error) -> bool:
+    """
+    断路器是否计入失败：连接错误、超时和 5xx 计入；4xx（集合不存在、参数错误）说明 Qdrant 正常响应，不计入。
+    """
+    if is_not_found(error):
+        return False
+    if isinstance(error, UnexpectedResponse):
+        return error.status_code is None or error.status_code >= 500
+    code = getattr(error, "code", None)
+    if callable(code):
+        return getattr(code(), "name", None) in ("UNAVAILABLE", "DEADLINE_EXCEEDED", "INTERNAL", "UNKNOWN")
+    return True
+
+
+# Qdrant 和 AsyncQdrant 的所有请求共用一个断路器
+qdrant_breaker = CircuitBreaker("Qdrant", is_failure=is_qdrant_failure)
+
+
+def point_id(doc_id: str, chunk_index: int) -> int:
+    """
+    由 (文档 id, chunk 序号) 生成确定的节点 id，重试同一批次时覆盖写入而不会产生重复节点。
+    同一文档的节点 id 按 chunk 序号递增，按 id 排序即可还原文档顺序。
+    """
+    if not 0 <= chunk_index < (1 << _CHUNK_INDEX_BITS):
+        raise ValueError(f"chunk_index 超出范围: {chunk_index}")
+    # 取 43 位哈希作为高位，整个 id 不超过 63 位
+    doc_hash = int.from_bytes(hashlib.blake2b(doc_id.encode('utf-8'), digest_size=6).digest(), 'big') >> 5
+    return (doc_hash << _CHUNK_INDEX_BITS) | chunk_index
+
+
+def _client_kwargs(prefer_grpc):
+    return dict(
+        host=QDRANT_HOST,
+        port=QDRANT_PORT,
+        grpc_port=QDRANT_GRPC_PORT,
+        prefer_grpc=prefer_grpc,
+        timeout=QDRANT_TIMEOUT,
+        limits=httpx.Limits(max_connections=QDRANT_MAX_CONNECTIONS,
+                            max_keepalive_connections=QDRANT_MAX_KEEPALIVE_CONNECTIONS),
+    )
+
+
+def create_client(prefer_grpc=QDRANT_PREFER_GRPC):
+    """
+    按 config 创建 QdrantClient。REST 传输使用显式的连接池限制以保持长连接；
+    gRPC 传输复用同一条 HTTP/2 通道。
+    """
+    return QdrantClient(**_client_kwargs(prefer_grpc))
+
+
+def get_client():
+    """
+    进程内共享的 QdrantClient，首次使用时创建。
+    客户端是线程安全的，Gradio 的各个工作线程和检索/写入线程池共用它的连接池。
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _client_lock:
+            if _shared_client is None:
+                _shared_client = create_client()
+                logger.info(f"创建共享的 Qdrant 客户端：{QDRANT_HOST}:"
+                            f"{QDRANT_GRPC_PORT if QDRANT_PREFER_GRPC else QDRANT_PORT}，"
+                            f"传输：{'gRPC' if QDRANT_PREFER_GRPC else 'REST'}")
+    return _shared_client
+
+
+def get_async_client():
+    """
+    进程内共享的 AsyncQdrantClient，首次使用时创建。
+    异步客户端的连接绑定在创建它的事件循环上，只应在 Gradio 的事件循环中使用。
+    """
+    global _shared_async_client
+    if _shared_async_client is None:
+        with _client_lock:
+            if _shared_async_client is None:
+                _shared_async_client = AsyncQdrantClient(**_client_kwargs(QDRANT_PREFER_GRPC))
+    return _shared_async_client
+
+
+def check_health(client=None):
+    """
+    启动时检查 Qdrant 是否可用，顺带建立首个连接（gRPC 通道）。
+
+    Returns:
+        bool: 可用返回 True，否则记录错误并返回 False
+    """
+    client = client or get_client()
+    start = time.perf_counter()
+    try:
+        collections = client.get_collections().collections
+    except Exception as e:
+        logger.error(f"Qdrant 健康检查失败：{QDRANT_HOST}，错误：{e}")
+        return False
+    logger.info(f"Qdrant 健康检查通过，集合数：{len(collections)}，"
+                f"耗时：{(time.perf_counter() - start) * 1000:.1f}ms")
+    return True
+
+
+def point_doc_key(point_id) -> int:
+    # point_id 的高位部分：同一文档的节点相同，用于判断两个节点是否属于同一文档
+    return point_id >> _CHUNK_INDEX_BITS
 
-from config import QDRANT_HOST, QDRANT_PORT
+
+def collection_profile_name(collection_info, preferred=QDRANT_COLLECTION_PROFILE):
+    """
+    由集合创建时的存储配置（量化、向量和 HNSW 索引是否落盘）反推调优配置名，优先匹配 preferred；
+    都不匹配时返回 None。
+    """
+    config = collection_info.config
+    quantized = config.quantization_config is not None
+    vectors_on_disk = bool(getattr(config.params.vectors, "on_disk", None))
+    hnsw_on_disk = bool(config.hnsw_config.on_disk)
+    names = [preferred] + [name for name in QDRANT_COLLECTION_PROFILES if name != preferred]
+    for name in names:
+        profile = QDRANT_COLLECTION_PROFILES[name]
+        if (bool(profile.get("quantization")) == quantized and bool(profile.get("on_disk")) == vectors_on_disk
+                and bool(profile.get("hnsw_on_disk")) == hnsw_on_disk):
+            return name
+    return None
+
+
+def forget_search_params(collection_name):
+    for profile_name in QDRANT_COLLECTION_PROFILES:
+        _search_params_cache.pop((collection_name, profile_name))
+
+
+def _get_search_semaphore():
+    # asyncio.Semaphore 只能在一个事件循环中使用，每个事件循环一个（应用只有一个事件循环）
+    loop = asyncio.get_running_loop()
+    semaphore = _search_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _search_semaphores[loop] = asyncio.Semaphore(QDRANT_SEARCH_PARALLEL)
+    return semaphore
+
+
+def _get_upsert_executor():
+    global _upsert_executor
+    if _upsert_executor is None:
+        with _executor_lock:
+            if _upsert_executor is None:
+                _upsert_executor = ThreadPoolExecutor(
+                    max_workers=QDRANT_UPSERT_PARALLEL, thread_name_prefix="qdrant-upsert")
+    return _upsert_executor
 
 
 class Qdrant:
-    def __init__(self):
-        self.client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)  # 创建客户端实例
-        self.size = 1536  # openai embedding 维度 = 1536
+    def __init__(self, profile=QDRANT_COLLECTION_PROFILE, client=None):
+        # 默认使用进程内共享的客户端；所有请求经过断路器，Qdrant 不可用时快速失败
+        self.client = guard_client(client or get_client(), qdrant_breaker)
+        self.size = EMBEDDING_DIMENSION  # openai embedding 维度 = 1536
+        self.profile_name = profile
+        self.profile = QDRANT_COLLECTION_PROFILES[profile]  # 集合调优配置，见 config.QDRANT_COLLECTION_PROFILES
+        self.search_params = self.build_search_params(self.profile)
+
+    @staticmethod
+    def build_search_params(profile):
+        # 检索参数需要与创建集合时的调优配置匹配：量化集合检索时过采样并重打分
+        quantization = None
+        if profile.get("quantization"):
+            quantization = QuantizationSearchParams(
+                ignore=False,
+                rescore=profile.get("search_rescore", False),
+                oversampling=profile.get("search_oversampling"),
+            )
+        return SearchParams(hnsw_ef=profile.get("search_hnsw_ef"), quantization=quantization)
+
+    @staticmethod
+    def resolve_search_params(collection_name, collection_info, profile_name):
+        # 按集合实际的调优配置生成检索参数；无法识别时使用当前配置
+        name = collection_profile_name(collection_info, profile_name)
+        if name is None:
+            logger.warning(f"无法识别集合的调优配置，使用当前配置 {profile_name} 的检索参数 | "
+                           f"collection_name: {collection_name}")
+            name = profile_name
+        return Qdrant.build_search_params(QDRANT_COLLECTION_PROFILES[name])
+
+    def get_search_params(self, collection_name):
+        key = (collection_name, self.profile_name)
+        search_params = _search_params_cache.get(key)
+        if search_params is None:
+            search_params = self.resolve_search_params(
+                collection_name, self.get_collection(collection_name), self.profile_name)
+            _search_params_cache.set(key, search_params)
+        return search_params
 
     def get_points_count(self, collection_name):
         """
@@ -28,21 +270,107 @@ class Qdrant:
         """
         try:
             collection_info = self.get_collection(collection_name)
-        except (UnexpectedResponse, ValueError) as e:  # 集合不存在，创建新的集合
-            if self.create_collection(collection_name):
+        except Exception as e:
+            if not is_not_found(e):
+                # 连接失败、5xx 或断路器断开：不能当作集合不存在去重建集合
+                logger.error(f"获取集合信息时发生错误 | collection_name：{collection_name} 错误信息:{e}")
+                return -1  # 返回错误码或其他适当的值
+            # 集合不存在，创建新的集合
+            try:
+                created = self.create_collection(collection_name)
+                if not created:
+                    # 并发的请求先创建了该集合，重新读取节点数
+                    collection_info = self.get_collection(collection_name)
+            except Exception as create_error:
+                logger.error(f"创建集合失败 | collection_name：{collection_name} 错误信息:{create_error}")
+                return -1
+            if created:
                 logger.success(f"创建集合成功 | collection_name：{collection_name} points_count: 0")
                 return 0
-            else:
-                logger.error(f"创建集合失败 | collection_name：{collection_name} 错误信息:{e}")
-                return -1
-        except Exception as e:
-            logger.error(f"获取集合信息时发生错误 | collection_name：{collection_name} 错误信息:{e}")
-            return -1  # 返回错误码或其他适当的值
+            points_count = collection_info.points_count
+            logger.success(f"库里已有该集合 | collection_name：{collection_name} points_count：{points_count}")
+            return points_count
         else:
             points_count = collection_info.points_count
             logger.success(f"库里已有该集合 | collection_name：{collection_name} points_count：{points_count}")
             return points_count
 
+    def get_document_points_count(self, collection_name, doc_id):
+        """
+        共享集合模式下获取某个文档的节点数。共享集合不存在时先创建集合和 doc_id 索引。
+
+        Returns:
+            points_count: 该文档的节点数；创建集合失败或发生错误时返回 -1。
+        """
+        try:
+            self.ensure_shared_collection(collection_name)
+            points_count = self.client.count(
+                collection_name=collection_name,
+                count_filter=self.doc_filter([doc_id]),
+                exact=True,
+            ).count
+        except Exception as e:
+            logger.error(f"获取文档节点数时发生错误 | collection_name：{collection_name} doc_id：{doc_id} 错误信息:{e}")
+            return -1
+        logger.success(f"共享集合 | collection_name：{collection_name} doc_id：{doc_id} points_count：{points_count}")
+        return points_count
+
+    def ensure_shared_collection(self, collection_name):
+        """
+        共享集合不存在时创建集合，并为 doc_id 字段建立关键字索引。
+        两步都是幂等的：并发的首次上传或迁移脚本同时执行时，已存在视为成功，绝不重建共享集合。
+        """
+        if self.has_collection(collection_name):
+            return
+        if self.create_collection(collection_name):
+            logger.success(f"创建共享集合成功 | collection_name：{collection_name}")
+        try:
+            self.client.create_payload_index(
+                collection_name=collection_name,
+                field_name="doc_id",
+                field_schema=PayloadSchemaType.KEYWORD,
+                wait=True,
+            )
+        except Exception as e:
+            if not is_already_exists(e):
+                raise
+
+    def delete_document(self, collection_name, doc_id):
+        # 删除共享集合中某个文档的所有节点
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=FilterSelector(filter=self.doc_filter([doc_id])),
+            wait=True,
+        )
+
+    @staticmethod
+    def doc_filter(doc_ids):
+        # 按 doc_id 过滤节点的条件
+        if len(doc_ids) == 1:
+            match = MatchValue(value=doc_ids[0])
+        else:
+            match = MatchAny(any=list(doc_ids))
+        return Filter(must=[FieldCondition(key="doc_id", match=match)])
+
+    def has_collection(self, collection_name) -> bool:
+        try:
+            self.get_collection(collection_name)
+            return True
+        except Exception as e:
+            # 只有集合不存在返回 False；Qdrant 不可用时向上抛出，避免被当作集合不存在
+            if is_not_found(e):
+                return False
+            raise
+
+    def has_points(self, collection_name) -> bool:
+        """集合存在且有节点时返回 True；与 get_points_count 不同，集合不存在时不会创建。"""
+        try:
+            return self.get_collection(collection_name).points_count > 0
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+
     def list_all_collection_names(self):
         """
         CollectionsResponse类型举例：
@@ -75,59 +403,267 @@ class Qdrant:
     # 创建集合
     def create_collection(self, collection_name) -> bool:
         """
-        创建集合。
+        创建集合。集合已存在时不做任何修改（不会重建，已有节点不受影响）。
 
         Args:
             collection_name (str, optional): 自定义的集合名称。如果未提供，则使用默认的self.collection_name。
 
         Returns:
-            bool: 如果成功创建集合，则返回True；否则返回False。
+            bool: 如果成功创建集合，则返回True；集合已存在（例如被并发的请求先创建）时返回False。
         """
-        return self.client.recreate_collection(collection_name=collection_name, vectors_config=VectorParams(size=self.size, distance=Distance.COSINE), )
+        profile = self.profile
+        quantization_config = None
+        if profile.get("quantization") == "int8":
+            quantization_config = ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=profile.get("quantization_always_ram", True),
+                )
+            )
+        try:
+            created = self.client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(size=self.size, distance=Distance.COSINE, on_disk=profile.get("on_disk")),
+                hnsw_config=HnswConfigDiff(
+                    m=profile.get("hnsw_m"),
+                    ef_construct=profile.get("hnsw_ef_construct"),
+                    on_disk=profile.get("hnsw_on_disk"),
+                ),
+                on_disk_payload=profile.get("on_disk_payload"),
+                quantization_config=quantization_config,
+            )
+        except Exception as e:
+            if not is_already_exists(e):
+                raise
+            logger.info(f"集合已存在 | collection_name：{collection_name}")
+            return False
+        if created:
+            _search_params_cache.set((collection_name, self.profile_name), self.search_params)
+        return created
 
-    def add_points(self, collection_name, vectors, payloads):
-        # 将数据点添加到Qdrant
-        self.client.upsert(
-            collection_name=collection_name,
-            wait=True,
-            points=Batch(
-                ids=list(range(1, len(vectors) + 1)),
-                payloads=payloads,
-                vectors=vectors
+    def delete_collection(self, collection_name):
+        # 同名集合可能以其他调优配置重建，删除时清掉缓存的检索参数
+        try:
+            return self.client.delete_collection(collection_name=collection_name)
+        finally:
+            forget_search_params(collection_name)
+
+    def add_points(self, collection_name, vectors, payloads, ids=None, start_id=1, wait=QDRANT_UPSERT_WAIT):
+        """
+        插入节点。节点按 QDRANT_UPSERT_BATCH_SIZE 切成多个请求，由 QDRANT_UPSERT_PARALLEL 个线程并发发送，
+        失败的请求单独重试（节点 id 确定，重试是幂等的）。
+
+        Args:
+            ids: 节点 id 列表；未提供时使用 start_id 开始的连续整数。
+            wait: 是否等待 Qdrant 完成写入再返回；为 False 时需要之后调用 wait_for_points 做一致性检查。
+
+        Returns:
+            bool: 全部请求成功时返回 True。
+        """
+        # get_embeddings 返回 NumPy 矩阵，Batch 需要嵌套列表
+        if hasattr(vectors, 'tolist'):
+            vectors = vectors.tolist()
+        if ids is None:
+            ids = list(range(start_id, start_id + len(vectors)))
+
+        batch_size = QDRANT_UPSERT_BATCH_SIZE
+        futures = [
+            _get_upsert_executor().submit(
+                self._upsert_batch,
+                collection_name,
+                ids[i:i + batch_size],
+                vectors[i:i + batch_size],
+                payloads[i:i + batch_size],
+                wait,
             )
-        )
+            for i in range(0, len(vectors), batch_size)
+        ]
+        for future in futures:
+            future.result()
         return True
 
+    def _upsert_batch(self, collection_name, ids, vectors, payloads, wait):
+        for i in range(QDRANT_UPSERT_RETRIES):
+            try:
+                self.client.upsert(
+                    collection_name=collection_name,
+                    wait=wait,
+                    points=Batch(
+                        ids=ids,
+                        payloads=payloads,
+                        vectors=vectors
+                    )
+                )
+                return
+            except Exception as e:
+                # 只重试连接错误、超时和 5xx；4xx、断路器断开和调用方自身的错误直接抛出
+                if i == QDRANT_UPSERT_RETRIES - 1 or not (is_qdrant_error(e) and is_qdrant_failure(e)):
+                    raise
+                delay = backoff_delay(i, base=QDRANT_BACKOFF_BASE, cap=QDRANT_BACKOFF_MAX)
+                logger.warning("插入节点第{}次重试，{:.2f} 秒后重试 | collection_name: {} points: {} 错误信息: {}",
+                               i + 1, delay, collection_name, len(ids), e)
+                time.sleep(delay)
+
+    def wait_for_points(self, collection_name, expected_count, timeout=QDRANT_CONSISTENCY_TIMEOUT, doc_id=None) -> bool:
+        """
+        一致性检查：等待集合中的节点数达到 expected_count（用于 wait=False 的插入）。
+
+        Returns:
+            bool: 在超时前达到预期节点数时返回 True。
+        """
+        deadline = time.time() + timeout
+        while True:
+            count = self.client.count(
+                collection_name=collection_name,
+                count_filter=self.doc_filter([doc_id]) if doc_id else None,
+                exact=True,
+            ).count
+            if count >= expected_count:
+                return True
+            if time.time() >= deadline:
+                logger.error(f"一致性检查超时 | collection_name: {collection_name} "
+                             f"expected: {expected_count} actual: {count}")
+                return False
+            time.sleep(0.5)
+
     # 搜索
-    def search(self, collection_name, query_vector, limit=3):
+    def search(self, collection_name, query_vector, limit=3, doc_ids=None):
+        # doc_ids：共享集合模式下只在这些文档的节点中检索
         return self.client.search(
             collection_name=collection_name,
             query_vector=query_vector,
+            query_filter=self.doc_filter(doc_ids) if doc_ids else None,
+            search_params=self.get_search_params(collection_name),
             limit=limit,
             with_payload=True
         )
 
-    def get_collection_content(self, collection_name, limit=1000):
-        # 获取ScoredPoint对象列表
-        scored_points = self.client.search(
-            collection_name=collection_name,
-            query_vector=[0.0] * self.size,
-            limit=limit,
-            with_payload=True
-        )
+    def iter_collection_content(self, collection_name, page_size=QDRANT_SCROLL_PAGE_SIZE, doc_id=None):
+        """
+        按 id 升序分页滚动读取集合，逐个产出节点的 page_content。
+        同一文档的节点 id 按 chunk 序号递增，产出顺序就是文档顺序；内存占用只与 page_size 有关。
 
-        # 将该对象列表按id升序排序
-        scored_points.sort(key=lambda point: point.id)
-        logger.info(f"当前集合：{collection_name} 的节点总数：{len(scored_points)}")
+        Args:
+            page_size: 每次 scroll 请求的节点数。
+            doc_id: 共享集合模式下只读取该文档的节点。
+        """
+        offset = None
+        points_count = 0
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=self.doc_filter([doc_id]) if doc_id else None,
+                limit=page_size,
+                offset=offset,
+                with_payload=['page_content'],
+                with_vectors=False,
+            )
+            points_count += len(records)
+            for record in records:
+                # payload表示向量的附加信息，每个payload都是一个字典，包含了page_content和metadata）
+                yield (record.payload or {}).get('page_content', '')
+            if offset is None:
+                break
+        logger.info(f"当前集合：{collection_name} 的节点总数：{points_count}")
 
-        # 提取每个ScoredPoint对象中的payload字典中的page_content
-        # payload表示向量的附加信息，每个payload都是一个字典，包含了page_content和metadata）
-        page_contents = [scored_point.payload.get('page_content', '') for scored_point in scored_points]
-        content = "".join(page_contents)
+    def get_collection_content(self, collection_name, page_size=QDRANT_SCROLL_PAGE_SIZE, doc_id=None):
+        # 拼接整个文档的内容；大文档请直接使用 iter_collection_content 流式读取
+        content = "".join(self.iter_collection_content(collection_name, page_size, doc_id))
         logger.trace(f"当前集合：{collection_name} 的内容字符数：{len(content)}")
         return content
 
 
+class AsyncQdrant:
+    """
+    检索路径的异步版本，基于 AsyncQdrantClient。等待 Qdrant 响应时不占用线程，
+    一个事件循环可以同时服务大量对话。集合的创建和写入仍由同步的 Qdrant 负责。
+    """
+
+    def __init__(self, profile=QDRANT_COLLECTION_PROFILE, client=None):
+        self.client = guard_client(client or get_async_client(), qdrant_breaker)
+        self.profile_name = profile
+
+    async def get_collection(self, collection_name):
+        return await self.client.get_collection(collection_name=collection_name)
+
+    async def has_collection(self, collection_name) -> bool:
+        try:
+            await self.get_collection(collection_name)
+            return True
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+
+    async def has_points(self, collection_name) -> bool:
+        """集合存在且有节点时返回 True；集合不存在时不会创建。"""
+        try:
+            return (await self.get_collection(collection_name)).points_count > 0
+        except Exception as e:
+            if is_not_found(e):
+                return False
+            raise
+
+    async def get_search_params(self, collection_name):
+        # 与 Qdrant.get_search_params 共用缓存
+        key = (collection_name, self.profile_name)
+        search_params = _search_params_cache.get(key)
+        if search_params is None:
+            search_params = Qdrant.resolve_search_params(
+                collection_name, await self.get_collection(collection_name), self.profile_name)
+            _search_params_cache.set(key, search_params)
+        return search_params
+
+    async def get_document_points_count(self, collection_name, doc_id):
+        """
+        共享集合模式下获取某个文档的节点数。与同步版本不同，共享集合不存在时直接返回 0，不创建集合。
+        """
+        if not await self.has_collection(collection_name):
+            return 0
+        result = await self.client.count(
+            collection_name=collection_name,
+            count_filter=Qdrant.doc_filter([doc_id]),
+            exact=True,
+        )
+        return result.count
+
+    async def search(self, collection_name, query_vector, limit=3, doc_ids=None):
+        # doc_ids：共享集合模式下只在这些文档的节点中检索
+        search_params = await self.get_search_params(collection_name)
+        async with _get_search_semaphore():
+            return await self.client.search(
+                collection_name=collection_name,
+                query_vector=query_vector,
+                query_filter=Qdrant.doc_filter(doc_ids) if doc_ids else None,
+                search_params=search_params,
+                limit=limit,
+                with_payload=True
+            )
+
+    async def search_collections(self, collection_names, query_vector, limit=3):
+        """
+        并发地在多个集合中检索。所有检索请求共用进程内的信号量，同时在途的请求数不超过 QDRANT_SEARCH_PARALLEL。
+
+        Returns:
+            list: 所有集合的 ScoredPoint 对象（未排序）。
+        """
+        if len(collection_names) == 1:
+            return await self.search(collection_names[0], query_vector, limit=limit)
+
+        async def timed_search(collection_name):
+            start = time.perf_counter()
+            scored_points = await self.search(collection_name, query_vector, limit=limit)
+            logger.debug(f"集合检索耗时 | collection_name: {collection_name} "
+                         f"points: {len(scored_points)} 耗时: {(time.perf_counter() - start) * 1000:.1f}ms")
+            return scored_points
+
+        results = []
+        for scored_points in await asyncio.gather(*(timed_search(name) for name in collection_names)):
+            results.extend(scored_points)
+        return results
+
+
 if __name__ == "__main__":
     qdrant = Qdrant()
 
@@ -155,3 +691,7 @@ if __name__ == "__main__":
     # collection_name = ""
     # content = qdrant.get_collection_content(collection_name)
     # print(content)
+
+    # 流式读取集合内容
+    # for page_content in qdrant.iter_collection_content(collection_name):
+    #     print(page_content)
@@ -0,0 +1,207 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+from loguru import logger
+
+from config import (EMBEDDING_CACHE_MAX_BYTES, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_TOUCH_FLUSH_INTERVAL,
+                    EMBEDDING_CACHE_TOUCH_FLUSH_SIZE)
+
+# SQLite 单条语句可绑定的参数个数有限，IN 查询按该大小分段
+_SQLITE_MAX_VARIABLES = 500
+
+
+class EmbeddingCache:
+    """
+    内容寻址的持久化 embedding 缓存。
+
+    键为 sha256(model + 文本)，值为 float32 向量的原始字节，存放在本地 SQLite 文件中。
+    向量数据总字节数超过 max_bytes 时，按 last_access 淘汰最近最少使用的条目。
+
+    查询只读：每个线程使用自己的只读连接，WAL 模式下并发查询互不阻塞；
+    命中条目的 last_access 先记在内存中，写入、淘汰前或积累足够多时由后台线程批量写入。
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES,
+                 touch_flush_size=EMBEDDING_CACHE_TOUCH_FLUSH_SIZE,
+                 touch_flush_interval=EMBEDDING_CACHE_TOUCH_FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_flush_size = touch_flush_size
+        self.touch_flush_interval = touch_flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # 保护写连接
+        self._touch_lock = threading.Lock()  # 保护 _pending_touches 和命中统计
+        self._pending_touches = {}  # key -> 最近一次命中的时间
+        self._last_touch_flush = time.monotonic()
+        self._touch_flush_scheduled = False
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_access REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        atexit.register(self.flush_touches)
+
+    def _reader(self) -> sqlite3.Connection:
+        # 当前线程的只读连接
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """
+        批量查询缓存。
+        :return: {texts 中的下标: float32 向量}，未命中的下标不在结果中
+        """
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        conn = self._reader()
+        for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+            part = list(set(keys[i:i + _SQLITE_MAX_VARIABLES]))
+            rows = conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part)
+            found.update(rows)
+
+        result = {}
+        for i, key in enumerate(keys):
+            vector = found.get(key)
+            if vector is not None:
+                result[i] = np.frombuffer(vector, dtype=np.float32)
+        self._touch(found, len(result), len(keys) - len(result))
+        return result
+
+    def _touch(self, keys, hits, misses):
+        # 记录命中，last_access 延后批量写入
+        now = time.time()
+        with self._touch_lock:
+            self.hits += hits
+            self.misses += misses
+            for key in keys:
+                self._pending_touches[key] = now
+            due = self._pending_touches and not self._touch_flush_scheduled and (
+                len(self._pending_touches) >= self.touch_flush_size
+                or time.monotonic() - self._last_touch_flush >= self.touch_flush_interval)
+            if due:
+                self._touch_flush_scheduled = True
+        if due:
+            threading.Thread(target=self.flush_touches, name="embedding-cache-touch", daemon=True).start()
+
+    def _take_touches(self):
+        with self._touch_lock:
+            touches, self._pending_touches = self._pending_touches, {}
+            self._last_touch_flush = time.monotonic()
+            self._touch_flush_scheduled = False
+        return touches
+
+    def _write_touches(self, touches):
+        # 调用方持有 self._lock
+        if touches:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in touches.items()])
+
+    def flush_touches(self):
+        """把内存中积累的 last_access 更新写入缓存文件。"""
+        with self._lock:
+            touches = self._take_touches()
+            if touches:
+                self._write_touches(touches)
+                self._conn.commit()
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.time()
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            data = vector.tobytes()
+            rows[self.make_key(model, text)] = (model, data, len(data), now)
+        if not rows:
+            return
+
+        with self._lock:
+            # 顺带写入积累的 last_access，淘汰时按最新的访问时间排序
+            self._write_touches(self._take_touches())
+            # 覆盖已存在的键时先扣除旧条目的大小，保持字节计数准确
+            keys = list(rows)
+            for i in range(0, len(keys), _SQLITE_MAX_VARIABLES):
+                part = keys[i:i + _SQLITE_MAX_VARIABLES]
+                existing = self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part).fetchone()[0]
+                self._total_bytes -= existing
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                [(key, *row) for key, row in rows.items()])
+            self._total_bytes += sum(row[2] for row in rows.values())
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免每次写入都触发淘汰
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            keys = []
+            for key, size in rows:
+                if self._total_bytes <= target:
+                    break
+                keys.append((key,))
+                self._total_bytes -= size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+            evicted += len(keys)
+        logger.info(f"embedding 缓存淘汰 | evicted: {evicted} bytes: {self._total_bytes}")
+
+    def stats(self) -> dict:
+        entries = self._reader().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        with self._touch_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "bytes": self._total_bytes,
+            }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """进程内共享的 EmbeddingCache 实例，首次调用时打开缓存文件。"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                _embedding_cache = EmbeddingCache()
+    return _embedding_cache
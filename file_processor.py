@@ -1,7 +1,26 @@
 import hashlib
 import os
+import re
 from typing import Any, Dict, List, Union
 
+from loguru import logger
+
+from config import (FILE_DIGEST_ALGORITHM, FILE_DIGEST_CACHE_SIZE, FILE_DIGEST_CACHE_TTL,
+                    FILE_DIGEST_LEGACY_MD5, FILE_HASH_BUFFER_SIZE)
+import tracing
+from ttl_cache import TTLCache
+
+try:
+    import xxhash
+except ImportError:  # xxhash 是可选依赖
+    xxhash = None
+
+# (绝对路径, 文件大小, 修改时间, 摘要算法) -> 文件摘要
+_file_digest_cache = TTLCache(FILE_DIGEST_CACHE_SIZE, FILE_DIGEST_CACHE_TTL)
+
+# collection_name_for 生成的集合名：MD5 摘要，或带算法前缀的 blake2b / xxhash 摘要（都是 128 位）
+COLLECTION_NAME_PATTERN = re.compile(r"^(?:(?:blake2b|xxhash)_)?[0-9a-f]{32}$")
+
 
 class FileProcessor:
     # 定义允许处理的文件后缀列表，作为类属性
@@ -30,9 +49,104 @@ class FileProcessor:
     # 获取文件MD5值
     # todo @staticmethod
     def get_file_md5(self):
-        file_bytes = self.get_file_bytes(self.file_path)
-        file_md5 = self.calculate_md5(file_bytes)
-        return file_md5
+        return self.hash_file(self.file_path, ['md5'])['md5']
+
+    def get_document_handle(self, algorithm: str = FILE_DIGEST_ALGORITHM) -> Dict[str, Any]:
+        """
+        获取文件的文档句柄，上传时生成一次，之后的问答直接使用其中的集合名。
+
+        Returns:
+            dict: file_path、file_name、size、mtime、digest、digest_algorithm、md5、
+            collection_name（由摘要得到的集合名）、legacy_collection_name（以 MD5 命名的旧集合名，仅非 md5 算法时存在）
+        """
+        algorithm = self.resolve_digest_algorithm(algorithm)
+        algorithms = [algorithm]
+        if algorithm != 'md5' and FILE_DIGEST_LEGACY_MD5:
+            algorithms.append('md5')
+        stat = os.stat(self.file_path)
+        digests = self.get_cached_file_digests(self.file_path, algorithms, stat)
+        document = {
+            'file_path': self.file_path,
+            'file_name': self.get_file_name(),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'digest': digests[algorithm],
+            'digest_algorithm': algorithm,
+            'md5': digests.get('md5'),
+            'collection_name': self.collection_name_for(digests[algorithm], algorithm),
+        }
+        if algorithm != 'md5' and digests.get('md5'):
+            document['legacy_collection_name'] = digests['md5']
+        return document
+
+    @staticmethod
+    def collection_name_for(digest: str, algorithm: str) -> str:
+        # MD5 摘要直接作为集合名（兼容已有集合），其他算法加上算法前缀避免混淆
+        return digest if algorithm == 'md5' else f"{algorithm}_{digest}"
+
+    @staticmethod
+    def is_collection_name(name: str) -> bool:
+        # 是否是 collection_name_for 生成的集合名（128 位摘要的十六进制），用于区分本应用的集合和节点上的其他集合
+        return COLLECTION_NAME_PATTERN.match(name) is not None
+
+    @staticmethod
+    def resolve_digest_algorithm(algorithm: str) -> str:
+        if algorithm == 'xxhash' and xxhash is None:
+            logger.warning("未安装 xxhash，文件摘要算法回退到 blake2b")
+            return 'blake2b'
+        if algorithm not in ('md5', 'blake2b', 'xxhash'):
+            raise ValueError(f"不支持的文件摘要算法: {algorithm}")
+        return algorithm
+
+    @staticmethod
+    def _new_hasher(algorithm: str):
+        if algorithm == 'md5':
+            return hashlib.md5()
+        if algorithm == 'blake2b':
+            return hashlib.blake2b(digest_size=16)
+        if algorithm == 'xxhash':
+            return xxhash.xxh3_128()
+        raise ValueError(f"不支持的文件摘要算法: {algorithm}")
+
+    @staticmethod
+    def hash_file(file_path: str, algorithms: List[str]) -> Dict[str, str]:
+        """
+        流式计算文件摘要：用 readinto 把文件分块读入复用的缓冲区，峰值内存只有一个缓冲区大小。
+        多个算法在同一次读取中一起计算。
+
+        Returns:
+            dict: 算法 -> 十六进制摘要
+        """
+        hashers = {algorithm: FileProcessor._new_hasher(algorithm) for algorithm in algorithms}
+        buffer = bytearray(FILE_HASH_BUFFER_SIZE)
+        view = memoryview(buffer)
+        with tracing.span("hash"), open(file_path, 'rb', buffering=0) as file:
+            while True:
+                size = file.readinto(buffer)
+                if not size:
+                    break
+                for hasher in hashers.values():
+                    hasher.update(view[:size])
+        return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+    @staticmethod
+    def get_cached_file_digests(file_path: str, algorithms: List[str], stat: os.stat_result = None) -> Dict[str, str]:
+        """
+        获取文件摘要，按 (路径, 大小, 修改时间, 算法) 缓存；文件未变化时不会重新读取文件。
+        """
+        stat = stat or os.stat(file_path)
+        file_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        digests = {}
+        for algorithm in algorithms:
+            digest = _file_digest_cache.get(file_key + (algorithm,))
+            if digest is not None:
+                digests[algorithm] = digest
+        missing = [algorithm for algorithm in algorithms if algorithm not in digests]
+        if missing:
+            for algorithm, digest in FileProcessor.hash_file(file_path, missing).items():
+                _file_digest_cache.set(file_key + (algorithm,), digest)
+                digests[algorithm] = digest
+        return digests
 
     @staticmethod
     def get_file_bytes(file_path: str):
@@ -1,12 +1,40 @@
+import bisect
+import copy
+import hashlib
+import itertools
+import math
+import multiprocessing
 import os
-from typing import List
+import threading
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import pdfplumber
 import tiktoken
 
-from config import CHUNK_OVERLAP, CHUNK_SIZE
+from config import (CHUNK_OVERLAP, CHUNK_SIZE, DEFAULT_TIKTOKEN_ENCODING, MODELS, PDF_EXTRACT_WORKERS,
+                    PDF_PARALLEL_MIN_PAGES, TEXT_SPLIT_SEPARATORS, TOKEN_COUNT_CACHE_SIZE,
+                    TOKEN_COUNT_THREADS, TXT_READ_BLOCK_CHARS)
 from langchain.schema import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+import tracing
+
+
+# 进程级 tokenizer 注册表：model -> Encoding，每个模型的编码器只解析一次
+_ENCODINGS: Dict[str, tiktoken.Encoding] = {}
+_ENCODINGS_LOCK = threading.Lock()
+
+# 文本 token 数的记忆化缓存（LRU）：(encoding_name, 文本摘要) -> token 数
+# 对话历史等重复出现的字符串无需反复编码；键只保存 16 字节摘要，内存占用与文本长度无关
+_TOKEN_COUNT_CACHE: "OrderedDict[tuple, int]" = OrderedDict()
+_TOKEN_COUNT_CACHE_LOCK = threading.Lock()
+
+# PDF 提取共用的进程池，首次使用时创建，避免每个 PDF 都启动和销毁一组进程
+_PDF_POOL = None
+_PDF_POOL_LOCK = threading.Lock()
 
 
 class FileProcessorHelper:
@@ -24,10 +52,14 @@ class FileProcessorHelper:
 
     # 获取docs
     def file_to_docs(self) -> List:
+        return list(self.iter_file_docs())
+
+    # 逐页（逐块）产出docs，不把整个文件的内容同时放在内存里
+    def iter_file_docs(self) -> Iterator[Document]:
 
         strategy_mapping = {
-            '.pdf': self.pdf_file_to_docs,
-            '.txt': self.txt_file_to_docs,
+            '.pdf': self.iter_pdf_docs,
+            '.txt': self.iter_txt_docs,
             # '.doc': self.word_file_to_docs,
             # '.docx': self.word_file_to_docs,
             # '.md': self.md_file_to_docs,
@@ -49,61 +81,159 @@ class FileProcessorHelper:
             # '.mp4': self.video_file_to_docs,
         }
         func = strategy_mapping.get(self.file_extension)
-        return func(self.file_path)
+        return tracing.traced_iter("extract", func(self.file_path))
 
     # 切分docs
     def split_docs(self, docs):
-        # 切分
-        text_splitter = RecursiveCharacterTextSplitter(
+        # 切分：每页只编码一次，按 token 偏移切块
+        text_splitter = TokenOffsetTextSplitter(
             chunk_size=CHUNK_SIZE,
             chunk_overlap=CHUNK_OVERLAP,
-            length_function=self.tiktoken_len,
         )
         texts = [doc.page_content for doc in docs]
         metadatas = [doc.metadata for doc in docs]
         docs = text_splitter.create_documents(texts, metadatas=metadatas)
         return docs
 
+    # 逐个切分docs，与 iter_file_docs 组成流式管道
+    def iter_split_docs(self, docs: Iterable[Document]) -> Iterator[Document]:
+        text_splitter = TokenOffsetTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+        )
+        for doc in docs:
+            with tracing.span("split"):
+                chunks = text_splitter.create_documents([doc.page_content], metadatas=[doc.metadata])
+            yield from chunks
+
     @staticmethod
-    def pdf_file_to_docs(file_path: str) -> List[Document]:
+    def pdf_file_to_docs(file_path: str, workers: int = PDF_EXTRACT_WORKERS) -> List[Document]:
+        return list(FileProcessorHelper.iter_pdf_docs(file_path, workers))
+
+    @staticmethod
+    def iter_pdf_docs(file_path: str, workers: int = PDF_EXTRACT_WORKERS) -> Iterator[Document]:
         file_name = os.path.basename(file_path)
 
-        docs = []
         with pdfplumber.open(file_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    doc = Document(
-                        page_content=page_text,
-                        metadata=dict(
-                            {
-                                "file_name": file_name,
-                                "page": page.page_number,
-                                "total_pages": len(pdf.pages),
-                            },
-                            **{
-                                k: pdf.metadata[k]
-                                for k in pdf.metadata
-                                if isinstance(pdf.metadata[k], (str, int))
-                            },
-                        ),
-                    )
-                    docs.append(doc)
-        return docs
+            total_pages = len(pdf.pages)
+            pdf_metadata = {
+                k: pdf.metadata[k]
+                for k in pdf.metadata
+                if isinstance(pdf.metadata[k], (str, int))
+            }
+
+        for page_number, page_text in FileProcessorHelper.iter_pdf_pages(file_path, total_pages, workers):
+            if page_text:
+                yield Document(
+                    page_content=page_text,
+                    metadata=dict(
+                        {
+                            "file_name": file_name,
+                            "page": page_number,
+                            "total_pages": total_pages,
+                        },
+                        **pdf_metadata,
+                    ),
+                )
+
+    @staticmethod
+    def extract_pdf_pages(file_path: str, page_count: int, workers: int = PDF_EXTRACT_WORKERS) -> List[Tuple[int, str]]:
+        """
+        提取 PDF 前 page_count 页的文本，返回按页码升序的 [(页码, 文本), ...]。
+        """
+        return list(FileProcessorHelper.iter_pdf_pages(file_path, page_count, workers))
+
+    @staticmethod
+    def iter_pdf_pages(file_path: str, page_count: int, workers: int = PDF_EXTRACT_WORKERS) -> Iterator[Tuple[int, str]]:
+        """
+        按页码升序逐页产出 PDF 前 page_count 页的 (页码, 文本)。
+        页数较多时按页码区间切分，交给进程池并行提取，每个进程自己打开 PDF；
+        同时在途的区间数有上限，下游消费慢时不会把整个文件的文本都堆在内存里。
+        """
+        if workers <= 1 or page_count < PDF_PARALLEL_MIN_PAGES:
+            with pdfplumber.open(file_path) as pdf:
+                for page in pdf.pages[:page_count]:
+                    yield page.page_number, page.extract_text()
+            return
+
+        # 每个进程分到多个区间，页面提取耗时不均时也能保持负载均衡
+        pages_per_task = max(1, math.ceil(page_count / (workers * 4)))
+        ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+        # 进程池由所有 PDF 共用，workers 限制的是本文件同时在途的区间数
+        max_in_flight = workers * 2
+        pool = _get_pdf_pool()
+        # 按提交顺序取结果，页码顺序不变
+        futures = deque()
+        try:
+            for start, end in ranges:
+                futures.append(pool.submit(_extract_pdf_page_range, file_path, start, end))
+                if len(futures) >= max_in_flight:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+        except BrokenProcessPool:
+            # worker 进程异常退出后进程池不可再用，丢弃后下次使用时重新创建
+            _discard_pdf_pool(pool)
+            raise
+        finally:
+            # 下游提前停止消费时，取消尚未开始的区间
+            for future in futures:
+                future.cancel()
 
     @staticmethod
     def txt_file_to_docs(file_path: str) -> List[Document]:
+        return list(FileProcessorHelper.iter_txt_docs(file_path))
+
+    @staticmethod
+    def iter_txt_docs(file_path: str, block_chars: int = TXT_READ_BLOCK_CHARS) -> Iterator[Document]:
+        """
+        按块流式读取 txt 文件，每块在最后一个换行处断开，剩余部分并入下一块（整块没有换行时按块大小断开）。
+        """
         file_name = os.path.basename(file_path)
 
+        rest = ""
         with open(file_path, 'r') as file:
-            text = file.read()
-        if not text:
-            return []
-        return [
-            Document(
-                page_content=text,
-                metadata={
-                    "file_name": file_name})]
+            while True:
+                block = file.read(block_chars)
+                if not block:
+                    break
+                text = rest + block
+                cut = text.rfind("\n")
+                if cut < 0:
+                    # 整块都没有换行时按块大小断开，避免剩余部分无限增长
+                    cut = len(text) - 1
+                text, rest = text[:cut + 1], text[cut + 1:]
+                if text.strip():
+                    yield Document(page_content=text, metadata={"file_name": file_name})
+        if rest.strip():
+            yield Document(page_content=rest, metadata={"file_name": file_name})
+
+    @staticmethod
+    def get_encoding(model: str = "gpt-3.5-turbo") -> tiktoken.Encoding:
+        """
+        从进程级注册表获取模型对应的编码器，首次使用时解析并缓存。
+        tiktoken 不认识的模型（如较新的模型）回退到 DEFAULT_TIKTOKEN_ENCODING。
+        :param model: 模型名称
+        :return: tiktoken.Encoding
+        """
+        encoding = _ENCODINGS.get(model)
+        if encoding is not None:
+            return encoding
+        with _ENCODINGS_LOCK:
+            encoding = _ENCODINGS.get(model)
+            if encoding is None:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    encoding = tiktoken.get_encoding(DEFAULT_TIKTOKEN_ENCODING)
+                _ENCODINGS[model] = encoding
+        return encoding
+
+    @staticmethod
+    def preload_encodings(models: List[str] = MODELS):
+        """预先解析 MODELS 中所有模型的编码器，避免首个请求承担加载开销。"""
+        for model in models:
+            FileProcessorHelper.get_encoding(model)
 
     @staticmethod
     def tiktoken_len(text, model="gpt-3.5-turbo"):
@@ -113,14 +243,220 @@ class FileProcessorHelper:
         :param model:
         :return:
         """
-        # use cl100k_base tokenizer for gpt-3.5-turbo and gpt-4
-        encoding = tiktoken.get_encoding('cl100k_base')
-        # encoding = tiktoken.encoding_for_model(model)
-        tokens = encoding.encode(
+        encoding = FileProcessorHelper.get_encoding(model)
+        key = _token_count_key(encoding.name, text)
+        with _TOKEN_COUNT_CACHE_LOCK:
+            count = _TOKEN_COUNT_CACHE.get(key)
+            if count is not None:
+                _TOKEN_COUNT_CACHE.move_to_end(key)
+                return count
+        count = len(encoding.encode(
             text,
             disallowed_special=()  # 禁用对所有特殊标记的检查
-        )
-        return len(tokens)
+        ))
+        FileProcessorHelper._remember_token_counts({key: count})
+        return count
+
+    @staticmethod
+    def count_tokens(texts: List[str], model="gpt-3.5-turbo", num_threads=TOKEN_COUNT_THREADS) -> List[int]:
+        """
+        批量计算 token 数，返回与 texts 顺序一致的列表。
+        已缓存的文本直接命中，未命中的文本用 encode_batch 多线程编码。
+        :param texts: 文本列表
+        :param model: 模型名称
+        :param num_threads: encode_batch 使用的线程数
+        :return: token 数列表
+        """
+        encoding = FileProcessorHelper.get_encoding(model)
+        counts = [None] * len(texts)
+        missing = {}  # text -> 在 texts 中出现的下标列表
+        with _TOKEN_COUNT_CACHE_LOCK:
+            for i, text in enumerate(texts):
+                key = _token_count_key(encoding.name, text)
+                count = _TOKEN_COUNT_CACHE.get(key)
+                if count is None:
+                    missing.setdefault(text, []).append(i)
+                else:
+                    _TOKEN_COUNT_CACHE.move_to_end(key)
+                    counts[i] = count
+
+        if missing:
+            missing_texts = list(missing)
+            batch_tokens = encoding.encode_batch(
+                missing_texts,
+                num_threads=num_threads,
+                disallowed_special=(),
+            )
+            computed = {}
+            for text, tokens in zip(missing_texts, batch_tokens):
+                computed[_token_count_key(encoding.name, text)] = len(tokens)
+                for i in missing[text]:
+                    counts[i] = len(tokens)
+            FileProcessorHelper._remember_token_counts(computed)
+        return counts
+
+    @staticmethod
+    def _remember_token_counts(counts: Dict[tuple, int]):
+        # 写入 LRU 缓存，超出上限时淘汰最久未使用的条目
+        with _TOKEN_COUNT_CACHE_LOCK:
+            for key, count in counts.items():
+                _TOKEN_COUNT_CACHE[key] = count
+                _TOKEN_COUNT_CACHE.move_to_end(key)
+            while len(_TOKEN_COUNT_CACHE) > TOKEN_COUNT_CACHE_SIZE:
+                _TOKEN_COUNT_CACHE.popitem(last=False)
+
+
+def _token_count_key(encoding_name: str, text: str) -> tuple:
+    # 摘要比编码快得多，长文本也不会被缓存整段持有
+    return encoding_name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    获取共享的 PDF 提取进程池。worker 进程用 forkserver（不支持时用 spawn）启动，
+    不会从 Gradio 进程 fork 出已经持有的线程和锁。
+    """
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _PDF_POOL = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                            mp_context=multiprocessing.get_context(method))
+        return _PDF_POOL
+
+
+def _discard_pdf_pool(pool: ProcessPoolExecutor):
+    global _PDF_POOL
+    with _PDF_POOL_LOCK:
+        if _PDF_POOL is pool:
+            _PDF_POOL = None
+    pool.shutdown(wait=False)
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    # 进程池的任务函数，需要定义在模块顶层才能被序列化
+    with pdfplumber.open(file_path) as pdf:
+        return [(page.page_number, page.extract_text()) for page in pdf.pages[start:end]]
+
+
+class _TokenByteLengths(dict):
+    """token -> 该 token 的字节长度，按需解码并缓存，避免每次切分都逐个解码 token。"""
+
+    def __init__(self, encoding: tiktoken.Encoding):
+        super().__init__()
+        self.encoding = encoding
+
+    def __missing__(self, token: int) -> int:
+        length = len(self.encoding.decode_single_token_bytes(token))
+        self[token] = length
+        return length
+
+
+_TOKEN_BYTE_LENGTHS: Dict[str, _TokenByteLengths] = {}
+
+
+def _token_byte_lengths(encoding: tiktoken.Encoding) -> _TokenByteLengths:
+    with _ENCODINGS_LOCK:
+        return _TOKEN_BYTE_LENGTHS.setdefault(encoding.name, _TokenByteLengths(encoding))
+
+
+class TokenOffsetTextSplitter:
+    """
+    基于 token 偏移的文本切分器。
+
+    与 RecursiveCharacterTextSplitter + tiktoken_len 不同，每段文本只编码一次：
+    按 token 偏移切出不超过 chunk_size 个 token 的块，相邻块重叠 chunk_overlap 个 token，
+    切点尽量回退到分隔符之后（不会回退到半个块以内），且始终落在完整字符的边界上。
+    输出的 Document 结构（page_content/metadata）与 langchain 切分器一致。
+    """
+
+    def __init__(
+            self,
+            chunk_size: int = CHUNK_SIZE,
+            chunk_overlap: int = CHUNK_OVERLAP,
+            separators: List[str] = TEXT_SPLIT_SEPARATORS,
+            model: str = "gpt-3.5-turbo",
+    ):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap({chunk_overlap}) 必须小于 chunk_size({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = [separator.encode('utf-8') for separator in separators]
+        self.encoding = FileProcessorHelper.get_encoding(model)
+        self.token_byte_lengths = _token_byte_lengths(self.encoding)
+
+    def split_text(self, text: str) -> List[str]:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= self.chunk_size:
+            text = text.strip()
+            return [text] if text else []
+
+        # 每个 token 在 UTF-8 字节流中的起始偏移，offsets[i] 为第 i 个 token 的起点
+        data = text.encode('utf-8', errors='surrogatepass')
+        offsets = list(itertools.accumulate(map(self.token_byte_lengths.__getitem__, tokens), initial=0))
+        if offsets[-1] != len(data):
+            data = b"".join(self.encoding.decode_tokens_bytes(tokens))
+
+        chunks = []
+        n = len(tokens)
+        start = 0
+        while start < n:
+            end = min(start + self.chunk_size, n)
+            if end < n:
+                end = self._find_cut(data, offsets, start, end)
+            chunk = data[offsets[start]:offsets[end]].decode('utf-8', errors='ignore').strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= n:
+                break
+            # 下一块从 end 往前回退 chunk_overlap 个 token，并对齐到字符边界
+            start = self._align_to_char(data, offsets, max(end - self.chunk_overlap, start + 1), end)
+        return chunks
+
+    def create_documents(self, texts: List[str], metadatas: List[dict] = None) -> List[Document]:
+        metadatas = metadatas or [{}] * len(texts)
+        docs = []
+        for text, metadata in zip(texts, metadatas):
+            for chunk in self.split_text(text):
+                docs.append(Document(page_content=chunk, metadata=copy.deepcopy(metadata)))
+        return docs
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        texts = [doc.page_content for doc in docs]
+        metadatas = [doc.metadata for doc in docs]
+        return self.create_documents(texts, metadatas=metadatas)
+
+    def _find_cut(self, data: bytes, offsets: List[int], start: int, end: int) -> int:
+        # 在 [start + chunk_size/2, end] 内从后往前找切点，分隔符按优先级依次尝试
+        lowest = start + self.chunk_size // 2
+        low_offset, high_offset = offsets[lowest], offsets[end]
+        for separator in self.separators:
+            search_end = high_offset
+            while True:
+                position = data.rfind(separator, low_offset, search_end)
+                if position < 0:
+                    break
+                # 分隔符结束处恰好是 token 边界时才能作为切点
+                cut = position + len(separator)
+                index = bisect.bisect_left(offsets, cut, lowest, end + 1)
+                if index <= end and offsets[index] == cut:
+                    return index
+                search_end = cut - 1
+        # 没有分隔符时，至少保证切点落在完整字符的边界上
+        for i in range(end, start, -1):
+            if self._is_char_boundary(data, offsets[i]):
+                return i
+        return end
+
+    def _align_to_char(self, data: bytes, offsets: List[int], index: int, end: int) -> int:
+        while index < end and not self._is_char_boundary(data, offsets[index]):
+            index += 1
+        return index
+
+    @staticmethod
+    def _is_char_boundary(data: bytes, offset: int) -> bool:
+        # UTF-8 续字节形如 0b10xxxxxx，不能作为字符起点
+        return offset >= len(data) or (data[offset] & 0xC0) != 0x80
 
 
 if __name__ == "__main__":
@@ -141,4 +477,7 @@ if __name__ == "__main__":
     # [Document(page_content='样本\nPDF\n将本地 PDF 文件直接拖到此窗口中，或单击此页面右上角的第一个按钮上传本地 PDF\n文件，沉浸式翻译扩展将立即开始翻译您的 PDF 文件。\n翻译结果将显示在页面右侧，因此您可以轻松地交叉引用原始 PDF 文件。\n让我们一起享受身临其境的翻译体验吧！\n笔记：\n1. 沉浸式翻译扩展支持导出双语PDF，翻译完成后请点击右上角的保存按钮下载双语\nPDF。\n2. 如果PDF页面是图片，则翻译后的页面将是空白页，因为我们只翻译了文本\n部分。\n3. 某些PDF文档可能有重叠的翻译，如果发生这种情况，您可以选择翻译的文本框，然\n后拖动、缩放或删除文本框以获得更好的阅读体验。如下图所示：\n4. 快捷方式控制样式按钮提供了一种方便的方式来控制翻译等：', metadata={'file_name': 'sample-pdf.pdf', 'page': 1, 'total_pages': 2, 'Creator': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36', 'Producer': 'Skia/PDF m119', 'CreationDate': "D:20231201072920+00'00'", 'ModDate': "D:20231201072920+00'00'"})]
 
     # 测试 tiktoken_len
-    print(FileProcessorHelper.tiktoken_len("你好\n你好有什么能帮你的吗？"))
\ No newline at end of file
+    print(FileProcessorHelper.tiktoken_len("你好\n你好有什么能帮你的吗？"))
+
+    # 测试 count_tokens
+    print(FileProcessorHelper.count_tokens(["你好", "你好有什么能帮你的吗？", "你好"]))
\ No newline at end of file
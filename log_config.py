@@ -0,0 +1,50 @@
+"""
+日志配置和大段内容的惰性记录。
+
+- setup_logging：按 LOG_LEVEL 配置 sink，使用 enqueue=True 由后台线程写入，磁盘 I/O 不阻塞流式响应；
+- log_payload：prompt、检索结果、回复等大段内容只在级别开启且被采样时才格式化，并截断到 LOG_PAYLOAD_MAX_CHARS。
+
+用法：
+    log_payload("DEBUG", "prompt", lambda: prompt)
+"""
+import random
+import sys
+
+from loguru import logger
+
+from config import (LOG_FILE, LOG_FILE_RETENTION, LOG_FILE_ROTATION, LOG_LEVEL, LOG_PAYLOAD_MAX_CHARS,
+                    LOG_PAYLOAD_SAMPLE_RATE, LOG_SERIALIZE)
+
+
+def setup_logging(level=LOG_LEVEL):
+    # 删去import logger之后自动产生的handler，不删除的话会出现重复输出的现象
+    logger.remove()
+    logger.add(sys.stderr, level=level, enqueue=True)
+    if LOG_FILE:
+        logger.add(LOG_FILE, level=level, enqueue=True, rotation=LOG_FILE_ROTATION, retention=LOG_FILE_RETENTION,
+                   serialize=LOG_SERIALIZE, encoding="utf-8")
+    logger.info(f"日志级别: {level}")
+
+
+def truncate(value, max_chars=LOG_PAYLOAD_MAX_CHARS):
+    """转为字符串并截断到 max_chars 个字符，注明省略的字符数。"""
+    text = value if isinstance(value, str) else str(value)
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(省略 {len(text) - max_chars} 个字符)"
+
+
+def sampled(rate=LOG_PAYLOAD_SAMPLE_RATE):
+    return rate >= 1 or random.random() < rate
+
+
+def log_payload(level, name, payload):
+    """
+    惰性记录一段大内容。
+    :param level: 日志级别名
+    :param name: 内容名称，作为消息前缀并绑定到 extra["payload"]，便于在 JSON 日志中过滤
+    :param payload: 无参函数，返回要记录的内容；只在级别开启且被采样时调用
+    """
+    if not sampled():
+        return
+    logger.bind(payload=name).opt(lazy=True, depth=1).log(level, name + ": \n{}", lambda: truncate(payload()))
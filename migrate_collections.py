@@ -0,0 +1,104 @@
+"""
+把按文件存储的集合（每个文件一个集合）迁移到共享集合 QDRANT_SHARED_COLLECTION。
+
+只处理本应用按文件摘要命名的集合（见 FileProcessor.collection_name_for），节点上的其他集合不会被迁移或删除。
+每个旧集合的名字作为文档的 doc_id，节点的向量和 payload 原样复制，
+并补上 doc_id、chunk_index 字段，节点 id 由 (doc_id, chunk 序号) 重新生成，重复执行是幂等的。
+
+用法：
+    python migrate_collections.py            # 迁移本应用的所有集合，保留旧集合
+    python migrate_collections.py --collections <name> ...  # 只迁移指定的集合
+    python migrate_collections.py --delete   # 迁移并校验节点数后删除旧集合
+    python migrate_collections.py --dry-run  # 只列出待迁移的集合和节点数
+"""
+import argparse
+
+from loguru import logger
+
+from config import QDRANT_SCROLL_PAGE_SIZE, QDRANT_SHARED_COLLECTION
+from db_qdrant import Qdrant, point_id
+from file_processor import FileProcessor
+
+
+def migrate_collection(qdrant, collection_name, shared_collection_name):
+    """
+    把一个旧集合的所有节点复制到共享集合。
+    :return: 复制的节点数
+    """
+    migrated = 0
+    offset = None
+    while True:
+        records, offset = qdrant.client.scroll(
+            collection_name=collection_name,
+            limit=QDRANT_SCROLL_PAGE_SIZE,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if not records:
+            break
+        vectors, payloads, ids = [], [], []
+        for record in records:
+            payload = dict(record.payload or {})
+            # 旧集合的 id 是从 1 开始的连续整数；新入库的节点在 payload 里记录了 chunk_index
+            chunk_index = payload.get('chunk_index')
+            if chunk_index is None:
+                chunk_index = record.id - 1 if isinstance(record.id, int) else migrated + len(ids)
+            payload['chunk_index'] = chunk_index
+            payload['doc_id'] = collection_name
+            vectors.append(record.vector)
+            payloads.append(payload)
+            ids.append(point_id(collection_name, chunk_index))
+        qdrant.add_points(shared_collection_name, vectors, payloads, ids=ids, wait=True)
+        migrated += len(records)
+        if offset is None:
+            break
+    return migrated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把按文件存储的集合迁移到共享集合")
+    parser.add_argument("--shared-collection", default=QDRANT_SHARED_COLLECTION, help="共享集合名")
+    parser.add_argument("--delete", action="store_true", help="迁移成功后删除旧集合")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待迁移的集合")
+    parser.add_argument("--collections", nargs="+", help="只迁移这些集合，默认迁移所有按文件摘要命名的集合")
+    args = parser.parse_args()
+
+    qdrant = Qdrant()
+    all_collection_names = [
+        name for name in qdrant.list_all_collection_names() if name != args.shared_collection]
+    if args.collections:
+        missing = sorted(set(args.collections) - set(all_collection_names))
+        if missing:
+            logger.warning(f"以下集合不存在，跳过：{missing}")
+        collection_names = [name for name in args.collections if name in all_collection_names]
+    else:
+        collection_names = [name for name in all_collection_names if FileProcessor.is_collection_name(name)]
+        skipped = len(all_collection_names) - len(collection_names)
+        if skipped:
+            logger.info(f"跳过 {skipped} 个不是本应用命名的集合")
+    logger.info(f"待迁移的集合数：{len(collection_names)}")
+
+    if not args.dry_run:
+        qdrant.ensure_shared_collection(args.shared_collection)
+
+    for collection_name in collection_names:
+        points_count = qdrant.get_collection(collection_name).points_count
+        if args.dry_run:
+            logger.info(f"集合：{collection_name} 节点数：{points_count}")
+            continue
+
+        migrated = migrate_collection(qdrant, collection_name, args.shared_collection)
+        shared_count = qdrant.get_document_points_count(args.shared_collection, collection_name)
+        if shared_count != migrated:
+            logger.error(f"迁移后节点数不一致，保留旧集合 | collection_name：{collection_name} "
+                         f"migrated：{migrated} shared：{shared_count}")
+            continue
+        logger.success(f"迁移完成 | collection_name：{collection_name} 节点数：{migrated}")
+        if args.delete:
+            qdrant.delete_collection(collection_name)
+            logger.info(f"已删除旧集合 | collection_name：{collection_name}")
+
+
+if __name__ == "__main__":
+    main()
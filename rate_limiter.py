@@ -0,0 +1,300 @@
+"""
+OpenAI 请求调度：按模型的 RPM / TPM 令牌桶限流，可重试的错误按指数退避加随机抖动重试。
+
+- 发送前用 tiktoken 估算请求的 token 数（对话为 prompt + max_tokens，与 OpenAI 计入 TPM 的方式一致），
+  两个桶都有足够的令牌时才发出请求；
+- 每次响应后按 x-ratelimit-limit-* / x-ratelimit-remaining-* 头校准桶的容量和剩余量；
+- 429、408、409、5xx 和连接错误按指数退避加抖动重试，响应带 Retry-After 时至少等待该时长，
+  收到 429 时同时暂停该模型的其他请求；
+- 优先级：批量任务（入库 embedding）只能使用桶容量的 RATE_LIMIT_BULK_RATIO，
+  并且有交互式请求在等待时让行，交互式对话不会排在大批量入库之后。
+
+SDK 自带的重试已关闭（max_retries=0），重试都由这里完成。
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import openai
+from loguru import logger
+
+from config import (MESSAGE_OVERHEAD_TOKENS, OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX, OPENAI_MAX_RETRIES,
+                    OPENAI_RATE_LIMITS, RATE_LIMIT_BULK_RATIO, RATE_LIMIT_ENABLED)
+from file_processor_helper import FileProcessorHelper
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+
+# 等待令牌时单次最长休眠（秒），期间其他响应可能已校准了桶
+_MAX_SLEEP = 1.0
+# 批量请求给等待中的交互式请求让行时的轮询间隔（秒）
+_YIELD_INTERVAL = 0.05
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def retry_after_seconds(headers):
+    """
+    :return: 响应头 retry-after-ms / retry-after（秒数或 HTTP 日期）要求的等待秒数，没有时返回 None
+    """
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None, base=OPENAI_BACKOFF_BASE, cap=OPENAI_BACKOFF_MAX):
+    """
+    第 attempt 次（从 0 开始）重试前的等待秒数：指数退避，取一半加上随机的另一半，避免同时失败的请求一起重试。
+    有 Retry-After 时至少等待该时长，再加少量抖动。
+    """
+    if retry_after is not None:
+        return min(retry_after, cap) + random.uniform(0, base)
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIConnectionError):  # 包括 APITimeoutError
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def estimate_chat_tokens(messages, model, max_tokens, prompt_tokens=None):
+    # OpenAI 按 prompt 的 token 数加上 max_tokens 计入 TPM
+    # 调用方已经统计过 prompt 的 token 数（例如 context_packer 打包时）时直接使用，不再重新编码
+    if isinstance(prompt_tokens, int):
+        return prompt_tokens + (max_tokens or 0)
+    contents = [message.get("content") or "" for message in messages]
+    contents = [content if isinstance(content, str) else str(content) for content in contents]
+    return sum(FileProcessorHelper.count_tokens(contents, model)) \
+        + MESSAGE_OVERHEAD_TOKENS * len(messages) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """每分钟 capacity 个令牌，按时间连续补充。不加锁，由 RateLimiter 保护。"""
+
+    def __init__(self, capacity):
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount, floor=0.0):
+        # 取走 amount 个令牌后剩余不低于 floor 还需要等待的秒数
+        needed = amount + floor - self.tokens
+        return 0.0 if needed <= 0 else needed * 60 / self.capacity
+
+    def sync(self, limit, remaining):
+        # 以接口返回的数字为准；本地剩余更少时保留本地值（可能有尚未返回的在途请求）
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.tokens = min(self.tokens, float(remaining))
+
+
+class RateLimiter:
+    """单个模型的 RPM / TPM 限流，线程安全，同步和异步代码共用。"""
+
+    def __init__(self, model, rpm, tpm):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self._interactive_waiting = 0
+
+    def _try_acquire(self, tokens, priority):
+        """
+        :return: 0 表示已取得令牌，否则为建议的等待秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if priority == PRIORITY_BULK and self._interactive_waiting:
+                return _YIELD_INTERVAL
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            # 批量请求必须在桶里留下 1 - RATE_LIMIT_BULK_RATIO 的余量给交互式请求
+            reserve = 1 - RATE_LIMIT_BULK_RATIO if priority == PRIORITY_BULK else 0.0
+            request_floor = self.requests.capacity * reserve
+            token_floor = self.tokens.capacity * reserve
+            # 超过可用容量的请求按可用容量计，避免永远等不到
+            tokens = min(tokens, self.tokens.capacity - token_floor)
+            wait = max(self.requests.wait_time(1, request_floor), self.tokens.wait_time(tokens, token_floor))
+            if wait > 0:
+                return wait
+            self.requests.tokens -= 1
+            self.tokens.tokens -= tokens
+            return 0.0
+
+    def _set_waiting(self, priority, delta):
+        if priority == PRIORITY_INTERACTIVE:
+            with self._lock:
+                self._interactive_waiting += delta
+
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE):
+        """
+        阻塞直到取得一个请求和 tokens 个 token 的令牌。
+        :return: 等待的秒数
+        """
+        wait = self._try_acquire(tokens, priority)
+        if not wait:
+            return 0.0
+        start = time.monotonic()
+        self._set_waiting(priority, 1)
+        try:
+            while wait:
+                time.sleep(min(wait, _MAX_SLEEP))
+                wait = self._try_acquire(tokens, priority)
+        finally:
+            self._set_waiting(priority, -1)
+        return time.monotonic() - start
+
+    async def acquire_async(self, tokens, priority=PRIORITY_INTERACTIVE):
+        # acquire 的异步版本，等待期间不阻塞事件循环
+        wait = self._try_acquire(tokens, priority)
+        if not wait:
+            return 0.0
+        start = time.monotonic()
+        self._set_waiting(priority, 1)
+        try:
+            while wait:
+                await asyncio.sleep(min(wait, _MAX_SLEEP))
+                wait = self._try_acquire(tokens, priority)
+        finally:
+            self._set_waiting(priority, -1)
+        return time.monotonic() - start
+
+    def update_from_headers(self, headers):
+        def number(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        now = time.monotonic()
+        with self._lock:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            self.requests.sync(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"))
+            self.tokens.sync(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"))
+
+    def pause(self, seconds):
+        # 收到 429 后暂停该模型的所有请求，避免其他请求继续撞上限流
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(model):
+    """每个模型一个进程内共享的 RateLimiter，限额取自 OPENAI_RATE_LIMITS（未配置的模型使用 "default"）。"""
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limits = OPENAI_RATE_LIMITS.get(model, OPENAI_RATE_LIMITS["default"])
+                limiter = _limiters[model] = RateLimiter(model, limits["rpm"], limits["tpm"])
+    return limiter
+
+
+def _retry_delay(limiter, error, attempt, model):
+    """
+    :return: 下次重试前的等待秒数；不可重试或重试次数已用完时返回 None
+    """
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else None
+    if limiter is not None and headers is not None:
+        limiter.update_from_headers(headers)
+    if attempt >= OPENAI_MAX_RETRIES or not is_retryable(error):
+        return None
+    delay = backoff_delay(attempt, retry_after_seconds(headers))
+    if limiter is not None and getattr(error, "status_code", None) == 429:
+        limiter.pause(delay)
+    logger.warning(f"OpenAI 请求第{attempt + 1}次重试 | model: {model} 等待: {delay:.2f}s 错误信息: {error}")
+    return delay
+
+
+def _limiter_and_tokens(model, tokens):
+    if not RATE_LIMIT_ENABLED:
+        return None, 0
+    return get_rate_limiter(model), tokens() if callable(tokens) else tokens
+
+
+def request(func, model, tokens, priority=PRIORITY_INTERACTIVE):
+    """
+    经过限流和重试发送一次请求。
+    :param func: 无参函数，通过 with_raw_response 发起请求并返回原始响应
+    :param model: 模型，决定使用哪个限流器
+    :param tokens: 估算的 token 数，整数或无参函数（关闭限流时不调用）
+    :param priority: PRIORITY_INTERACTIVE 或 PRIORITY_BULK
+    :return: 解析后的响应（流式请求为 Stream）
+    """
+    limiter, tokens = _limiter_and_tokens(model, tokens)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            waited = limiter.acquire(tokens, priority)
+            if waited:
+                logger.debug(f"限流等待 | model: {model} priority: {priority} tokens: {tokens} 等待: {waited:.2f}s")
+        try:
+            raw_response = func()
+        except Exception as e:
+            delay = _retry_delay(limiter, e, attempt, model)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        if limiter is not None:
+            limiter.update_from_headers(raw_response.headers)
+        return raw_response.parse()
+
+
+async def request_async(func, model, tokens, priority=PRIORITY_INTERACTIVE):
+    """
+    request 的异步版本：func 是返回原始响应的协程函数，等待和退避期间不阻塞事件循环。
+    """
+    limiter, tokens = _limiter_and_tokens(model, tokens)
+    attempt = 0
+    while True:
+        if limiter is not None:
+            waited = await limiter.acquire_async(tokens, priority)
+            if waited:
+                logger.debug(f"限流等待 | model: {model} priority: {priority} tokens: {tokens} 等待: {waited:.2f}s")
+        try:
+            raw_response = await func()
+        except Exception as e:
+            delay = _retry_delay(limiter, e, attempt, model)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        if limiter is not None:
+            limiter.update_from_headers(raw_response.headers)
+        return raw_response.parse()
@@ -0,0 +1,109 @@
+"""
+流式输出的缓冲区：累积模型返回的增量文本，按 STREAM_FLUSH_POLICY 决定何时推送给前端。
+
+每次推送 Gradio 都要序列化整个对话历史并通过 websocket 发送，逐个增量推送会占满服务器 CPU。
+- "time"：距上次推送超过 STREAM_FLUSH_INTERVAL 秒时推送；
+- "chars"：累积的新字符达到 STREAM_FLUSH_CHARS 时推送；
+- "sentence"：增量以句末标点结尾时推送，累积字符达到 STREAM_FLUSH_CHARS 时也推送，避免长句迟迟不显示。
+首个增量立即推送（首字延迟不变），结束时调用 flush 推送剩余内容。
+
+append 只在收到新增量时判断是否推送：模型停顿时，"time" 策略下已缓冲的内容要等下一个增量才能显示。
+读取流式响应时用 iter_stream 代替 async for，停顿超过 time_until_flush 时产出 STALLED，调用方借此推送缓冲内容。
+"chars" 和 "sentence" 策略按内容推送，停顿时不会超时推送。
+"""
+import asyncio
+import time
+
+from config import STREAM_FLUSH_CHARS, STREAM_FLUSH_INTERVAL, STREAM_FLUSH_POLICY
+
+SENTENCE_ENDINGS = ("。", "！", "？", "；", "!", "?", ";", ".", "\n")
+
+# iter_stream 在等待下一个增量超时时产出的标记
+STALLED = object()
+
+
+class StreamBuffer:
+    def __init__(self, policy=STREAM_FLUSH_POLICY, interval=STREAM_FLUSH_INTERVAL, chars=STREAM_FLUSH_CHARS):
+        if policy not in ("time", "chars", "sentence"):
+            raise ValueError(f"未知的 STREAM_FLUSH_POLICY: {policy}")
+        self.policy = policy
+        self.interval = interval
+        self.chars = chars
+        self._parts = []  # 字符串片段列表，推送时才拼接，避免每个增量都复制整段文本
+        self._text = ""  # 上次推送时的完整文本
+        self._pending_chars = 0
+        self._last_flush = None
+        self.flushes = 0
+
+    def append(self, delta):
+        """
+        加入一个增量。
+        :return: 是否应该现在推送
+        """
+        if not delta:
+            return False
+        self._parts.append(delta)
+        self._pending_chars += len(delta)
+        if self._last_flush is None:
+            return True
+        if self.policy == "time":
+            return time.monotonic() - self._last_flush >= self.interval
+        if self.policy == "chars":
+            return self._pending_chars >= self.chars
+        return delta.endswith(SENTENCE_ENDINGS) or self._pending_chars >= self.chars
+
+    def time_until_flush(self):
+        """
+        "time" 策略下有未推送内容时，距离应该推送还有多少秒；否则返回 None（不需要超时推送）。
+        """
+        if self.policy != "time" or not self.pending or self._last_flush is None:
+            return None
+        return max(0.0, self._last_flush + self.interval - time.monotonic())
+
+    @property
+    def pending(self):
+        return self._pending_chars > 0
+
+    @property
+    def text(self):
+        # 到目前为止的完整文本（包括未推送的部分）
+        if self._parts:
+            self._text += "".join(self._parts)
+            self._parts = []
+        return self._text
+
+    def flush(self):
+        """
+        :return: 到目前为止的完整文本
+        """
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.flushes += 1
+        return self.text
+
+
+async def iter_stream(stream, timeout):
+    """
+    逐个产出异步迭代器 stream 的元素；等待下一个元素超过 timeout() 秒时产出 STALLED。
+    超时不会取消正在等待的读取，之后继续等待同一个元素。timeout() 返回 None 时一直等待。
+    """
+    iterator = stream.__aiter__()
+    next_item = None
+    try:
+        while True:
+            if next_item is None:
+                next_item = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({next_item}, timeout=timeout())
+            if not done:
+                yield STALLED
+                continue
+            try:
+                item = next_item.result()
+            except StopAsyncIteration:
+                next_item = None
+                return
+            next_item = None
+            yield item
+    finally:
+        if next_item is not None:
+            next_item.cancel()
@@ -0,0 +1,43 @@
+import os
+import sys
+
+# config.py 在导入时读取 OPENAI_API_KEY；测试不访问 OpenAI
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+import tiktoken
+
+from file_processor_helper import FileProcessorHelper
+
+# 每个字节一个 token 的编码器：测试不下载 tiktoken 的编码文件，token 数也容易推算（ASCII 文本的 token 数等于长度）
+BYTE_ENCODING = tiktoken.Encoding(
+    "test-bytes",
+    pat_str=r"\S+|\s+",
+    mergeable_ranks={bytes([i]): i for i in range(256)},
+    special_tokens={},
+)
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    monkeypatch.setattr(FileProcessorHelper, "get_encoding", staticmethod(lambda model="gpt-3.5-turbo": BYTE_ENCODING))
+    return BYTE_ENCODING
+
+
+class FakeClock:
+    """替换 time.monotonic，由测试推进时间。"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
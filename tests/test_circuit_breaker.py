@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, guard_client
+
+
+class DependencyDown(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def fail():
+    raise DependencyDown("连接失败")
+
+
+@pytest.fixture
+def breaker(monkeypatch, clock):
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    return CircuitBreaker("test", is_failure=lambda error: isinstance(error, DependencyDown),
+                          failure_threshold=2, reset_timeout=30)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    for _ in range(2):
+        with pytest.raises(DependencyDown):
+            breaker.call(fail)
+    assert breaker.state == OPEN
+
+    calls = []
+    with pytest.raises(CircuitOpenError) as info:
+        breaker.call(calls.append, 1)
+    assert calls == []
+    assert info.value.name == "test"
+    assert info.value.retry_in == pytest.approx(30)
+
+
+def test_success_resets_failure_count(breaker):
+    with pytest.raises(DependencyDown):
+        breaker.call(fail)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(DependencyDown):
+        breaker.call(fail)
+    assert breaker.state == CLOSED
+
+
+def test_non_failure_errors_do_not_open(breaker):
+    def not_found():
+        raise NotFound()
+
+    for _ in range(5):
+        with pytest.raises(NotFound):
+            breaker.call(not_found)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_half_open_probe_success_closes(breaker, clock):
+    breaker.record_failure(DependencyDown())
+    breaker.record_failure(DependencyDown())
+    clock.advance(30)
+
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def test_half_open_probe_failure_reopens(breaker, clock):
+    breaker.record_failure(DependencyDown())
+    breaker.record_failure(DependencyDown())
+    clock.advance(30)
+
+    with pytest.raises(DependencyDown):
+        breaker.call(fail)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_half_open_allows_a_single_probe(breaker, clock):
+    breaker.record_failure(DependencyDown())
+    breaker.record_failure(DependencyDown())
+    clock.advance(30)
+
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    # 探测请求长时间没有结果时再放行一个
+    clock.advance(30)
+    breaker.allow()
+
+
+def test_call_async(breaker):
+    async def fail_async():
+        raise DependencyDown()
+
+    async def main():
+        for _ in range(2):
+            with pytest.raises(DependencyDown):
+                await breaker.call_async(fail_async)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call_async(fail_async)
+
+    asyncio.run(main())
+
+
+def test_guarded_client_routes_methods_through_breaker(breaker):
+    class Client:
+        url = "http://localhost"
+
+        def search(self):
+            raise DependencyDown()
+
+    client = guard_client(Client(), breaker)
+    assert guard_client(client, breaker) is client
+    assert client.url == "http://localhost"
+    for _ in range(2):
+        with pytest.raises(DependencyDown):
+            client.search()
+    with pytest.raises(CircuitOpenError):
+        client.search()
@@ -0,0 +1,86 @@
+import pytest
+
+from config import DEFAULT_CONTEXT_WINDOW, MODEL_CONTEXT_WINDOWS, MODELS, PROMPT_RESERVED_TOKENS
+from context_packer import (CONTEXT_SEPARATOR, PromptBudgetError, pack_context, pack_prompt_parts,
+                            prompt_token_budget, strip_overlap)
+from conversation import ConversationState
+
+
+def point(text, score=0.9, doc_id="doc", chunk_index=None):
+    payload = {"page_content": text, "doc_id": doc_id}
+    if chunk_index is not None:
+        payload["chunk_index"] = chunk_index
+    return {"id": f"{doc_id}-{chunk_index}-{score}", "score": score, "payload": payload}
+
+
+def test_every_model_has_a_context_window():
+    assert set(MODELS) <= set(MODEL_CONTEXT_WINDOWS)
+
+
+def test_prompt_token_budget():
+    assert prompt_token_budget("gpt-4o", 2000) == MODEL_CONTEXT_WINDOWS["gpt-4o"] - 2000 - PROMPT_RESERVED_TOKENS
+    assert prompt_token_budget("unknown-model", 2000) == DEFAULT_CONTEXT_WINDOW - 2000 - PROMPT_RESERVED_TOKENS
+    assert prompt_token_budget("gpt-4", 9000) == 0
+
+
+def test_strip_overlap_prefers_the_longest_overlap():
+    previous_text = "abcdefgh XYZ abcdefgh XYZ abcdefgh"
+    assert strip_overlap(previous_text, "abcdefgh XYZ abcdefgh rest") == " rest"
+
+
+def test_strip_overlap_without_overlap():
+    assert strip_overlap("first chunk", "second chunk") == "second chunk"
+    assert strip_overlap("first chunk", "") == ""
+
+
+def test_pack_context_respects_budget():
+    points = [point("a" * 100, 0.9), point("b" * 100, 0.8), point("c" * 30, 0.7)]
+    context, used, stats = pack_context(points, 150, "gpt-4")
+
+    # 第二个放不下，继续尝试后面更短的
+    assert context == "a" * 100 + CONTEXT_SEPARATOR + "c" * 30
+    assert used == 100 + len(CONTEXT_SEPARATOR) + 30
+    assert stats["selected"] == 2
+    assert stats["over_budget"] == 1
+
+
+def test_pack_context_drops_near_duplicates():
+    text = "the quick brown fox jumps over the lazy dog " * 3
+    points = [point(text, 0.9, doc_id="a"), point(text + "!", 0.8, doc_id="b"), point("something else", 0.7)]
+    context, _, stats = pack_context(points, 10000, "gpt-4")
+
+    assert stats["duplicates"] == 1
+    assert stats["selected"] == 2
+    assert "!" not in context
+
+
+def test_pack_context_trims_adjacent_chunk_overlap():
+    points = [
+        point("first part of the page, shared tail", 0.9, chunk_index=0),
+        point("shared tail, second part", 0.8, chunk_index=1),
+    ]
+    context, _, stats = pack_context(points, 10000, "gpt-4")
+
+    assert context == "first part of the page, shared tail" + CONTEXT_SEPARATOR + ", second part"
+    assert stats["overlap_trimmed"] == 1
+
+
+def test_pack_prompt_parts_splits_budget_between_history_and_context():
+    conversation = ConversationState("gpt-4")
+    conversation.add_turn("q", "a")
+    context, history_str, prompt_tokens = pack_prompt_parts([point("x" * 50)], conversation, "gpt-4", 2000, 20)
+
+    assert context == "x" * 50
+    assert history_str == "user:q\nassistant:a"
+    assert prompt_tokens == 20 + 50 + conversation.window_tokens
+
+
+def test_pack_prompt_parts_raises_when_no_context_fits():
+    max_tokens = MODEL_CONTEXT_WINDOWS["gpt-4"] - PROMPT_RESERVED_TOKENS - 60
+    with pytest.raises(PromptBudgetError):
+        pack_prompt_parts([point("x" * 100)], ConversationState("gpt-4"), "gpt-4", max_tokens, 20)
+
+
+def test_pack_prompt_parts_without_points():
+    context, history_str, prompt_tokens = pack_prompt_parts([], ConversationState("gpt-4"), "gpt-4", 2000, 20)
+    assert (context, history_str, prompt_tokens) == ("", "", 20)
@@ -0,0 +1,98 @@
+from config import MESSAGE_OVERHEAD_TOKENS
+from conversation import ConversationState
+
+
+def turn_tokens(user, assistant):
+    # 字节编码器下 ASCII 文本的 token 数等于长度
+    return len(user) + len(assistant) + 2 * MESSAGE_OVERHEAD_TOKENS
+
+
+def test_add_turn_counts_tokens():
+    state = ConversationState("gpt-4")
+    turn = state.add_turn("hello", "world!")
+    assert turn.tokens == turn_tokens("hello", "world!")
+    assert state.window_tokens == turn.tokens
+    assert state.total_turns == 1
+
+
+def test_known_assistant_tokens_are_used():
+    state = ConversationState("gpt-4")
+    turn = state.add_turn("hello", "world!", assistant_tokens=100)
+    assert turn.assistant_tokens == 100
+    assert turn.user_tokens == 5
+
+
+def test_window_evicts_oldest_turns():
+    size = turn_tokens("q0", "a0")
+    state = ConversationState("gpt-4", max_history_tokens=size * 2)
+    for i in range(5):
+        state.add_turn(f"q{i}", f"a{i}")
+
+    assert [turn.user for turn in state.turns] == ["q3", "q4"]
+    assert state.window_tokens == size * 2
+    assert state.total_turns == 5
+    assert state.total_tokens == size * 5
+
+
+def test_window_keeps_latest_turn_over_budget():
+    state = ConversationState("gpt-4", max_history_tokens=10)
+    state.add_turn("a long question", "a long answer")
+    assert len(state.turns) == 1
+
+
+def test_history_str_within_budget():
+    state = ConversationState("gpt-4")
+    for i in range(3):
+        state.add_turn(f"q{i}", f"a{i}")
+
+    history_str, used, dropped = state.history_str(turn_tokens("q0", "a0") * 2)
+    assert history_str == "user:q1\nassistant:a1\nuser:q2\nassistant:a2"
+    assert used == turn_tokens("q0", "a0") * 2
+    assert dropped == 1
+
+    history_str, used, dropped = state.history_str()
+    assert history_str.startswith("user:q0")
+    assert dropped == 0
+
+
+def test_history_messages_returns_a_copy():
+    state = ConversationState("gpt-4")
+    state.add_turn("q", "a")
+    messages, _ = state.history_messages()
+    messages.append({"role": "user", "content": "next"})
+    assert state.history_messages()[0] == [
+        {"role": "user", "content": "q"},
+        {"role": "assistant", "content": "a"},
+    ]
+
+
+def test_sync_adds_only_new_turns():
+    state = ConversationState("gpt-4")
+    state.sync([["q0", "a0"], ["q1", None]])
+    assert [turn.user for turn in state.turns] == ["q0"]
+
+    first_turn = state.turns[0]
+    state.sync([["q0", "a0"], ["q1", "a1"], ["q2", None]])
+    assert [turn.user for turn in state.turns] == ["q0", "q1"]
+    assert state.turns[0] is first_turn
+
+    # 重复同步不会重复加入
+    state.sync([["q0", "a0"], ["q1", "a1"], ["q2", None]])
+    assert state.total_turns == 2
+
+
+def test_sync_rebuilds_after_chatbot_is_cleared():
+    state = ConversationState("gpt-4")
+    state.sync([["q0", "a0"], ["q1", "a1"], ["q2", None]])
+    state.sync([["new", None]])
+    assert state.total_turns == 0
+    assert len(state.turns) == 0
+
+    state.sync([["new", "answer"], ["next", None]])
+    assert [turn.user for turn in state.turns] == ["new"]
+
+
+def test_from_chat_history():
+    state = ConversationState.from_chat_history([["q0", "a0"], ["q1", "a1"]], "gpt-4")
+    assert state.total_turns == 2
+    assert state.history_str()[0] == "user:q0\nassistant:a0\nuser:q1\nassistant:a1"
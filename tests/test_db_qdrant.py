@@ -0,0 +1,212 @@
+import asyncio
+import weakref
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from qdrant_client.http.exceptions import UnexpectedResponse
+
+import db_qdrant
+from circuit_breaker import CircuitBreaker
+from config import QDRANT_COLLECTION_PROFILES
+from db_qdrant import Qdrant, point_id
+from ttl_cache import TTLCache
+
+
+def test_point_id_is_deterministic_and_ordered():
+    assert point_id("doc-a", 0) == point_id("doc-a", 0)
+    ids = [point_id("doc-a", i) for i in range(1000)]
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_point_ids_do_not_collide_across_documents():
+    ids = {point_id(f"doc-{doc}", chunk) for doc in range(200) for chunk in range(50)}
+    assert len(ids) == 200 * 50
+
+
+def test_point_id_bounds():
+    max_chunk = (1 << db_qdrant._CHUNK_INDEX_BITS) - 1
+    for doc_id in ("doc-a", "中文文档", ""):
+        assert 0 <= point_id(doc_id, 0) < 1 << 63
+        assert point_id(doc_id, max_chunk) < 1 << 63
+    with pytest.raises(ValueError):
+        point_id("doc-a", max_chunk + 1)
+    with pytest.raises(ValueError):
+        point_id("doc-a", -1)
+
+
+class FlakyClient:
+    """前几次 upsert 抛出给定错误的客户端替身。"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def upsert(self, collection_name, wait, points):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(db_qdrant.time, "sleep", delays.append)
+    monkeypatch.setattr(db_qdrant, "qdrant_breaker", CircuitBreaker("Qdrant", is_failure=db_qdrant.is_qdrant_failure))
+    return delays
+
+
+def upsert_batch(client):
+    Qdrant(client=client)._upsert_batch("collection", [1], [[0.0]], [{}], True)
+
+
+def test_upsert_retries_transient_failures_with_backoff(sleeps):
+    client = FlakyClient(httpx.ConnectError("refused"), UnexpectedResponse(503, "Unavailable", b"", httpx.Headers()))
+    upsert_batch(client)
+
+    assert client.calls == 3
+    assert len(sleeps) == 2
+    assert 0 < sleeps[0] <= db_qdrant.QDRANT_BACKOFF_BASE
+    assert all(delay <= db_qdrant.QDRANT_BACKOFF_MAX for delay in sleeps)
+
+
+def test_upsert_does_not_retry_client_errors(sleeps):
+    client = FlakyClient(UnexpectedResponse(400, "Bad Request", b"", httpx.Headers()))
+    with pytest.raises(UnexpectedResponse):
+        upsert_batch(client)
+    assert client.calls == 1
+
+    client = FlakyClient(TypeError("bad payload"))
+    with pytest.raises(TypeError):
+        upsert_batch(client)
+    assert client.calls == 1
+    assert sleeps == []
+
+
+def test_upsert_gives_up_after_retries(sleeps):
+    client = FlakyClient(*[httpx.ReadTimeout("timeout")] * db_qdrant.QDRANT_UPSERT_RETRIES)
+    with pytest.raises(httpx.ReadTimeout):
+        upsert_batch(client)
+    assert client.calls == db_qdrant.QDRANT_UPSERT_RETRIES
+
+
+class CollectionsClient:
+    """按 create_collection 的参数返回集合配置的客户端替身（本地模式不保存量化和 HNSW 配置）。"""
+
+    def __init__(self):
+        self.collections = {}
+        self.get_calls = 0
+
+    def create_collection(self, collection_name, vectors_config, hnsw_config, on_disk_payload, quantization_config):
+        if collection_name in self.collections:
+            raise ValueError(f"Collection {collection_name} already exists")
+        self.collections[collection_name] = SimpleNamespace(config=SimpleNamespace(
+            params=SimpleNamespace(vectors=vectors_config),
+            hnsw_config=hnsw_config,
+            quantization_config=quantization_config,
+        ))
+        return True
+
+    def get_collection(self, collection_name):
+        self.get_calls += 1
+        return self.collections[collection_name]
+
+    def delete_collection(self, collection_name):
+        return self.collections.pop(collection_name, None) is not None
+
+
+class AsyncCollectionsClient:
+    def __init__(self, client):
+        self.sync_client = client
+
+    async def get_collection(self, collection_name):
+        return self.sync_client.get_collection(collection_name)
+
+
+@pytest.fixture
+def collections_client(monkeypatch):
+    monkeypatch.setattr(db_qdrant, "_search_params_cache", TTLCache())
+    return CollectionsClient()
+
+
+@pytest.mark.parametrize("profile_name", list(QDRANT_COLLECTION_PROFILES))
+def test_collection_profile_is_resolved_from_stored_config(collections_client, profile_name):
+    Qdrant(profile=profile_name, client=collections_client).create_collection("docs")
+    info = collections_client.get_collection("docs")
+    assert db_qdrant.collection_profile_name(info, "ram-fast") == profile_name
+
+
+def test_search_uses_the_params_of_the_queried_collection(collections_client):
+    Qdrant(profile="scalar-int8", client=collections_client).create_collection("quantized")
+    Qdrant(profile="ram-fast", client=collections_client).create_collection("plain")
+    db_qdrant._search_params_cache.clear()
+
+    qdrant = Qdrant(profile="ram-fast", client=collections_client)
+    quantized = qdrant.get_search_params("quantized")
+    assert quantized.quantization is not None and quantized.quantization.rescore
+    assert qdrant.get_search_params("plain").quantization is None
+
+    async_qdrant = db_qdrant.AsyncQdrant(profile="ram-fast", client=AsyncCollectionsClient(collections_client))
+    assert asyncio.run(async_qdrant.get_search_params("quantized")) == quantized
+
+
+def test_search_params_are_cached_per_collection(collections_client):
+    qdrant = Qdrant(profile="on-disk", client=collections_client)
+    qdrant.create_collection("docs")
+    db_qdrant._search_params_cache.clear()
+
+    assert qdrant.get_search_params("docs") == qdrant.get_search_params("docs") == qdrant.search_params
+    assert collections_client.get_calls == 1
+
+    # 删除后以其他配置重建，检索参数随之更新
+    qdrant.delete_collection("docs")
+    Qdrant(profile="scalar-int8", client=collections_client).create_collection("docs")
+    assert qdrant.get_search_params("docs").quantization is not None
+
+
+def test_unknown_collection_config_falls_back_to_configured_profile(collections_client):
+    qdrant = Qdrant(profile="on-disk", client=collections_client)
+    collections_client.collections["custom"] = SimpleNamespace(config=SimpleNamespace(
+        params=SimpleNamespace(vectors=SimpleNamespace(on_disk=False)),
+        hnsw_config=SimpleNamespace(on_disk=True),
+        quantization_config=object(),
+    ))
+    assert qdrant.get_search_params("custom") == qdrant.search_params
+
+
+class SlowSearchClient:
+    """记录同时在途的检索请求数。"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def search(self, **kwargs):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        return []
+
+
+def test_search_concurrency_is_capped_per_process(monkeypatch):
+    monkeypatch.setattr(db_qdrant, "QDRANT_SEARCH_PARALLEL", 2)
+    monkeypatch.setattr(db_qdrant, "_search_semaphores", weakref.WeakKeyDictionary())
+    search_params = Qdrant.build_search_params(QDRANT_COLLECTION_PROFILES["ram-fast"])
+
+    async def get_search_params(self, collection_name):
+        return search_params
+
+    monkeypatch.setattr(db_qdrant.AsyncQdrant, "get_search_params", get_search_params)
+    client = SlowSearchClient()
+
+    async def run():
+        # 每次对话都创建新的 AsyncQdrant，信号量仍然是进程内共用的
+        await asyncio.gather(*(db_qdrant.AsyncQdrant(client=client).search_collections(["a", "b", "c"], [0.0])
+                               for _ in range(3)))
+
+    asyncio.run(run())
+    assert client.max_in_flight == 2
+    # 新的事件循环使用新的信号量
+    asyncio.run(run())
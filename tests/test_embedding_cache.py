@@ -0,0 +1,88 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache
+
+DIMENSION = 4
+VECTOR_BYTES = DIMENSION * 4
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "embeddings.sqlite3")
+
+
+def vectors(*values):
+    return np.array([[value] * DIMENSION for value in values], dtype=np.float32)
+
+
+def last_access(path, model, text):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_access FROM embeddings WHERE key = ?",
+                            (EmbeddingCache.make_key(model, text),)).fetchone()[0]
+
+
+def test_hit_and_miss(cache_path):
+    cache = EmbeddingCache(cache_path, touch_flush_size=100, touch_flush_interval=3600)
+    cache.put_many("m", ["a", "b"], vectors(1, 2))
+
+    result = cache.get_many("m", ["a", "c", "b", "a"])
+    assert sorted(result) == [0, 2, 3]
+    assert result[0].tolist() == [1.0] * DIMENSION
+    assert result[2].tolist() == [2.0] * DIMENSION
+    assert cache.get_many("other-model", ["a"]) == {}
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 2, 2)
+    assert stats["bytes"] == 2 * VECTOR_BYTES
+
+
+def test_overwrite_keeps_byte_count(cache_path):
+    cache = EmbeddingCache(cache_path)
+    cache.put_many("m", ["a"], vectors(1))
+    cache.put_many("m", ["a"], vectors(3))
+    assert cache.stats()["bytes"] == VECTOR_BYTES
+    assert cache.get_many("m", ["a"])[0].tolist() == [3.0] * DIMENSION
+
+
+def test_reads_do_not_write_last_access(cache_path):
+    cache = EmbeddingCache(cache_path, touch_flush_size=100, touch_flush_interval=3600)
+    cache.put_many("m", ["a"], vectors(1))
+    written = last_access(cache_path, "m", "a")
+
+    cache.get_many("m", ["a"])
+    assert last_access(cache_path, "m", "a") == written
+
+    cache.flush_touches()
+    assert last_access(cache_path, "m", "a") > written
+
+
+def test_touches_flush_in_background_when_buffer_is_full(cache_path):
+    cache = EmbeddingCache(cache_path, touch_flush_size=1, touch_flush_interval=3600)
+    cache.put_many("m", ["a"], vectors(1))
+    written = last_access(cache_path, "m", "a")
+
+    cache.get_many("m", ["a"])
+    for _ in range(100):
+        if last_access(cache_path, "m", "a") > written:
+            break
+        time.sleep(0.01)
+    assert last_access(cache_path, "m", "a") > written
+
+
+def test_lru_eviction_uses_buffered_access_times(cache_path):
+    # 超出上限时淘汰到上限的 90%，这里每次淘汰一条
+    cache = EmbeddingCache(cache_path, max_bytes=int(3.5 * VECTOR_BYTES), touch_flush_size=100,
+                           touch_flush_interval=3600)
+    for i, text in enumerate(["a", "b", "c"]):
+        cache.put_many("m", [text], vectors(i))
+        time.sleep(0.01)
+    # 访问 a 后，最久未使用的是 b；a 的访问时间还在内存中，写入时先落盘再淘汰
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["d"], vectors(4))
+
+    assert sorted(cache.get_many("m", ["a", "b", "c", "d"])) == [0, 2, 3]
+    assert cache.stats()["bytes"] == 3 * VECTOR_BYTES
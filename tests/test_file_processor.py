@@ -0,0 +1,94 @@
+import hashlib
+import os
+
+import pytest
+
+import file_processor
+from file_processor import FileProcessor
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(os.urandom(10_000))
+    return str(path)
+
+
+@pytest.fixture
+def small_buffer(monkeypatch):
+    # 缓冲区比文件小，摘要要跨多次 readinto 计算
+    monkeypatch.setattr(file_processor, "FILE_HASH_BUFFER_SIZE", 1024)
+
+
+@pytest.fixture
+def digest_cache(monkeypatch):
+    cache = TTLCache(maxsize=10, ttl=60)
+    monkeypatch.setattr(file_processor, "_file_digest_cache", cache)
+    return cache
+
+
+def test_hash_file_matches_hashlib(data_file, small_buffer):
+    with open(data_file, "rb") as file:
+        data = file.read()
+
+    digests = FileProcessor.hash_file(data_file, ["md5", "blake2b"])
+    assert digests == {
+        "md5": hashlib.md5(data).hexdigest(),
+        "blake2b": hashlib.blake2b(data, digest_size=16).hexdigest(),
+    }
+    assert FileProcessor(data_file).get_file_md5() == digests["md5"]
+
+
+def test_hash_empty_file(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    assert FileProcessor.hash_file(str(path), ["md5"]) == {"md5": hashlib.md5(b"").hexdigest()}
+
+
+def test_unsupported_algorithm(data_file):
+    with pytest.raises(ValueError):
+        FileProcessor.hash_file(data_file, ["sha1"])
+    with pytest.raises(ValueError):
+        FileProcessor.resolve_digest_algorithm("sha1")
+
+
+def test_cached_digests_skip_unchanged_files(data_file, digest_cache, monkeypatch):
+    calls = []
+    hash_file = FileProcessor.hash_file
+
+    def counting_hash_file(file_path, algorithms):
+        calls.append(list(algorithms))
+        return hash_file(file_path, algorithms)
+
+    monkeypatch.setattr(FileProcessor, "hash_file", staticmethod(counting_hash_file))
+
+    first = FileProcessor.get_cached_file_digests(data_file, ["md5"])
+    assert FileProcessor.get_cached_file_digests(data_file, ["md5"]) == first
+    # 只计算缺少的算法
+    FileProcessor.get_cached_file_digests(data_file, ["md5", "blake2b"])
+    assert calls == [["md5"], ["blake2b"]]
+
+    # 内容和修改时间变化后重新计算
+    with open(data_file, "ab") as file:
+        file.write(b"more")
+    stat = os.stat(data_file)
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert FileProcessor.get_cached_file_digests(data_file, ["md5"]) != first
+    assert len(calls) == 3
+
+
+def test_document_handle_collection_names(data_file, digest_cache):
+    with open(data_file, "rb") as file:
+        md5 = hashlib.md5(file.read()).hexdigest()
+
+    document = FileProcessor(data_file).get_document_handle("md5")
+    assert document["collection_name"] == md5
+    assert "legacy_collection_name" not in document
+
+    document = FileProcessor(data_file).get_document_handle("blake2b")
+    assert document["collection_name"].startswith("blake2b_")
+    assert document["legacy_collection_name"] == md5
+    assert FileProcessor.is_collection_name(document["collection_name"])
+    assert FileProcessor.is_collection_name(md5)
+    assert not FileProcessor.is_collection_name("other")
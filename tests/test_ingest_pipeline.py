@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from utils import iter_batches, run_stage
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_run_stage_yields_items_in_order():
+    assert list(run_stage(range(100), maxsize=2)) == list(range(100))
+    assert list(run_stage([])) == []
+
+
+def test_run_stage_reraises_worker_errors():
+    def pages():
+        yield 1
+        yield 2
+        raise RuntimeError("解析失败")
+
+    received = []
+    with pytest.raises(RuntimeError, match="解析失败"):
+        for item in run_stage(pages()):
+            received.append(item)
+    assert received == [1, 2]
+
+
+def test_run_stage_applies_backpressure():
+    produced = []
+
+    def pages():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    stage = run_stage(pages(), maxsize=2)
+    assert next(stage) == 0
+    time.sleep(0.1)
+    # 队列容量 2，加上正在等待放入队列的一项
+    assert len(produced) <= 4
+    stage.close()
+
+
+def test_closing_the_consumer_stops_and_closes_the_source():
+    closed = threading.Event()
+
+    def pages():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    stage = run_stage(pages(), maxsize=1)
+    assert next(stage) == 0
+    stage.close()
+    assert wait_until(closed.is_set)
+
+
+def test_chained_stages_shut_down_on_consumer_error():
+    closed = threading.Event()
+
+    def pages():
+        try:
+            yield from range(1000)
+        finally:
+            closed.set()
+
+    with pytest.raises(ValueError):
+        for batch in run_stage(iter_batches(run_stage(pages(), maxsize=2), 10), maxsize=2):
+            raise ValueError("插入失败")
+    assert wait_until(closed.is_set)
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_batches(range(6), 3)) == [[0, 1, 2], [3, 4, 5]]
+    assert list(iter_batches([], 3)) == []
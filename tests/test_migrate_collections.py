@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from qdrant_client import QdrantClient
+
+import migrate_collections
+from db_qdrant import Qdrant, point_id
+
+LEGACY_COLLECTION = "0123456789abcdef0123456789abcdef"
+SHARED_COLLECTION = "documents"
+
+
+@pytest.fixture
+def qdrant(monkeypatch):
+    # 翻页大小小于节点数，迁移要跨多页
+    monkeypatch.setattr(migrate_collections, "QDRANT_SCROLL_PAGE_SIZE", 4)
+    qdrant = Qdrant(client=QdrantClient(":memory:"))
+    qdrant.create_collection(LEGACY_COLLECTION)
+    vectors = np.random.default_rng(0).random((10, qdrant.size)).tolist()
+    payloads = [{"page_content": f"chunk {i}"} for i in range(10)]
+    # 旧集合的 id 是从 1 开始的连续整数
+    qdrant.add_points(LEGACY_COLLECTION, vectors, payloads, wait=True)
+    qdrant.ensure_shared_collection(SHARED_COLLECTION)
+    return qdrant
+
+
+def test_migrate_collection_copies_points(qdrant):
+    assert migrate_collections.migrate_collection(qdrant, LEGACY_COLLECTION, SHARED_COLLECTION) == 10
+    assert qdrant.get_document_points_count(SHARED_COLLECTION, LEGACY_COLLECTION) == 10
+
+    records = qdrant.client.retrieve(SHARED_COLLECTION, ids=[point_id(LEGACY_COLLECTION, i) for i in range(10)])
+    payloads = sorted((record.payload for record in records), key=lambda payload: payload["chunk_index"])
+    assert [payload["page_content"] for payload in payloads] == [f"chunk {i}" for i in range(10)]
+    assert all(payload["doc_id"] == LEGACY_COLLECTION for payload in payloads)
+
+
+def test_migrate_collection_is_idempotent(qdrant):
+    migrate_collections.migrate_collection(qdrant, LEGACY_COLLECTION, SHARED_COLLECTION)
+    migrate_collections.migrate_collection(qdrant, LEGACY_COLLECTION, SHARED_COLLECTION)
+    assert qdrant.get_document_points_count(SHARED_COLLECTION, LEGACY_COLLECTION) == 10
+    # 旧集合保持不变
+    assert qdrant.get_collection(LEGACY_COLLECTION).points_count == 10
+
+
+def test_main_skips_other_collections_and_deletes_migrated(qdrant, monkeypatch):
+    qdrant.create_collection("other")
+    monkeypatch.setattr(migrate_collections, "Qdrant", lambda: qdrant)
+    monkeypatch.setattr("sys.argv", ["migrate_collections.py", "--shared-collection", SHARED_COLLECTION, "--delete"])
+    migrate_collections.main()
+
+    names = qdrant.list_all_collection_names()
+    assert LEGACY_COLLECTION not in names
+    assert "other" in names
+    assert qdrant.get_document_points_count(SHARED_COLLECTION, LEGACY_COLLECTION) == 10
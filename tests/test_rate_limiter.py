@@ -0,0 +1,145 @@
+import httpx
+import openai
+import pytest
+
+import rate_limiter
+from rate_limiter import (PRIORITY_BULK, PRIORITY_INTERACTIVE, RateLimiter, TokenBucket, backoff_delay,
+                          estimate_chat_tokens, retry_after_seconds)
+
+
+@pytest.fixture
+def limiter(monkeypatch, clock):
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return RateLimiter("test-model", rpm=60, tpm=1000)
+
+
+def status_error(status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return openai.APIStatusError("error", response=response, body=None)
+
+
+class RawResponse:
+    def __init__(self, result, headers=None):
+        self.result = result
+        self.headers = httpx.Headers(headers or {})
+
+    def parse(self):
+        return self.result
+
+
+def test_token_bucket_wait_and_refill():
+    bucket = TokenBucket(60)  # 每秒补充 1 个
+    bucket.tokens = 0
+    assert bucket.wait_time(30) == pytest.approx(30)
+    assert bucket.wait_time(10, floor=5) == pytest.approx(15)
+
+    bucket.refill(bucket.updated + 20)
+    assert bucket.tokens == pytest.approx(20)
+    bucket.refill(bucket.updated + 3600)
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_sync_keeps_lower_local_value():
+    bucket = TokenBucket(100)
+    bucket.tokens = 10
+    bucket.sync(200, 50)
+    assert bucket.capacity == 200
+    assert bucket.tokens == 10
+    bucket.sync(None, 5)
+    assert bucket.tokens == 5
+
+
+def test_acquire_waits_for_tokens(limiter, clock):
+    assert limiter._try_acquire(600, PRIORITY_INTERACTIVE) == 0
+    wait = limiter._try_acquire(600, PRIORITY_INTERACTIVE)
+    assert wait == pytest.approx(200 * 60 / 1000)
+
+    clock.advance(wait)
+    assert limiter._try_acquire(600, PRIORITY_INTERACTIVE) == 0
+
+
+def test_oversized_request_is_capped_to_capacity(limiter):
+    assert limiter._try_acquire(5000, PRIORITY_INTERACTIVE) == 0
+    assert limiter.tokens.tokens == pytest.approx(0)
+
+
+def test_bulk_leaves_reserve_for_interactive(limiter):
+    # 批量请求只能用到容量的 RATE_LIMIT_BULK_RATIO
+    assert limiter._try_acquire(800, PRIORITY_BULK) == 0
+    assert limiter._try_acquire(1, PRIORITY_BULK) > 0
+    assert limiter._try_acquire(200, PRIORITY_INTERACTIVE) == 0
+
+
+def test_bulk_yields_to_waiting_interactive(limiter):
+    limiter._set_waiting(PRIORITY_INTERACTIVE, 1)
+    assert limiter._try_acquire(1, PRIORITY_BULK) == rate_limiter._YIELD_INTERVAL
+    assert limiter._try_acquire(1, PRIORITY_INTERACTIVE) == 0
+    limiter._set_waiting(PRIORITY_INTERACTIVE, -1)
+    assert limiter._try_acquire(1, PRIORITY_BULK) == 0
+
+
+def test_pause_blocks_all_priorities(limiter, clock):
+    limiter.pause(5)
+    assert limiter._try_acquire(1, PRIORITY_INTERACTIVE) == pytest.approx(5)
+    clock.advance(5)
+    assert limiter._try_acquire(1, PRIORITY_INTERACTIVE) == 0
+
+
+def test_update_from_headers(limiter):
+    limiter.update_from_headers({
+        "x-ratelimit-limit-requests": "120",
+        "x-ratelimit-remaining-requests": "7",
+        "x-ratelimit-limit-tokens": "2000",
+        "x-ratelimit-remaining-tokens": "300",
+    })
+    assert limiter.requests.capacity == 120
+    assert limiter.requests.tokens == 7
+    assert limiter.tokens.capacity == 2000
+    assert limiter.tokens.tokens == 300
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds({"retry-after-ms": "1500"}) == 1.5
+    assert retry_after_seconds({"retry-after": "3"}) == 3
+    assert retry_after_seconds({}) is None
+
+
+def test_backoff_delay_bounds():
+    for attempt in range(8):
+        delay = backoff_delay(attempt, base=1, cap=8)
+        ceiling = min(8, 2 ** attempt)
+        assert ceiling / 2 <= delay <= ceiling
+    assert 10 <= backoff_delay(0, retry_after=10, base=1, cap=30) <= 11
+
+
+def test_estimate_chat_tokens_uses_known_prompt_tokens():
+    messages = [{"role": "user", "content": "hello"}]
+    assert estimate_chat_tokens(messages, "gpt-4", 100, prompt_tokens=42) == 142
+    # 字节编码器下 "hello" 是 5 个 token
+    assert estimate_chat_tokens(messages, "gpt-4", 100) == 5 + rate_limiter.MESSAGE_OVERHEAD_TOKENS + 100
+
+
+def test_request_retries_retryable_errors(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rate_limiter.time, "sleep", sleeps.append)
+    errors = [status_error(503), openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))]
+
+    def func():
+        if errors:
+            raise errors.pop(0)
+        return RawResponse("ok")
+
+    assert rate_limiter.request(func, "test-request-model", 10) == "ok"
+    assert len(sleeps) == 2
+
+
+def test_request_does_not_retry_client_errors(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, "sleep", lambda seconds: pytest.fail("不应重试"))
+
+    def func():
+        raise status_error(400)
+
+    with pytest.raises(openai.APIStatusError):
+        rate_limiter.request(func, "test-request-model", 10)
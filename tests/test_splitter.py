@@ -0,0 +1,61 @@
+import pytest
+
+from file_processor_helper import TokenOffsetTextSplitter
+
+
+def test_short_text_is_a_single_chunk():
+    splitter = TokenOffsetTextSplitter(chunk_size=100, chunk_overlap=10)
+    assert splitter.split_text("  short text \n") == ["short text"]
+    assert splitter.split_text("   ") == []
+
+
+def test_chunks_respect_size_and_overlap():
+    text = "".join(f"word{i:03d} " for i in range(200))
+    splitter = TokenOffsetTextSplitter(chunk_size=100, chunk_overlap=20, separators=[" "])
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    assert text.startswith(chunks[0])
+    assert text.rstrip().endswith(chunks[-1])
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # 字节编码器下 token 数等于字节数
+        assert len(chunk.encode()) <= 100
+        assert chunk in text
+        # 相邻块有重叠：后一块的开头出现在前一块中
+        assert chunk[:8] in previous
+
+
+def test_cut_prefers_separators():
+    paragraphs = ["a" * 40, "b" * 40, "c" * 40]
+    splitter = TokenOffsetTextSplitter(chunk_size=90, chunk_overlap=5)
+    chunks = splitter.split_text("\n\n".join(paragraphs))
+
+    assert chunks[0] == "a" * 40 + "\n\n" + "b" * 40
+
+
+def test_multibyte_characters_are_not_split():
+    # 字节编码器下每个汉字 3 个 token，切点必须落在字符边界上
+    text = "中文文本切分测试" * 40
+    splitter = TokenOffsetTextSplitter(chunk_size=50, chunk_overlap=10, separators=["。"])
+    chunks = splitter.split_text(text)
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk in text
+        assert "�" not in chunk
+
+
+def test_create_documents_copies_metadata():
+    splitter = TokenOffsetTextSplitter(chunk_size=20, chunk_overlap=5, separators=[" "])
+    metadata = {"file_name": "a.txt"}
+    docs = splitter.create_documents(["one two three four five six seven eight"], metadatas=[metadata])
+
+    assert len(docs) > 1
+    assert all(doc.metadata == metadata for doc in docs)
+    docs[0].metadata["page"] = 1
+    assert "page" not in metadata
+
+
+def test_overlap_must_be_smaller_than_chunk_size():
+    with pytest.raises(ValueError):
+        TokenOffsetTextSplitter(chunk_size=10, chunk_overlap=10)
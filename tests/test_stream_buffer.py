@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+import stream_buffer
+from stream_buffer import STALLED, StreamBuffer, iter_stream
+
+
+def test_first_delta_flushes_immediately():
+    buffer = StreamBuffer(policy="chars", chars=100)
+    assert buffer.append("你")
+    assert buffer.flush() == "你"
+    assert not buffer.pending
+
+
+def test_empty_delta_is_ignored():
+    buffer = StreamBuffer(policy="chars", chars=1)
+    assert not buffer.append("")
+    assert not buffer.append(None)
+    assert not buffer.pending
+
+
+def test_chars_policy():
+    buffer = StreamBuffer(policy="chars", chars=5)
+    buffer.append("a")
+    buffer.flush()
+    assert not buffer.append("bc")
+    assert buffer.append("def")
+    assert buffer.flush() == "abcdef"
+    assert buffer.flushes == 2
+
+
+def test_time_policy(monkeypatch, clock):
+    monkeypatch.setattr(stream_buffer.time, "monotonic", clock)
+    buffer = StreamBuffer(policy="time", interval=0.05)
+    buffer.append("a")
+    buffer.flush()
+    assert not buffer.append("b")
+    clock.advance(0.06)
+    assert buffer.append("c")
+    assert buffer.flush() == "abc"
+
+
+def test_time_until_flush(monkeypatch, clock):
+    monkeypatch.setattr(stream_buffer.time, "monotonic", clock)
+    buffer = StreamBuffer(policy="time", interval=0.05)
+    assert buffer.time_until_flush() is None
+    buffer.append("a")
+    buffer.flush()
+    # 没有未推送的内容时不需要超时推送
+    assert buffer.time_until_flush() is None
+    clock.advance(0.02)
+    buffer.append("b")
+    assert buffer.time_until_flush() == pytest.approx(0.03)
+    clock.advance(0.1)
+    assert buffer.time_until_flush() == 0
+    assert StreamBuffer(policy="chars").time_until_flush() is None
+
+
+def test_sentence_policy():
+    buffer = StreamBuffer(policy="sentence", chars=100)
+    buffer.append("开")
+    buffer.flush()
+    assert not buffer.append("始回答")
+    assert buffer.append("。")
+    assert buffer.flush() == "开始回答。"
+
+    # 长句没有句末标点时按字符数推送
+    buffer = StreamBuffer(policy="sentence", chars=4)
+    buffer.append("a")
+    buffer.flush()
+    assert not buffer.append("bcd")
+    assert buffer.append("e")
+
+
+def test_text_includes_pending_deltas():
+    buffer = StreamBuffer(policy="chars", chars=100)
+    buffer.append("a")
+    buffer.flush()
+    buffer.append("b")
+    assert buffer.pending
+    assert buffer.text == "ab"
+    assert buffer.flush() == "ab"
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StreamBuffer(policy="words")
+
+
+async def deltas(*items):
+    # 数字表示停顿的秒数
+    for item in items:
+        if isinstance(item, float):
+            await asyncio.sleep(item)
+        else:
+            yield item
+
+
+def collect(stream, timeout):
+    async def run():
+        return [item async for item in iter_stream(stream, timeout)]
+    return asyncio.run(run())
+
+
+def test_iter_stream_reports_stalls_without_losing_items():
+    items = collect(deltas("a", 0.05, "b"), lambda: 0.01)
+    assert items[0] == "a" and items[-1] == "b"
+    assert STALLED in items
+    assert [item for item in items if item is not STALLED] == ["a", "b"]
+
+
+def test_iter_stream_waits_when_no_flush_is_due():
+    assert collect(deltas("a", 0.02, "b"), lambda: None) == ["a", "b"]
+
+
+def test_iter_stream_propagates_errors():
+    async def failing():
+        yield "a"
+        raise RuntimeError("断开")
+
+    with pytest.raises(RuntimeError):
+        collect(failing(), lambda: None)
+
+
+def test_stalled_stream_flushes_buffered_text():
+    async def run():
+        buffer = StreamBuffer(policy="time", interval=0.02)
+        pushed = []
+        async for item in iter_stream(deltas("a", "b", 0.1, "c"), buffer.time_until_flush):
+            if item is STALLED or buffer.append(item):
+                pushed.append(buffer.flush())
+        return pushed
+
+    # 停顿期间 "b" 按时推送，不必等到 "c"
+    assert asyncio.run(run()) == ["a", "ab", "abc"]
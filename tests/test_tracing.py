@@ -0,0 +1,84 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", True)
+    monkeypatch.setattr(tracing, "_histograms", {})
+
+
+def test_histogram_buckets_are_inclusive_upper_bounds():
+    histogram = tracing.Histogram(buckets=(0.1, 1))
+    for seconds in (0.05, 0.1, 0.5, 2):
+        histogram.observe(seconds)
+    counts, total, count = histogram.snapshot()
+    assert counts == [2, 1, 1]
+    assert total == pytest.approx(2.65)
+    assert count == 4
+
+
+def test_render_prometheus(enabled):
+    for stage in ("search", "embed_query"):
+        tracing._histograms[stage] = tracing.Histogram(buckets=(0.1, 1))
+    tracing.observe("search", 0.05)
+    tracing.observe("search", 0.5)
+    tracing.observe("embed_query", 3)
+
+    lines = tracing.render_prometheus().splitlines()
+    assert lines[:2] == [
+        f"# HELP {tracing.METRIC_NAME} Latency of each ingest and chat stage in seconds.",
+        f"# TYPE {tracing.METRIC_NAME} histogram",
+    ]
+    name = tracing.METRIC_NAME
+    # 阶段按名字排序，桶计数是累计的
+    assert lines[2:] == [
+        f'{name}_bucket{{stage="embed_query",le="0.1"}} 0',
+        f'{name}_bucket{{stage="embed_query",le="1"}} 0',
+        f'{name}_bucket{{stage="embed_query",le="+Inf"}} 1',
+        f'{name}_sum{{stage="embed_query"}} 3.0',
+        f'{name}_count{{stage="embed_query"}} 1',
+        f'{name}_bucket{{stage="search",le="0.1"}} 1',
+        f'{name}_bucket{{stage="search",le="1"}} 2',
+        f'{name}_bucket{{stage="search",le="+Inf"}} 2',
+        f'{name}_sum{{stage="search"}} 0.55',
+        f'{name}_count{{stage="search"}} 2',
+    ]
+
+
+def test_span_and_traced_iter_record_stages(enabled):
+    with tracing.span("pack"):
+        pass
+    assert list(tracing.traced_iter("extract", iter([1, 2, 3]))) == [1, 2, 3]
+    assert tracing._histograms["pack"].count == 1
+    assert tracing._histograms["extract"].count == 3
+
+
+def test_disabled_tracing_records_nothing(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", False)
+    monkeypatch.setattr(tracing, "_histograms", {})
+    items = iter([1])
+    with tracing.span("pack"):
+        tracing.observe("first_token", 1)
+    assert tracing.traced_iter("extract", items) is items
+    assert tracing._histograms == {}
+
+
+def test_metrics_endpoint(enabled, monkeypatch):
+    monkeypatch.setattr(tracing, "_metrics_server", None)
+    tracing.observe("search", 0.01)
+    server = tracing.start_metrics_server("127.0.0.1", 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert 'stage="search"' in response.read().decode("utf-8")
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import ttl_cache
+import utils
+from ttl_cache import TTLCache
+
+
+@pytest.fixture
+def patched_clock(monkeypatch, clock):
+    monkeypatch.setattr(ttl_cache.time, "monotonic", clock)
+    return clock
+
+
+def test_get_and_set(patched_clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("a") is None
+    assert cache.get("a", "default") == "default"
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_expire_after_ttl(patched_clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    patched_clock.advance(59)
+    assert cache.get("a") == 1
+    patched_clock.advance(1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction(patched_clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_pop_and_clear(patched_clock):
+    cache = TTLCache()
+    cache.set("a", 1)
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    cache.set("b", 2)
+    cache.clear()
+    assert len(cache) == 0
+
+
+class FakeQdrant:
+    """记录检索次数的 AsyncQdrant 替身。"""
+
+    def __init__(self):
+        self.searches = 0
+
+    async def search(self, collection_name, question_vector, limit, doc_ids=None):
+        return await self.search_collections(doc_ids, question_vector, limit)
+
+    async def search_collections(self, collection_names, question_vector, limit):
+        self.searches += 1
+        return [SimpleNamespace(id=i, score=1 - i / 10, payload={"page_content": f"chunk {i}"}) for i in range(limit)]
+
+
+def test_retrieval_cache_is_invalidated_by_reingest(monkeypatch):
+    monkeypatch.setattr(utils, "_retrieval_cache", TTLCache(maxsize=10, ttl=60))
+    qdrant = FakeQdrant()
+    vector = np.ones(4, dtype=np.float32)
+
+    def search(collection_names):
+        return asyncio.run(utils.search_points_async(qdrant, collection_names, vector, 2))
+
+    points = search(["doc-a", "doc-b"])
+    assert [point["id"] for point in points] == [0, 1]
+    assert search(["doc-b", "doc-a"]) == points
+    assert qdrant.searches == 1
+
+    utils.invalidate_retrieval_cache("doc-b")
+    search(["doc-a", "doc-b"])
+    assert qdrant.searches == 2
+
+    # 其他集合的缓存不受影响
+    search(["doc-c"])
+    utils.invalidate_retrieval_cache("doc-b")
+    search(["doc-c"])
+    assert qdrant.searches == 3
+
+
+def test_normalize_question():
+    assert utils.normalize_question("  什么是\tＱｄｒａｎｔ？ ") == utils.normalize_question("什么是 Qdrant?")
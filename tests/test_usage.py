@@ -0,0 +1,107 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import usage
+from usage import AsyncTrackedStream, JsonlFileSink, TrackedStream, UsageTracker
+
+
+@pytest.fixture
+def records():
+    received = []
+    usage.register_sink(received.append)
+    yield received
+    usage.unregister_sink(received.append)
+
+
+def chunk(content=None, usage_data=None):
+    choices = [] if usage_data is not None else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    return SimpleNamespace(choices=choices, usage=usage_data)
+
+
+API_USAGE = SimpleNamespace(prompt_tokens=12, completion_tokens=3,
+                            prompt_tokens_details={"cached_tokens": 8})
+
+
+def test_stream_uses_api_usage_and_skips_usage_chunk(records):
+    chunks = [chunk("he"), chunk("llo"), chunk(usage_data=API_USAGE)]
+    stream = TrackedStream(iter(chunks), UsageTracker("gpt-4", stream=True, prompt_tokens=100))
+
+    assert [c.choices[0].delta.content for c in stream] == ["he", "llo"]
+    record = stream.usage
+    assert records == [record]
+    assert (record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"]) == (12, 3, 8)
+    assert record["total_tokens"] == 15
+    assert record["source"] == "api"
+    assert record["first_token_ms"] is not None
+
+
+def test_stream_without_usage_estimates_completion_tokens(records):
+    estimates = []
+
+    def prompt_tokens():
+        estimates.append(1)
+        return 7
+
+    stream = TrackedStream(iter([chunk("ab"), chunk(None), chunk("cde")]),
+                           UsageTracker("gpt-4", stream=True, prompt_tokens=prompt_tokens))
+    list(stream)
+
+    # 字节编码器下每个字节一个 token
+    assert (stream.usage["prompt_tokens"], stream.usage["completion_tokens"]) == (7, 5)
+    assert stream.usage["source"] == "estimate"
+    assert estimates == [1]
+
+
+def test_prompt_estimate_is_not_computed_when_api_returns_usage(records):
+    tracker = UsageTracker("gpt-4", prompt_tokens=lambda: pytest.fail("不应估算 prompt token 数"))
+    tracker.observe_usage(API_USAGE)
+    assert tracker.finish()["prompt_tokens"] == 12
+
+
+def test_aborted_stream_still_emits_one_record(records):
+    stream = TrackedStream(iter([chunk("a"), chunk("b"), chunk("c")]), UsageTracker("gpt-4", stream=True))
+    for _ in stream:
+        break
+    # 生成器关闭时生成记录，重复 finish 不会重复上报
+    stream.tracker.finish()
+    assert len(records) == 1
+    assert records[0]["completion_tokens"] == 1
+
+
+def test_async_stream(records):
+    async def response():
+        for item in [chunk("hi"), chunk(usage_data={"prompt_tokens": 2, "completion_tokens": 1})]:
+            yield item
+
+    async def run():
+        stream = AsyncTrackedStream(response(), UsageTracker("gpt-4", stream=True))
+        return [c.choices[0].delta.content async for c in stream], stream.usage
+
+    contents, record = asyncio.run(run())
+    assert contents == ["hi"]
+    assert (record["prompt_tokens"], record["completion_tokens"], record["cached_tokens"]) == (2, 1, 0)
+
+
+def test_failing_sink_does_not_break_the_caller(records):
+    def failing_sink(record):
+        raise RuntimeError("sink 不可用")
+
+    usage.register_sink(failing_sink)
+    try:
+        UsageTracker("gpt-4", prompt_tokens=1).finish()
+    finally:
+        usage.unregister_sink(failing_sink)
+    assert len(records) == 1
+
+
+def test_jsonl_sink(tmp_path):
+    path = tmp_path / "logs" / "usage.jsonl"
+    sink = JsonlFileSink(str(path))
+    sink({"model": "gpt-4", "total_tokens": 3})
+    sink({"model": "模型", "total_tokens": 4})
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["total_tokens"] for line in lines] == [3, 4]
+    assert "模型" in lines[1]
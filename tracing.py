@@ -0,0 +1,200 @@
+"""
+轻量的分阶段耗时统计。
+
+入库阶段：hash, extract, split, embed, upsert
+问答阶段：embed_query, search, pack, first_token, total
+
+每个阶段一个进程内直方图，通过 Prometheus 文本格式的 /metrics 端点暴露（与 Gradio 应用分开的端口）；
+安装了 opentelemetry 并打开 OTEL_EXPORTER_ENABLED 时，每个 span 同时导出到 OpenTelemetry。
+TRACING_ENABLED 关闭时 span() 返回共享的空上下文管理器，traced_iter() 原样返回迭代器，几乎没有开销。
+
+用法：
+    with tracing.span("search"):
+        ...
+    tracing.observe("first_token", seconds)
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loguru import logger
+
+from config import (METRICS_HOST, METRICS_PORT, OTEL_EXPORTER_ENABLED, OTEL_SERVICE_NAME, TRACING_BUCKETS,
+                    TRACING_ENABLED)
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # opentelemetry 是可选依赖
+    otel_trace = None
+
+METRIC_NAME = "llm_assistant_stage_seconds"
+
+_NOOP_SPAN = nullcontext()
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+_tracer = None
+_metrics_server = None
+
+
+class Histogram:
+    """固定桶的累计直方图，线程安全。"""
+
+    def __init__(self, buckets=TRACING_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个是 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+def _get_histogram(stage):
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    return histogram
+
+
+def observe(stage, seconds):
+    """记录一个阶段的耗时（秒），用于无法用 span 包裹的阶段，例如首个 token 的延迟。"""
+    if TRACING_ENABLED:
+        _get_histogram(stage).observe(seconds)
+
+
+@contextmanager
+def _span(stage):
+    start = time.perf_counter()
+    if _tracer is not None:
+        with _tracer.start_as_current_span(stage):
+            try:
+                yield
+            finally:
+                _get_histogram(stage).observe(time.perf_counter() - start)
+    else:
+        try:
+            yield
+        finally:
+            _get_histogram(stage).observe(time.perf_counter() - start)
+
+
+def span(stage):
+    """统计 with 块的耗时，同步和异步代码中都可以使用。"""
+    if not TRACING_ENABLED:
+        return _NOOP_SPAN
+    return _span(stage)
+
+
+def traced_iter(stage, iterable):
+    """
+    统计每次从迭代器取下一个元素的耗时，用于生成器形式的阶段（例如逐页提取）。
+    只统计迭代器内部的耗时，不包括调用方处理元素的时间。
+    """
+    if not TRACING_ENABLED:
+        return iterable
+    return _traced_iter(stage, iterable)
+
+
+def _traced_iter(stage, iterable):
+    histogram = _get_histogram(stage)
+    iterator = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            histogram.observe(time.perf_counter() - start)
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def render_prometheus():
+    """Prometheus 文本格式（0.0.4）的全部阶段直方图。"""
+    lines = [
+        f"# HELP {METRIC_NAME} Latency of each ingest and chat stage in seconds.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    for stage, histogram in items:
+        counts, total, count = histogram.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+        lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {total}')
+        lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 不把每次抓取写到 stderr
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """在后台线程中启动 /metrics 端点；TRACING_ENABLED 关闭时不启动。"""
+    global _metrics_server
+    if not TRACING_ENABLED or _metrics_server is not None:
+        return _metrics_server
+    _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=_metrics_server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"metrics 端点已启动：http://{host}:{port}/metrics")
+    return _metrics_server
+
+
+def setup_opentelemetry():
+    """
+    配置 OpenTelemetry 导出：使用 OTLP exporter（标准 OTEL_EXPORTER_OTLP_* 环境变量配置地址）。
+    未安装 opentelemetry-sdk / opentelemetry-exporter-otlp 时记录警告并跳过。
+    """
+    global _tracer
+    if not (TRACING_ENABLED and OTEL_EXPORTER_ENABLED):
+        return
+    if otel_trace is None:
+        logger.warning("未安装 opentelemetry，跳过 OpenTelemetry 导出")
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        logger.warning(f"未安装 opentelemetry-sdk 或 OTLP exporter，跳过 OpenTelemetry 导出：{e}")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    _tracer = otel_trace.get_tracer(__name__)
+    logger.info("OpenTelemetry 导出已启用")
@@ -0,0 +1,54 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    线程安全的进程内缓存，同时支持 TTL 过期和 LRU 淘汰。
+
+    - 条目写入 ttl 秒后过期，读取到过期条目视为未命中并删除。
+    - 条目数超过 maxsize 时淘汰最近最少使用的条目。
+    """
+
+    _MISSING = object()
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (过期时间, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, self._MISSING)
+            if item is self._MISSING or item[0] <= now:
+                if item is not self._MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, self._MISSING)
+        return default if item is self._MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
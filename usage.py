@@ -0,0 +1,195 @@
+"""
+模型调用的用量记录。
+
+每次调用结束后生成一条结构化记录，交给已注册的 sink（日志、JSONL 文件或自定义函数），供成本统计使用：
+    {"operation", "model", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens",
+     "latency_ms", "first_token_ms", "stream", "source", "timestamp"}
+source 为 "api" 表示来自接口返回的 usage，"estimate" 表示本地估算（流式接口未返回 usage 时）。
+"""
+import json
+import os
+import threading
+import time
+
+from loguru import logger
+
+from config import USAGE_LOG_PATH, USAGE_SINKS
+from file_processor_helper import FileProcessorHelper
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+
+def register_sink(sink):
+    """
+    注册用量 sink：接收一条记录（dict）的可调用对象。sink 抛出的异常只记录日志，不影响调用方。
+    """
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def unregister_sink(sink):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def emit_usage(record):
+    for sink in list(_sinks):
+        try:
+            sink(record)
+        except Exception as e:
+            logger.warning(f"用量 sink 出错 | sink: {sink} 错误信息: {e}")
+
+
+def log_sink(record):
+    first_token = f" first_token: {record['first_token_ms']}ms" if record['first_token_ms'] is not None else ""
+    logger.success(f"用量 | {record['operation']} model: {record['model']} "
+                   f"total_tokens: {record['total_tokens']} = prompt_tokens: {record['prompt_tokens']} "
+                   f"(cached: {record['cached_tokens']}) + completion_tokens: {record['completion_tokens']} "
+                   f"latency: {record['latency_ms']}ms{first_token} source: {record['source']}")
+
+
+class JsonlFileSink:
+    """每条记录追加一行 JSON，供离线汇总或采集到成本看板。"""
+
+    def __init__(self, path=USAGE_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _usage_value(usage, name):
+    # 未在 SDK 模型中声明的字段以 dict 形式保留，两种形式都支持
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+class UsageTracker:
+    """
+    记录一次模型调用的用量。流式调用时逐个观察 chunk：
+    接口在最后一个 chunk（choices 为空）返回 usage 时使用接口的数字，否则按增量累计 completion token 数。
+    """
+
+    def __init__(self, model, operation="chat", stream=False, prompt_tokens=None):
+        self.model = model
+        self.operation = operation
+        self.stream = stream
+        # 调用方估算的 prompt token 数，可以是整数或无参函数（只在接口没有返回 usage 时才调用），接口返回 usage 时被覆盖
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = 0
+        self.cached_tokens = None
+        self.source = "estimate"
+        self.start = time.perf_counter()
+        self.first_token_ms = None
+        self.record = None
+        self._encoding = None
+
+    def observe_usage(self, usage):
+        if usage is None:
+            return
+        self.prompt_tokens = _usage_value(usage, "prompt_tokens")
+        self.completion_tokens = _usage_value(usage, "completion_tokens") or 0
+        self.cached_tokens = _usage_value(_usage_value(usage, "prompt_tokens_details"), "cached_tokens")
+        self.source = "api"
+
+    def observe_chunk(self, chunk):
+        """
+        :return: chunk 是否带有 choices（只带 usage 的最后一个 chunk 返回 False，调用方应跳过）
+        """
+        self.observe_usage(getattr(chunk, "usage", None))
+        if not chunk.choices:
+            return False
+        content = chunk.choices[0].delta.content
+        if content:
+            if self.first_token_ms is None:
+                self.first_token_ms = round((time.perf_counter() - self.start) * 1000, 1)
+            if self.source != "api":
+                # 只编码这个增量，不重新编码整段回复
+                if self._encoding is None:
+                    self._encoding = FileProcessorHelper.get_encoding(self.model)
+                self.completion_tokens += len(self._encoding.encode(content, disallowed_special=()))
+        return True
+
+    def finish(self):
+        if self.record is not None:
+            return self.record
+        prompt_tokens = self.prompt_tokens() if callable(self.prompt_tokens) else self.prompt_tokens
+        prompt_tokens = prompt_tokens or 0
+        self.record = {
+            "operation": self.operation,
+            "model": self.model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens or 0,
+            "total_tokens": prompt_tokens + self.completion_tokens,
+            "latency_ms": round((time.perf_counter() - self.start) * 1000, 1),
+            "first_token_ms": self.first_token_ms,
+            "stream": self.stream,
+            "source": self.source,
+            "timestamp": time.time(),
+        }
+        emit_usage(self.record)
+        return self.record
+
+
+class TrackedStream:
+    """
+    包装同步的流式响应：跳过只带 usage 的 chunk，迭代结束（或提前中止）时生成用量记录。
+    """
+
+    def __init__(self, response, tracker):
+        self.response = response
+        self.tracker = tracker
+
+    @property
+    def usage(self):
+        return self.tracker.record
+
+    def __iter__(self):
+        try:
+            for chunk in self.response:
+                if self.tracker.observe_chunk(chunk):
+                    yield chunk
+        finally:
+            self.tracker.finish()
+
+
+class AsyncTrackedStream:
+    """TrackedStream 的异步版本。"""
+
+    def __init__(self, response, tracker):
+        self.response = response
+        self.tracker = tracker
+
+    @property
+    def usage(self):
+        return self.tracker.record
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.response:
+                if self.tracker.observe_chunk(chunk):
+                    yield chunk
+        finally:
+            self.tracker.finish()
+
+
+# 按 config.USAGE_SINKS 注册内置 sink
+for _sink_name in USAGE_SINKS:
+    if _sink_name == "log":
+        register_sink(log_sink)
+    elif _sink_name == "jsonl":
+        register_sink(JsonlFileSink())
+    else:
+        logger.warning(f"未知的用量 sink: {_sink_name}")
@@ -1,10 +1,41 @@
+import asyncio
+import hashlib
+import heapq
+import json
+import os
+import queue
+import threading
 import time
 import traceback
+import unicodedata
+from contextlib import closing
+
+import numpy as np
 
 from db_qdrant import *
-from AssistantGPT import AssistantGPT
+from AssistantGPT import AssistantGPT, AsyncAssistantGPT, is_openai_failure
+from circuit_breaker import CircuitOpenError, DependencyUnavailable
+from config import (DEFAULT_MAX_TOKENS, DEFAULT_MODEL, EMBEDDING_MODEL, INGEST_BATCH_SIZE, INGEST_CLEANUP_MARKER_PATH,
+                    INGEST_QUEUE_SIZE, QDRANT_SHARED_COLLECTION, QDRANT_STORAGE_MODE, QDRANT_UPSERT_WAIT, QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL,
+                    RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+from context_packer import PromptBudgetError, pack_prompt_parts
+from conversation import ConversationState
 from file_processor import FileProcessor
 from file_processor_helper import FileProcessorHelper
+from log_config import log_payload, truncate
+from rate_limiter import PRIORITY_BULK
+import tracing
+from ttl_cache import TTLCache
+
+# 一级缓存：规范化后的问题文本 -> 问题向量
+_question_vector_cache = TTLCache(QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL)
+# 二级缓存：(集合及其版本号, 问题向量哈希, top_n) -> 按分数降序的 points
+_retrieval_cache = TTLCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+# 集合名 -> 版本号。集合重新入库时递增，旧版本的检索缓存自然失效
+_collection_generations = {}
+_collection_generations_lock = threading.Lock()
+# 待清理的部分入库数据（集合名，共享集合模式下为 doc_id），持久化在 INGEST_CLEANUP_MARKER_PATH
+_cleanup_markers_lock = threading.Lock()
 
 
 def create_result_dict(code, msg=None, data=None):
@@ -33,10 +64,10 @@ def create_result_dict(code, msg=None, data=None):
 
 
 # 文件入向量数据库
-def file_to_vectordb(file_path, file_name, file_extension, file_md5):
+def file_to_vectordb(file_path, file_name, file_extension, file_md5, collection_name=None):
 
-    # 集合名就是文件的 MD5 值
-    collection_name = file_md5
+    # 集合名默认就是文件的 MD5 值，使用其他摘要算法时由文档句柄给出
+    collection_name = collection_name or file_md5
 
     # 创建 Qdrant 类对象
     qdrant = Qdrant()
@@ -44,8 +75,27 @@ def file_to_vectordb(file_path, file_name, file_extension, file_md5):
     # This line is for testing delete_collection
     # qdrant.client.delete_collection(collection_name=collection_name)
 
-    # 获取集合里的数据数量 points_count，取值有三种情况: 0、>0、-1
-    points_count = qdrant.get_points_count(collection_name)
+    # 共享集合模式下，所有文件存入同一个集合，原来的集合名作为文档的 doc_id
+    if QDRANT_STORAGE_MODE == 'shared':
+        target_collection_name, doc_id = QDRANT_SHARED_COLLECTION, collection_name
+    else:
+        target_collection_name, doc_id = collection_name, None
+
+    # 上次入库失败且没能清理的部分数据会被误判为入库完成，先清理
+    if needs_cleanup(collection_name):
+        try:
+            cleanup_partial_ingest(qdrant, target_collection_name, doc_id)
+        except Exception as e:
+            logger.error(f"清理上次未完成的入库失败 | collection_name: {collection_name} 错误信息: {e}")
+            return ''
+        set_needs_cleanup(collection_name, False)
+        logger.info(f"已清理上次未完成的入库，重新入库 | collection_name: {collection_name}")
+
+    if doc_id:
+        points_count = qdrant.get_document_points_count(target_collection_name, doc_id)
+    else:
+        # 获取集合里的数据数量 points_count，取值有三种情况: 0、>0、-1
+        points_count = qdrant.get_points_count(collection_name)
 
     if points_count == 0:
         # case 1: 刚创建完集合，集合里没有节点
@@ -57,22 +107,21 @@ def file_to_vectordb(file_path, file_name, file_extension, file_md5):
             file_md5=file_md5,
         )
 
-        # 获取 docs
-        docs = file_processor_helper.file_to_docs()
-        logger.trace(f"docs: {docs}")
-
-        # 切分 docs
-        docs = file_processor_helper.split_docs(docs)
-        texts = [doc.page_content for doc in docs]
-        metadatas = [doc.metadata for doc in docs]
-
-        # 向量化 docs
-        payloads = build_payloads(texts, metadatas)
-        gpt = AssistantGPT()
-        embeddings = gpt.get_embeddings(texts)
-        # 插入节点
-        if qdrant.add_points(collection_name, embeddings, payloads):
-            return file_path
+        # 流式入库：提取 -> 切分 -> 向量化 -> 插入节点
+        try:
+            ingest_file(qdrant, target_collection_name, file_processor_helper, doc_id=doc_id)
+        except Exception:
+            # 已经插入部分节点的集合（文档）会被误判为入库完成，失败时删除，下次上传重新入库
+            try:
+                cleanup_partial_ingest(qdrant, target_collection_name, doc_id)
+            except Exception as cleanup_error:
+                # 清理失败（例如断路器已断开）时记录待清理标记，并抛出原来的入库错误
+                logger.error(f"清理部分入库的数据失败，下次上传时重新清理 | collection_name: {collection_name} "
+                             f"错误信息: {cleanup_error}")
+                set_needs_cleanup(collection_name, True)
+            raise
+        invalidate_retrieval_cache(collection_name)
+        return file_path
     elif points_count > 0:
         # case 2: 库里已有该集合，且该集合有节点
         return file_path
@@ -81,6 +130,156 @@ def file_to_vectordb(file_path, file_name, file_extension, file_md5):
         return ''
 
 
+def cleanup_partial_ingest(qdrant, target_collection_name, doc_id=None):
+    # 删除部分入库的数据：共享集合模式下删除文档的节点，否则删除整个集合
+    if doc_id:
+        qdrant.delete_document(target_collection_name, doc_id)
+    else:
+        qdrant.delete_collection(target_collection_name)
+
+
+def _load_cleanup_markers():
+    try:
+        with open(INGEST_CLEANUP_MARKER_PATH, encoding="utf-8") as file:
+            return set(json.load(file))
+    except FileNotFoundError:
+        return set()
+
+
+def needs_cleanup(collection_name):
+    with _cleanup_markers_lock:
+        return collection_name in _load_cleanup_markers()
+
+
+def set_needs_cleanup(collection_name, needed):
+    # 标记文件先写临时文件再替换，进程中途退出也不会留下损坏的文件
+    with _cleanup_markers_lock:
+        markers = _load_cleanup_markers()
+        if (collection_name in markers) == needed:
+            return
+        if needed:
+            markers.add(collection_name)
+        else:
+            markers.discard(collection_name)
+        os.makedirs(os.path.dirname(INGEST_CLEANUP_MARKER_PATH) or ".", exist_ok=True)
+        temp_path = INGEST_CLEANUP_MARKER_PATH + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(sorted(markers), file, ensure_ascii=False)
+        os.replace(temp_path, INGEST_CLEANUP_MARKER_PATH)
+
+
+_STAGE_DONE = object()
+
+
+def _put_or_stop(stage_queue, item, stop_event):
+    # 队列满时阻塞（背压），下游退出后不再等待
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def run_stage(iterable, maxsize=INGEST_QUEUE_SIZE):
+    """
+    在后台线程中消费 iterable，通过有界队列把结果交给当前线程，让流水线的各阶段并行执行。
+    后台线程的异常会在当前线程重新抛出；当前线程提前停止消费（关闭生成器）时，后台线程随之退出并关闭 iterable。
+    """
+    stage_queue = queue.Queue(maxsize=maxsize)
+    stop_event = threading.Event()
+
+    def worker():
+        try:
+            for item in iterable:
+                if not _put_or_stop(stage_queue, (None, item), stop_event):
+                    return
+        except BaseException as e:
+            _put_or_stop(stage_queue, (e, None), stop_event)
+            return
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+        _put_or_stop(stage_queue, (_STAGE_DONE, None), stop_event)
+
+    threading.Thread(target=worker, daemon=True).start()
+    try:
+        while True:
+            error, item = stage_queue.get()
+            if error is _STAGE_DONE:
+                return
+            if error is not None:
+                raise error
+            yield item
+    finally:
+        stop_event.set()
+
+
+def iter_batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest_file(qdrant, collection_name, file_processor_helper, batch_size=INGEST_BATCH_SIZE, wait=QDRANT_UPSERT_WAIT,
+                doc_id=None):
+    """
+    有界的流式入库流水线：提取 -> 切分 -> 向量化 -> 插入节点。
+    页面以生成器逐页流过各阶段，阶段之间是有界队列，后面的页面还在解析时前面的批次已经开始插入；
+    峰值内存只与 batch_size、队列长度相关，与文档大小无关。
+    节点 id 由 (doc_id 或集合名, chunk 序号) 确定，重试的批次会覆盖写入而不会重复。
+    :param doc_id: 共享集合模式下文档的 doc_id，会写入每个节点的 payload
+    :return: 插入的节点数
+    """
+    start_time = time.time()
+    gpt = AssistantGPT.shared()
+
+    def embed(batches):
+        with closing(batches):
+            for batch in batches:
+                with tracing.span("embed"):
+                    # 入库是批量任务，限流时让交互式对话优先
+                    embeddings = gpt.get_embeddings([doc.page_content for doc in batch], priority=PRIORITY_BULK)
+                yield batch, embeddings
+
+    # 阶段 1：提取、切分并按批次打包；阶段 2：向量化
+    docs = file_processor_helper.iter_split_docs(file_processor_helper.iter_file_docs())
+    embedded_batches = run_stage(embed(run_stage(iter_batches(docs, batch_size))))
+
+    # 阶段 3：插入节点
+    points_count = 0
+    upsert_seconds = 0.0
+    with closing(embedded_batches):
+        for batch, embeddings in embedded_batches:
+            chunk_indexes = range(points_count, points_count + len(batch))
+            texts = [doc.page_content for doc in batch]
+            metadatas = [doc.metadata for doc in batch]
+            payloads = build_payloads(texts, metadatas, chunk_indexes, doc_id)
+            ids = [point_id(doc_id or collection_name, chunk_index) for chunk_index in chunk_indexes]
+            upsert_start = time.time()
+            with tracing.span("upsert"):
+                qdrant.add_points(collection_name, embeddings, payloads, ids=ids, wait=wait)
+            upsert_seconds += time.time() - upsert_start
+            points_count += len(batch)
+            logger.debug(f"流式入库 | collection_name: {collection_name} points: {points_count}")
+
+    if not wait and not qdrant.wait_for_points(collection_name, points_count, doc_id=doc_id):
+        raise RuntimeError(f"入库后节点数不一致 | collection_name: {collection_name}")
+
+    elapsed = time.time() - start_time
+    logger.info(f"入库完成 | collection_name: {collection_name} points: {points_count} "
+                f"耗时: {elapsed:.2f}s 吞吐: {points_count / elapsed if elapsed else 0:.1f} points/s "
+                f"插入吞吐: {points_count / upsert_seconds if upsert_seconds else 0:.1f} points/s")
+    return points_count
+
+
 def upload_files(file_path):
     try:
         # 打印输入参数
@@ -101,23 +300,27 @@ def upload_files(file_path):
         logger.trace(f"文件允许被处理 | file_path: {file_path}")
 
         # 处理文件
-        # 获取文件的更多信息
-        file_name = file_processor.get_file_name()
+        # 获取文件的更多信息，文档句柄在之后的问答中用于定位集合
+        document = file_processor.get_document_handle()
+        document['collection_name'] = resolve_document_collection(Qdrant(), document)
+        file_name = document['file_name']
         file_extension = file_processor.get_file_extension()
-        file_md5 = file_processor.get_file_md5()
+        file_digest = document['digest']
         logger.info(
-            f"文件信息 | file_name: {file_name}, file_extension: {file_extension}, file_md5: {file_md5}")
+            f"文件信息 | file_name: {file_name}, file_extension: {file_extension}, "
+            f"{document['digest_algorithm']}: {file_digest}, collection_name: {document['collection_name']}")
 
         # 文件存入向量数据库
         uploaded_file_path = file_to_vectordb(
-            file_path, file_name, file_extension, file_md5)
+            file_path, file_name, file_extension, file_digest, document['collection_name'])
 
         # 处理成功
         if uploaded_file_path:
             # 处理成功
             return create_result_dict(
                 200, None, {
-                    'uploaded_file_path': uploaded_file_path
+                    'uploaded_file_path': uploaded_file_path,
+                    'document': document,
                 })
         else:
             # 处理失败
@@ -130,88 +333,155 @@ def upload_files(file_path):
         return create_result_dict(500)
 
 
-def build_context(qdrant, collection_names, question_vector, top_n):
+def invalidate_retrieval_cache(collection_name):
+    """集合重新入库后调用，使涉及该集合的检索缓存失效。"""
+    with _collection_generations_lock:
+        _collection_generations[collection_name] = _collection_generations.get(collection_name, 0) + 1
+
+
+def normalize_question(question):
+    # 统一全角/半角并合并空白，让仅有格式差异的相同问题命中同一缓存
+    return " ".join(unicodedata.normalize("NFKC", question).split())
+
+
+async def get_question_vector_async(gpt, user_input, model=EMBEDDING_MODEL):
+    """
+    获取问题向量，优先从一级缓存读取。限流和重试由 rate_limiter 完成，重试用完后抛出异常。
+    :param gpt: AsyncAssistantGPT
+    :return: float32 向量
+    """
+    key = (model, normalize_question(user_input))
+    question_vector = _question_vector_cache.get(key)
+    if question_vector is not None:
+        logger.opt(lazy=True).debug("问题向量缓存命中 | user_input: {}", lambda: truncate(user_input))
+        return question_vector
+
+    with tracing.span("embed_query"):
+        question_vectors = await gpt.get_embeddings([user_input])
+    return _remember_question_vector(key, question_vectors)
+
 
-    # 执行相似度搜索查询并获取 ScoredPoint 对象列表
-    scored_points = []
-    for collection_name in collection_names:
-        scored_points_by_current_collection = qdrant.search(
-            collection_name, question_vector, limit=top_n)
-        scored_points.extend(scored_points_by_current_collection)
+def _remember_question_vector(key, question_vectors):
+    question_vector = question_vectors[0]
+    question_vector.flags.writeable = False  # 缓存中的向量被多个请求共享，禁止修改
+    _question_vector_cache.set(key, question_vector)
+    return question_vector
 
-    # 将 ScoredPoint 对象列表转换为字典列表
-    points = []
-    for scored_point in scored_points:
-        point = {
+
+def _retrieval_cache_key(collection_names, question_vector, top_n):
+    with _collection_generations_lock:
+        collections_key = tuple(sorted(
+            (collection_name, _collection_generations.get(collection_name, 0))
+            for collection_name in set(collection_names)))
+    vector_hash = hashlib.blake2b(
+        np.asarray(question_vector, dtype=np.float32).tobytes(), digest_size=16).hexdigest()
+    return collections_key, vector_hash, top_n
+
+
+def _top_points(scored_points, top_n):
+    # 用有界堆取分数最高的 top_n 个，再转换为字典列表
+    return [
+        {
             "id": scored_point.id,
             "score": scored_point.score,
             "payload": scored_point.payload
         }
-        points.append(point)
+        for scored_point in heapq.nlargest(top_n, scored_points, key=lambda point: point.score)
+    ]
 
-    # 字典列表按分数降序排序
-    points.sort(key=lambda x: x['score'], reverse=True)
-    points = points[:top_n]
-    logger.trace(f"points: {points}")
 
-    # 构建上下文
-    contexts = []
-    for point in points:
-        context = point['payload']['page_content']
-        # metadata = point['payload']['metadata']
-        contexts.append(context)
-    context = "\n---\n".join(contexts)
+async def search_points_async(qdrant, collection_names, question_vector, top_n):
+    """
+    在多个集合中检索，返回按分数降序的前 top_n 个 point 字典，结果经过二级缓存。
+    :param qdrant: AsyncQdrant
+    """
+    key = _retrieval_cache_key(collection_names, question_vector, top_n)
+    points = _retrieval_cache.get(key)
+    if points is not None:
+        logger.opt(lazy=True).debug("检索结果缓存命中 | collection_names: {} top_n: {}",
+                                    lambda: truncate(collection_names), lambda: top_n)
+        return points
+
+    start = time.perf_counter()
+    with tracing.span("search"):
+        if QDRANT_STORAGE_MODE == 'shared':
+            scored_points = await qdrant.search(
+                QDRANT_SHARED_COLLECTION, question_vector, limit=top_n, doc_ids=collection_names)
+        else:
+            scored_points = await qdrant.search_collections(collection_names, question_vector, limit=top_n)
+    logger.debug("检索耗时 | collections: {} 耗时: {:.1f}ms", len(collection_names), (time.perf_counter() - start) * 1000)
 
-    return context
+    points = _top_points(scored_points, top_n)
+    _retrieval_cache.set(key, points)
+    return points
 
-# 构建文档问答 prompt
-def build_chat_document_prompt(file_paths, user_input, chat_history, top_n):
-    try:
-        # 打印参数
-        logger.debug(
-            f"file_paths: {file_paths}, user_input: {user_input}, chat_history: {chat_history}, top_n: {top_n}")
-
-        # qdrant 参数
-        qdrant = Qdrant()
-
-        # collection_names 参数
-        collection_names = []
-        for file_path in file_paths:
-            file_bytes = FileProcessor.get_file_bytes(file_path)
-            file_md5 = FileProcessor.calculate_md5(file_bytes)
-            collection_names.append(file_md5)
-        logger.debug(f"collection_names: {collection_names}")
-
-        # question_vector 参数
-        gpt = AssistantGPT()
-        question_vectors = retry(gpt.get_embeddings, args=([user_input]))
-        if not question_vectors:
-            logger.error("获取 question_vector 参数失败")
-            return ''
-        question_vector = question_vectors[0]
 
-        # context
-        top_n = int(top_n)
-        context = build_context(
-            qdrant,
-            collection_names,
-            question_vector,
-            top_n)
-        logger.trace(f"context: \n{context}")
-
-        # chat_history_str
-        chat_history_str = ""
-        for chat in chat_history[:-1]:
-            # 检查是否是用户消息
-            if chat[0]:
-                chat_history_str += f'user:{chat[0]}\n'
-            if chat[1]:
-                chat_history_str += f'assistant:{chat[1]}\n'
-        chat_history_str = chat_history_str[:-1]  # 去掉最后一个'\n'
-        logger.trace(f"chat_history_str: \n{chat_history_str}")
-
-        # 构建 prompt
-        prompt = f"""你是一位文档问答助手，你会基于`文档内容`和`对话历史`回答user的问题。如果用户的问题与`文档内容`无关，就不用强行根据`文档内容`回答。
+def is_document_ingested(qdrant, collection_name):
+    # 共享集合模式下 collection_name 就是文档的 doc_id
+    if QDRANT_STORAGE_MODE == 'shared':
+        return qdrant.has_collection(QDRANT_SHARED_COLLECTION) \
+            and qdrant.get_document_points_count(QDRANT_SHARED_COLLECTION, collection_name) > 0
+    return qdrant.has_points(collection_name)
+
+
+def resolve_document_collection(qdrant, document):
+    """
+    确定文档句柄使用的集合名：如果以 MD5 命名的旧集合已经入库，继续使用旧集合，无需重新向量化。
+    上传入库（同步）时使用，问答时使用 resolve_document_collection_async。
+    """
+    legacy_collection_name = document.get('legacy_collection_name')
+    if legacy_collection_name and not is_document_ingested(qdrant, document['collection_name']) \
+            and is_document_ingested(qdrant, legacy_collection_name):
+        logger.info(f"使用以 MD5 命名的已有集合 | collection_name: {legacy_collection_name}")
+        return legacy_collection_name
+    return document['collection_name']
+
+
+async def is_document_ingested_async(qdrant, collection_name):
+    if QDRANT_STORAGE_MODE == 'shared':
+        return await qdrant.get_document_points_count(QDRANT_SHARED_COLLECTION, collection_name) > 0
+    return await qdrant.has_points(collection_name)
+
+
+async def resolve_document_collection_async(qdrant, document):
+    legacy_collection_name = document.get('legacy_collection_name')
+    if legacy_collection_name and not await is_document_ingested_async(qdrant, document['collection_name']) \
+            and await is_document_ingested_async(qdrant, legacy_collection_name):
+        logger.info(f"使用以 MD5 命名的已有集合 | collection_name: {legacy_collection_name}")
+        return legacy_collection_name
+    return document['collection_name']
+
+
+async def resolve_collection_names_async(qdrant, documents):
+    """
+    解析文档对应的集合名。
+    :param documents: 上传时得到的文档句柄（dict），或只有文件路径（str）；只有路径时，读取和哈希文件放到线程中执行
+    :return: 集合名列表
+    """
+    collection_names = []
+    for document in documents:
+        if not isinstance(document, dict):
+            document = await asyncio.to_thread(FileProcessor(document).get_document_handle)
+            document['collection_name'] = await resolve_document_collection_async(qdrant, document)
+        collection_names.append(document['collection_name'])
+    return collection_names
+
+
+def pack_document_prompt(points, user_input, chat_history, model, max_tokens, conversation=None):
+    """
+    在模型的 token 预算内选择检索结果和对话历史，见 context_packer。
+    :param conversation: 会话的 ConversationState；未提供时由 chat_history 临时构建
+    :return: (context, chat_history_str, prompt_tokens)
+    """
+    with tracing.span("pack"):
+        if conversation is None:
+            conversation = ConversationState.from_chat_history(chat_history[:-1], model)
+        fixed_tokens = FileProcessorHelper.tiktoken_len(render_document_prompt("", "", user_input), model)
+        return pack_prompt_parts(points, conversation, model, max_tokens, fixed_tokens)
+
+
+def render_document_prompt(context, chat_history_str, user_input):
+    return f"""你是一位文档问答助手，你会基于`文档内容`和`对话历史`回答user的问题。如果用户的问题与`文档内容`无关，就不用强行根据`文档内容`回答。
 
 文档内容：```
 {context}```
@@ -221,42 +491,63 @@ def build_chat_document_prompt(file_paths, user_input, chat_history, top_n):
 
 user: ```{user_input}```
 assistant: """
-        logger.info(f"prompt: \n{prompt}")
-        return prompt
+
+
+# 构建文档问答 prompt，返回 (prompt, prompt 的 token 数)，失败时返回 ('', 0)；等待 embedding 和 Qdrant 响应时不占用线程
+# Qdrant 或 embedding 接口不可用（断路器断开，或连接错误、超时、5xx）时抛出 DependencyUnavailable，
+# 预算放不下任何文档内容时抛出 PromptBudgetError；只有其他错误才返回 ('', 0)
+async def build_chat_document_prompt_async(documents, user_input, chat_history, top_n,
+                                           model=DEFAULT_MODEL, max_tokens=DEFAULT_MAX_TOKENS, conversation=None):
+    try:
+        logger.debug("documents: {}, chat_history: {} 轮, top_n: {}", len(documents), len(chat_history), top_n)
+        log_payload("TRACE", "user_input", lambda: user_input)
+
+        qdrant = AsyncQdrant()
+
+        collection_names = await resolve_collection_names_async(qdrant, documents)
+        logger.opt(lazy=True).debug("collection_names: {}", lambda: truncate(collection_names))
+
+        gpt = AsyncAssistantGPT.shared()
+        question_vector = await get_question_vector_async(gpt, user_input)
+
+        top_n = int(top_n)
+        points = await search_points_async(qdrant, collection_names, question_vector, top_n)
+        log_payload("TRACE", "points", lambda: points)
+
+        context, chat_history_str, prompt_tokens = pack_document_prompt(
+            points, user_input, chat_history, model, max_tokens, conversation)
+        log_payload("TRACE", "context", lambda: context)
+        log_payload("TRACE", "chat_history_str", lambda: chat_history_str)
+
+        prompt = render_document_prompt(context, chat_history_str, user_input)
+        log_payload("DEBUG", "prompt", lambda: prompt)
+        return prompt, prompt_tokens
+    except (CircuitOpenError, PromptBudgetError):
+        # 依赖的断路器已断开或预算不足，交给调用方处理
+        raise
     except Exception as e:
+        dependency = _failed_dependency(e)
+        if dependency is not None:
+            # 断路器断开之前的依赖故障同样交给调用方降级
+            logger.warning(f"{dependency} 请求失败 | {type(e).__name__}: {e}")
+            raise DependencyUnavailable(dependency) from e
         error_str = traceback.format_exc()
         logger.error(error_str)
-        return ''
+        return '', 0
 
 
-def retry(func, args=None, kwargs=None, retries=3, delay=1):
+def _failed_dependency(error):
     """
-    重试机制函数
-    :param func: 需要重试的函数
-    :param args: 函数参数，以元组形式传入
-    :param kwargs: 函数关键字参数，以字典形式传入
-    :param retries: 重试次数，默认为3
-    :param delay: 重试间隔时间，默认为1秒
-    :return: 函数执行结果
+    :return: 错误是依赖故障时返回依赖名称（"Qdrant" 或 "OpenAI"），否则返回 None
     """
-    for i in range(retries):
-        try:
-            if args is None and kwargs is None:
-                result = func()
-            elif args is not None and kwargs is None:
-                result = func(*args)
-            elif args is None and kwargs is not None:
-                result = func(**kwargs)
-            else:
-                result = func(*args, **kwargs)
-            return result  # 如果函数执行成功，返回结果
-        except Exception as e:
-            logger.warning(f"{func.__name__}函数第{i + 1}次重试：{e}")
-            time.sleep(delay)
-    logger.error(f"{func.__name__}函数重试次数已用完")
+    if is_qdrant_error(error):
+        return "Qdrant" if is_qdrant_failure(error) else None
+    if is_openai_failure(error):
+        return "OpenAI"
+    return None
 
 
-def build_payloads(texts, metadatas):
+def build_payloads(texts, metadatas, chunk_indexes=None, doc_id=None):
     payloads = [
         {
             "page_content": text,
@@ -264,4 +555,10 @@ def build_payloads(texts, metadatas):
         }
         for text, metadata in zip(texts, metadatas)
     ]
+    if chunk_indexes is not None:
+        for payload, chunk_index in zip(payloads, chunk_indexes):
+            payload["chunk_index"] = chunk_index
+    if doc_id is not None:
+        for payload in payloads:
+            payload["doc_id"] = doc_id
     return payloads